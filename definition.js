@@ -546,12 +546,8 @@ Blockly.Python['rover_show_rgb_led_array'] = function (block) {
   var value_color_5 = Blockly.Python.valueToCode(block, 'color5', Blockly.Python.ORDER_ATOMIC);
   var value_color_6 = Blockly.Python.valueToCode(block, 'color6', Blockly.Python.ORDER_ATOMIC);
   // TODO: Assemble Python into code variable.
-  var code = 'rover.show_rgb_led(1, hex_to_rgb(' + value_color_1 + '))\n';
-  code = code + 'rover.show_rgb_led(2, hex_to_rgb(' + value_color_2 + '))\n';
-  code = code + 'rover.show_rgb_led(3, hex_to_rgb(' + value_color_3 + '))\n';
-  code = code + 'rover.show_rgb_led(4, hex_to_rgb(' + value_color_4 + '))\n';
-  code = code + 'rover.show_rgb_led(5, hex_to_rgb(' + value_color_5 + '))\n';
-  code = code + 'rover.show_rgb_led(6, hex_to_rgb(' + value_color_6 + '))\n';
+  var code = 'rover.show_rgb_leds((hex_to_rgb(' + value_color_1 + '), hex_to_rgb(' + value_color_2 + '), hex_to_rgb(' + value_color_3 + '), ' +
+    'hex_to_rgb(' + value_color_4 + '), hex_to_rgb(' + value_color_5 + '), hex_to_rgb(' + value_color_6 + ')))\n';
   return code;
 };
 
@@ -1,10 +1,15 @@
 # This file is executed on every boot (including wake-boot from deepsleep)
 import gc
 import time
+import uasyncio as asyncio
 from yolobit import *
 import music
 from rover import *
 from rover_ir import *
+import rover_led
+import rover_ble
+from rover_events import EventBus
+import rover_instr
 
 rover.stop()
 stop_all()
@@ -18,6 +23,18 @@ music.play(music.POWER_UP, wait=False)
 
 print('Rover started and ready')
 
+# set to True to time the driving/sensor calls, IR SETUP key prints the results
+INSTRUMENT = False
+if INSTRUMENT:
+    rover_instr.enable(rover)
+
+# GPIO wired to the INT pin of the MPU6050 (e.g. pin5.pin) to stop on bumps, None without
+BUMP_PIN = None
+
+# status overlays, precomputed so playing them does not allocate
+STATUS_BLE_CONNECTED = rover_led.blink(hex_to_rgb('#00ff00'), 3, 3)
+STATUS_BLE_DISCONNECTED = rover_led.blink(hex_to_rgb('#ff0000'), 3, 3)
+
 ROBOT_MODE_DO_NOTHING = const(31)
 ROBOT_MODE_AVOID_OBS = const(32)
 ROBOT_MODE_FOLLOW = const(33)
@@ -37,75 +54,82 @@ mode_changed = False
 current_speed = 100
 key = KEY_NONE
 ble_connected = False
+obs_distance = 200
+bumped = False
+
+
+# All inputs only post events, the mode loop handles them.
+bus = EventBus()
+
+EV_BUTTON_A = const(1)
+EV_MODE = const(2)
+EV_KEY = const(3)
+EV_SPEED = const(4)
+EV_SERVO1 = const(5)
+EV_SERVO2 = const(6)
+EV_BLE_DRIVE = const(7)
+EV_BLE_CONNECTED = const(8)
+EV_DUMP_STATS = const(9)
+EV_BUMP = const(10)
+
+# an IR key keeps the robot moving while the remote repeats it
+KEY_HOLD_MS = const(150)
+
+LINE_SPEED = const(30)
+
+IR_KEYMAP = {
+    IR_REMOTE_A: (EV_MODE, ROBOT_MODE_DO_NOTHING),
+    IR_REMOTE_B: (EV_MODE, ROBOT_MODE_AVOID_OBS),
+    IR_REMOTE_C: (EV_MODE, ROBOT_MODE_FOLLOW),
+    IR_REMOTE_D: (EV_MODE, ROBOT_MODE_LINE_FINDER),
+    IR_REMOTE_E: (EV_KEY, KEY_S1_CLOSE),
+    IR_REMOTE_F: (EV_KEY, KEY_S1_OPEN),
+    IR_REMOTE_UP: (EV_KEY, KEY_UP),
+    IR_REMOTE_DOWN: (EV_KEY, KEY_DOWN),
+    IR_REMOTE_LEFT: (EV_KEY, KEY_LEFT),
+    IR_REMOTE_RIGHT: (EV_KEY, KEY_RIGHT),
+    IR_REMOTE_1: (EV_SPEED, 20),
+    IR_REMOTE_2: (EV_SPEED, 25),
+    IR_REMOTE_3: (EV_SPEED, 30),
+    IR_REMOTE_4: (EV_SPEED, 40),
+    IR_REMOTE_5: (EV_SPEED, 50),
+    IR_REMOTE_6: (EV_SPEED, 60),
+    IR_REMOTE_7: (EV_SPEED, 70),
+    IR_REMOTE_8: (EV_SPEED, 80),
+    IR_REMOTE_9: (EV_SPEED, 100),
+    IR_REMOTE_SETUP: (EV_DUMP_STATS, 0),
+}
+
+# app gamepad messages, any other string (button released) stops
+BLE_KEYMAP = {
+    '!B516': (EV_BLE_DRIVE, KEY_UP),
+    '!B615': (EV_BLE_DRIVE, KEY_DOWN),
+    '!B714': (EV_BLE_DRIVE, KEY_LEFT),
+    '!B814': (EV_BLE_DRIVE, KEY_RIGHT),
+    '!B11:': (EV_SERVO1, 0),   # A
+    '!B219': (EV_SERVO2, 90),  # B
+    '!B318': (EV_SERVO2, 0),   # C
+    '!B417': (EV_SERVO1, 90),  # D
+}
+BLE_STOP = (EV_BLE_DRIVE, KEY_NONE)
+
+NEXT_MODE = {
+    ROBOT_MODE_DO_NOTHING: ROBOT_MODE_AVOID_OBS,
+    ROBOT_MODE_AVOID_OBS: ROBOT_MODE_FOLLOW,
+    ROBOT_MODE_FOLLOW: ROBOT_MODE_LINE_FINDER,
+    ROBOT_MODE_LINE_FINDER: ROBOT_MODE_DO_NOTHING,
+}
 
 
 def on_button_a_pressed():
-    global mode, mode_changed
-    music.play(['G3:1'], wait=True)
-    if mode == ROBOT_MODE_DO_NOTHING:
-        mode = ROBOT_MODE_AVOID_OBS
-    elif mode == ROBOT_MODE_AVOID_OBS:
-        mode = ROBOT_MODE_FOLLOW
-    elif mode == ROBOT_MODE_FOLLOW:
-        mode = ROBOT_MODE_LINE_FINDER
-    elif mode == ROBOT_MODE_LINE_FINDER:
-        mode = ROBOT_MODE_DO_NOTHING
-
-    mode_changed = True
-    time.sleep_ms(100)
-    print('mode changed by button')
+    bus.post(EV_BUTTON_A)
 
 
 button_a.on_pressed = on_button_a_pressed
 
 
 def ir_callback(cmd, addr, ext):
-    global mode, mode_changed, current_speed, key
-    if cmd == IR_REMOTE_A:
-        mode = ROBOT_MODE_DO_NOTHING
-        mode_changed = True
-    elif cmd == IR_REMOTE_B:
-        mode = ROBOT_MODE_AVOID_OBS
-        mode_changed = True
-    elif cmd == IR_REMOTE_C:
-        mode = ROBOT_MODE_FOLLOW
-        mode_changed = True
-    elif cmd == IR_REMOTE_D:
-        mode = ROBOT_MODE_LINE_FINDER
-        mode_changed = True
-    elif cmd == IR_REMOTE_E:
-        key = KEY_S1_CLOSE
-    elif cmd == IR_REMOTE_F:
-        key = KEY_S1_OPEN
-    elif cmd == IR_REMOTE_UP:
-        key = KEY_UP
-    elif cmd == IR_REMOTE_DOWN:
-        key = KEY_DOWN
-    elif cmd == IR_REMOTE_LEFT:
-        key = KEY_LEFT
-    elif cmd == IR_REMOTE_RIGHT:
-        key = KEY_RIGHT
-    elif cmd == IR_REMOTE_1:
-        current_speed = 20
-    elif cmd == IR_REMOTE_2:
-        current_speed = 25
-    elif cmd == IR_REMOTE_3:
-        current_speed = 30
-    elif cmd == IR_REMOTE_4:
-        current_speed = 40
-    elif cmd == IR_REMOTE_5:
-        current_speed = 50
-    elif cmd == IR_REMOTE_6:
-        current_speed = 60
-    elif cmd == IR_REMOTE_7:
-        current_speed = 70
-    elif cmd == IR_REMOTE_8:
-        current_speed = 80
-    elif cmd == IR_REMOTE_9:
-        current_speed = 100
-
-    if mode_changed:
-        print('mode changed by IR remote')
+    bus.post_mapped(IR_KEYMAP, cmd)
 
 
 rover_ir_rx.on_received(ir_callback)
@@ -113,82 +137,187 @@ rover_ir_rx.start()
 
 
 def on_ble_connected_callback():
-  global ble_connected
-  display.set_all('#00ff00')
-  ble_connected = True
+  bus.post(EV_BLE_CONNECTED, 1)
 
 
 ble.on_connected(on_ble_connected_callback)
 
 
 def on_ble_disconnected_callback():
-  global ble_connected
-  display.set_all('#ff0000')
-  ble_connected = False
+  bus.post(EV_BLE_CONNECTED, 0)
 
 
 ble.on_disconnected(on_ble_disconnected_callback)
 
 
+def on_ble_mode(new_mode):
+  bus.post(EV_MODE, new_mode)
+
+
+# drive commands from the app are coalesced and applied by ble_control.run()
+ble_control = rover_ble.ControlDispatcher(rover, on_mode=on_ble_mode)
+
+
 def on_ble_message_string_receive_callback(chu_E1_BB_97i):
-  global mode, mode_changed
-  if chu_E1_BB_97i == ('!B516'):
-    rover.forward(50)
-  elif chu_E1_BB_97i == ('!B615'):
-    rover.backward(50)
-  elif chu_E1_BB_97i == ('!B714'):
-    rover.turn_left(50)
-  elif chu_E1_BB_97i == ('!B814'):
-    rover.turn_right(50)
-  elif chu_E1_BB_97i == ('!B11:'):  # A
-    rover.servo_write(1, 0)
-  elif chu_E1_BB_97i == ('!B219'):  # B
-    rover.servo_write(2, 90)
-  elif chu_E1_BB_97i == ('!B318'):  # C
-    rover.servo_write(2, 0)
-  elif chu_E1_BB_97i == ('!B417'):  # D
-    rover.servo_write(1, 90)
+  if rover_ble.is_frame(chu_E1_BB_97i):
+    ble_control.feed(chu_E1_BB_97i)
   else:
-    rover.stop()
-
-  if mode_changed:
-    print('mode changed by app')
+    bus.post_mapped(BLE_KEYMAP, chu_E1_BB_97i, BLE_STOP)
 
 
 ble.on_receive_msg("string", on_ble_message_string_receive_callback)
 
 def on_ble_message_name_value_receive_callback(name, value):
-        global current_speed, key, ble_key_received
-
         if name == 'F':
-            rover.forward(value)
+            ble_control.set_drive(value, value)
         elif name == 'B':
-            rover.backward(value)
+            ble_control.set_drive(-value, -value)
         elif name == 'L':
-            rover.turn_left(value/1.5)
+            ble_control.set_drive(-value/1.5, value/1.5)
         elif name == 'R':
-            rover.turn_right(value/1.5)
-        if name == 'FL':
-            rover.move(4, value/1.5)
+            ble_control.set_drive(value/1.5, -value/1.5)
+        elif name == 'FL':
+            ble_control.set_drive(value/3, value/1.5)
         elif name == 'BL':
-            rover.move(6, value/1.5)
+            ble_control.set_drive(-value/3, -value/1.5)
         elif name == 'FR':
-            rover.move(2, value/1.5)
+            ble_control.set_drive(value/1.5, value/3)
         elif name == 'BR':
-            rover.move(8, value/1.5)
+            ble_control.set_drive(-value/1.5, -value/3)
         elif name == 'S':
-            current_speed = 80
-            rover.stop()
+            bus.post(EV_SPEED, 80)
+            ble_control.set_drive(0, 0)
         elif name == 'S1':
-            rover.servo_write(1, value)
+            bus.post(EV_SERVO1, int(value))
         elif name == 'S2':
-            rover.servo_write(2, value)
+            bus.post(EV_SERVO2, int(value))
 
 ble.on_receive_msg("name_value", on_ble_message_name_value_receive_callback)
 
-try:
+
+def on_bump_callback():
+    bus.post(EV_BUMP)
+
+
+# the wheels stop from the IRQ, the avoid mode then backs up
+if BUMP_PIN != None:
+    rover.start_bump_detection(BUMP_PIN, on_bump=on_bump_callback)
+
+# heading, distance, wheel speeds and line bits streamed to the app while connected
+ble_telemetry = rover_ble.TelemetryStreamer(rover, ble.send)
+ble_telemetry.enabled = False
+
+
+# event handlers, run from the mode loop
+
+def on_button_a(value):
+    global mode, mode_changed
+    music.play(['G3:1'], wait=True)
+    mode = NEXT_MODE[mode]
+    mode_changed = True
+    print('mode changed by button')
+
+def on_mode(value):
+    global mode, mode_changed
+    if value in NEXT_MODE:
+        mode = value
+        mode_changed = True
+        print('mode changed')
+
+def on_key(value):
+    global key
+    key = value
+
+def on_speed(value):
+    global current_speed
+    current_speed = value
+
+def on_servo1(value):
+    rover.servo_write(1, value)
+
+def on_servo2(value):
+    rover.servo_write(2, value)
+
+def on_ble_drive(value):
+    if value == KEY_UP:
+        rover.forward(50)
+    elif value == KEY_DOWN:
+        rover.backward(50)
+    elif value == KEY_LEFT:
+        rover.turn_left(50)
+    elif value == KEY_RIGHT:
+        rover.turn_right(50)
+    else:
+        rover.stop()
+
+def on_ble_connected(value):
+    global ble_connected
+    ble_connected = value == 1
+    ble_telemetry.enabled = ble_connected
+    # the streamer sends angleZ as stored: keep the heading current while connected
+    if rover.motion:
+        if ble_connected:
+            rover.motion.start_background()
+        else:
+            rover.motion.stop_background()
+    if ble_connected:
+        display.set_all('#00ff00')
+        rover.play_led_animation(STATUS_BLE_CONNECTED, rover_led.LAYER_STATUS, 3)
+    else:
+        display.set_all('#ff0000')
+        rover.play_led_animation(STATUS_BLE_DISCONNECTED, rover_led.LAYER_STATUS, 3)
+
+def on_dump_stats(value):
+    rover_instr.dump()
+
+def on_bump(value):
+    global bumped
+    bumped = True
+
+EVENT_HANDLERS = {
+    EV_BUTTON_A: on_button_a,
+    EV_MODE: on_mode,
+    EV_KEY: on_key,
+    EV_SPEED: on_speed,
+    EV_SERVO1: on_servo1,
+    EV_SERVO2: on_servo2,
+    EV_BLE_DRIVE: on_ble_drive,
+    EV_BLE_CONNECTED: on_ble_connected,
+    EV_DUMP_STATS: on_dump_stats,
+    EV_BUMP: on_bump,
+}
+
+def handle_events():
+    while True:
+        event = bus.get()
+        if event == None:
+            return
+        EVENT_HANDLERS[event[0]](event[1])
+
+
+# The mode loop and the distance sampling run as concurrent uasyncio tasks,
+# so the robot keeps ranging while a timed motion is in progress.
+async def distance_loop():
+    global obs_distance
+    while True:
+        # also ranging for the distance streamed by ble_telemetry
+        if mode == ROBOT_MODE_AVOID_OBS or mode == ROBOT_MODE_FOLLOW or ble_telemetry.enabled:
+            obs_distance = rover.ultrasonic.distance_cm()
+        await asyncio.sleep_ms(50)
+
+
+async def mode_loop():
+    global mode_changed, key, bumped
+    line_task_started = False
+    loop_probe = rover_instr.probe('mode_loop')
     while True :
+        loop_probe.end()
+        loop_probe.begin()
+        handle_events()
         if mode_changed:
+            rover.stop()
+            line_task_started = False
+            bumped = False
             if mode == ROBOT_MODE_DO_NOTHING:
                 rover.show_rgb_led(0, hex_to_rgb('#ff0000'))
                 key = KEY_NONE
@@ -203,7 +332,7 @@ try:
         if mode == ROBOT_MODE_DO_NOTHING:
             if ble_connected:
               # do nothing and wait for commands from bluetooth
-              time.sleep_ms(500)
+              await bus.wait()
             else:
                 if key != KEY_NONE:
                     if key == KEY_UP:
@@ -226,21 +355,23 @@ try:
                         rover.servo_write(1, 90)
 
                     key = KEY_NONE
+                    # keep going until the remote stops repeating the key
+                    if not await bus.wait(KEY_HOLD_MS):
+                        rover.stop()
                 else:
                     rover.stop()
-                rover_ir_rx.clear_code()
-                time.sleep_ms(100)
+                    await bus.wait()
 
         elif mode == ROBOT_MODE_AVOID_OBS:
-            if rover.ultrasonic.distance_cm() < 15:
-              rover.backward(50, 0.5)
-              rover.turn_right(50, 0.25)
+            if obs_distance < 15 or bumped:
+              bumped = False
+              await rover.backward_async(50, 0.5)
+              await rover.turn_right_async(50, 0.25)
             else:
               rover.forward(50)
-        
+              await bus.wait(20)
+    
         elif mode == ROBOT_MODE_FOLLOW:
-            obs_distance = rover.ultrasonic.distance_cm()
-
             if obs_distance < 15:
                 rover.backward(50)
             elif obs_distance < 30:
@@ -249,33 +380,40 @@ try:
                 rover.forward(50)
             else:
                 rover.stop()
-            time.sleep_ms(50)
+            await bus.wait(50)
 
         elif mode == ROBOT_MODE_LINE_FINDER:
-            if rover.read_line_sensors() == (1, 0, 0, 0):
-              rover.turn_left(50)
-            elif rover.read_line_sensors() == (1, 1, 0, 0):
-              rover.turn_left(30)
-            elif rover.read_line_sensors() == (0, 0, 0, 1):
-              rover.turn_right(50)
-            elif rover.read_line_sensors() == (0, 0, 1, 1):
-              rover.turn_right(30)
-            elif rover.read_line_sensors() == (0, 0, 0, 0):
-              # while not ((rover.read_line_sensors(0)) or (rover.read_line_sensors(1)) or (rover.read_line_sensors(2)) or (rover.read_line_sensors(3))):
-              rover.backward(20)
-            else:
-              rover.forward(25)
-            
+            # the line follower runs as its own task until the next driving command
+            if not line_task_started:
+                asyncio.create_task(rover.follow_line_async(LINE_SPEED))
+                line_task_started = True
+            await bus.wait()
+
+
+async def main():
+    asyncio.create_task(distance_loop())
+    asyncio.create_task(ble_control.run())
+    asyncio.create_task(ble_telemetry.run())
+    await mode_loop()
+
+
+try:
+    asyncio.run(main())
 except KeyboardInterrupt:
     print('Rover program stopped')
 finally:
     rover.stop()
+    rover.stop_bump_detection()
+    if rover.motion:
+        rover.motion.stop_background()
+    rover.stop_led_animation()
     button_a.on_pressed = None
     rover_ir_rx.on_received(None)
     rover_ir_rx.stop()
     ble.on_receive_msg("string", None)
+    ble.on_receive_msg("name_value", None)
     ble.on_connected(None)
     ble.on_disconnected(None)
-    del mode, mode_changed, current_speed, ble_connected, key, on_ble_message_string_receive_callback, on_ble_connected_callback, on_ble_disconnected_callback, on_button_a_pressed
+    del mode, mode_changed, current_speed, ble_connected, key, obs_distance, bumped, on_bump_callback, on_ble_message_string_receive_callback, on_ble_connected_callback, on_ble_disconnected_callback, on_button_a_pressed, ble_control, ble_telemetry, bus
     gc.collect()
 
@@ -1,11 +1,18 @@
 from yolobit import *
 import machine, neopixel
 from machine import *
-import time
+import time, gc
+from array import array
+from micropython import const, schedule
+import uasyncio as asyncio
 from utility import *
+import rover_i2c
+import rover_led
 import rover_pcf8574
 import rover_motion
 import rover_hcsr04
+from rover_pid import PID
+from rover_telemetry import TAG_TURN, TAG_STRAIGHT, TAG_LINE
 from rover_ir import *
 
 # IR receiver
@@ -14,6 +21,41 @@ rover_ir_rx = IR_RX(Pin(pin4.pin, Pin.IN))
 # MPU check connection
 mpu_detected = True
 
+_PCF8574_ADDR = const(0x23)
+_MPU6050_ADDR = const(0x68)
+
+_RAMP_TIMER_ID = const(1) # Timer(2) is used by the heading sampler, Timer(3) by the IR receiver
+_RAMP_JUMP = const(30) # largest wheel speed change applied at once, larger changes are ramped
+
+# Line position for each state of the 4 line sensors (bit 0 = leftmost sensor),
+# in hundredths from -150 (line under the left sensor) to 150 (right sensor).
+# Looked up from the port value, so the follow loop does no division.
+_LINE_LOST = const(-32768) # no sensor sees the line
+_LINE_OFF_POS = const(200) # position used while lost, on the side the line was last seen
+_LINE_WEIGHTS = (-150, -50, 50, 150)
+
+def _line_position_table():
+    table = array('h', (_LINE_LOST for _ in range(16)))
+    for state in range(1, 16):
+        total = 0
+        n = 0
+        for i in range(4):
+            if state & (1 << i):
+                total += _LINE_WEIGHTS[i]
+                n += 1
+        table[state] = int(total / n)
+    return table
+
+_LINE_POS = _line_position_table()
+
+def _duty_table(scale, min_duty):
+    # PWM duty for speed 0..100. min_duty: duty below which the motor does not
+    # turn (speed 1 starts there), scale: gain of the wheel to match the other one
+    table = array('H', (0 for _ in range(101)))
+    for speed in range(1, 101):
+        table[speed] = min(1023, int(min_duty + (1023 - min_duty) * speed * scale / 100))
+    return table
+
 class Rover():
 
     def __init__(self):
@@ -30,25 +72,54 @@ class Rover():
 
         self.m1_speed = 0
         self.m2_speed = 0
+
+        # speed to duty lookup per wheel, and the duties last written (unchanged ones are skipped)
+        self._pwm = (self.ina1, self.ina2, self.inb1, self.inb2)
+        self._duty = array('H', (0, 0, 0, 0))
+        self.set_motor_trim()
+
+        # heading hold for straight driving, output is the wheel speed difference / 2
+        self._heading_pid = PID(3.0, 1.0, 0.2, -30, 30, 0.5)
+        self.straight_loop_hz = 0
+
+        # line following: steering output is the wheel speed difference / 2
+        self._line_pid = PID(0.25, 0.0, 0.004, -60, 60, 0.5)
+        self._line_side = -1 # side the line was last seen on, -1 left, 1 right
+        self.__reset_line_stats()
+
+        # telemetry recorder (rover_telemetry.Telemetry) fed by the driving loops, None = off
+        self.telemetry = None
+
+        # collision stop from the MPU6050 motion interrupt (see start_bump_detection)
+        self.bumps = 0
+        self._bump_stop = False
+        self._on_bump = None
+        self._bump_ref = self._bump
+
+        # id of the motion in progress, bumped by every new driving command
+        self._motion_id = 0
+
+        # soft-start ramp: wheel targets are reached from a timer, set_wheel_speed never blocks
+        self._m1_target = 0
+        self._m2_target = 0
+        self._ramp_timer = None
+        self._ramp_pending = False
+        self._ramp_tick_ref = self._ramp_tick
+        self._ramp_step_ref = self._ramp_step
+        self.set_ramp()
         
+        # shared I2C bus, scanned once. The line sensors are constructed on
+        # first use (see the pcf property), the MPU6050 by calibrate_motion() below.
+        self.i2c = rover_i2c.get_bus()
+        self._pcf = None
+        self._motion = None
+
         # line IR sensors
-        try:
-            self.pcf = rover_pcf8574.PCF8574(
-                machine.SoftI2C(
-                    scl=machine.Pin(22), 
-                    sda=machine.Pin(21)), 0x23)
-        except:
+        if not self.i2c.has(_PCF8574_ADDR):
             say('Line IR sensors not detected')
-            self.pcf = None
         
         # MPU6050
-        try:
-            self.motion = rover_motion.Motion(
-                machine.SoftI2C(
-                    scl=machine.Pin(22), 
-                    sda=machine.Pin(21)), 0x68)
-        except:
-            self.motion = None
+        if not self.i2c.has(_MPU6050_ADDR):
             mpu_detected = False
         
         # ultrasonic
@@ -57,17 +128,70 @@ class Rover():
         # RGB leds
         self._num_leds = 6
         self._rgb_leds = neopixel.NeoPixel(machine.Pin(pin6.pin), self._num_leds)
+        self._led_shadow = bytearray(3 * self._num_leds) # last colours set, unchanged frames are not written
+        self._led_dirty = True
+        # raw buffer of the neopixel driver, written directly when available
+        self._np_buf = getattr(self._rgb_leds, 'buf', None)
+        self._np_bpp = getattr(self._rgb_leds, 'bpp', 3)
+        self._np_order = getattr(self._rgb_leds, 'ORDER', (1, 0, 2, 3))
+        self._indicators = 0 # left/right indicator led bits
+        self.animator = rover_led.LedAnimator(self)
 
         self.show_led(0, 0)
 
         self.stop()
 
+        # at boot the robot stands still: the gyro offsets can be checked now
+        self.calibrate_motion()
+
         if mpu_detected == True:
             say('Rover setup done with MPU6050!')
         else:
             say('Rover setup done!')
    
+    @property
+    def pcf(self):
+        if self._pcf == None and self.i2c.has(_PCF8574_ADDR):
+            try:
+                self._pcf = rover_pcf8574.PCF8574(self.i2c, _PCF8574_ADDR)
+            except OSError:
+                pass
+        return self._pcf
+
+    @property
+    def motion(self):
+        # the MPU6050 (rover_motion.Motion), None without it
+        return self._motion
+
+    def calibrate_motion(self):
+        # Load the saved gyro offsets, full calibration (seconds, saved to flash)
+        # only if missing or drifted. The robot must stand still.
+        # Returns False without MPU6050.
+        global mpu_detected
+        if not mpu_detected:
+            return False
+        try:
+            if self._motion == None:
+                self._motion = rover_motion.Motion(self.i2c, _MPU6050_ADDR)
+            self._motion.warm_start()
+        except OSError:
+            self._motion = None
+            mpu_detected = False
+            return False
+        return True
+
     #------------------------------ROBOT PRIVATE MOVING METHODS--------------------------#
+    # The timed motions are written as generators yielding the number of ms to wait
+    # before the next step, so the blocking methods and the async methods share them.
+
+    def __run_steps(self, steps):
+        # blocking run of a motion, ended early when a callback cancels it (bump stop)
+        motion_id = self._motion_id
+        for ms in steps:
+            if self._motion_id != motion_id:
+                return
+            if ms:
+                time.sleep_ms(ms)
 
     def __go(self, forward=True, speed=None, t=None, straight=False):
 
@@ -79,26 +203,64 @@ class Rover():
         else:
             if forward:
                 #self.stop() stop() isn't work in rover. So we need to test it more...
-                self.set_wheel_speed(speed, speed)
+                self.__drive(speed, speed)
             else:
                 #self.stop()
-                self.set_wheel_speed(-speed, -speed)
+                self.__drive(-speed, -speed)
 
             if t != None :
                 time.sleep(t)
                 self.stop()
     
-    def __calibrate_speed(self, speed, error=0.2, error_rotate=10, speed_factor=3):
-        self.motion.updateZ()
+    def __heading_error(self):
+        # heading drift since motion.begin(), wrapped to -180..180
         z = self.motion.get_angleZ()
         if abs(z) >= 360:
             z = (abs(z) - 360) * z / abs(z)
         if abs(z) > 180:
             z = z - 360 * z / abs(z)
-        if abs(z) > error:
-            if abs(z) > error_rotate:
-                self.set_wheel_speed(30 * z / abs(z), -30 * z / abs(z))
-            self.set_wheel_speed(speed + z * speed_factor, speed - z * speed_factor)
+        return z
+
+    def set_heading_pid(self, kp=3.0, ki=1.0, kd=0.2, limit=30, d_filter=0.5):
+        # tune the heading hold used by forward/backward(straight=True)
+        self._heading_pid.set_gains(kp, ki, kd)
+        self._heading_pid.set_limits(-limit, limit)
+        self._heading_pid.d_filter = d_filter
+
+    def __go_straight_steps(self, speed, t, forward, sleep_t, need_calib):
+        self.__drive(0, 0)
+        yield 20
+        if need_calib:
+            self.motion.warm_start()
+
+        if forward == False:
+            speed = -speed
+
+        self.motion.begin()
+        yield 100 # sleep to calib right value
+        pid = self._heading_pid
+        pid.reset()
+        self.__drive(speed, speed)
+
+        # run the controller every sleep_t ms, using the measured time between updates
+        period_us = sleep_t * 1000
+        duration_us = int(t * 1e6)
+        count = 0
+        t_start = t_last = time.ticks_us()
+        while time.ticks_diff(t_last, t_start) < duration_us:
+            self.motion.updateZ()
+            t_now = time.ticks_us()
+            u = pid.update(self.__heading_error(), time.ticks_diff(t_now, t_last) * 1e-6)
+            t_last = t_now
+            self.__drive(max(-100, min(100, speed - u)), max(-100, min(100, speed + u)))
+            count += 1
+            if self.telemetry:
+                self.telemetry.record(TAG_STRAIGHT)
+            wait = (period_us - time.ticks_diff(time.ticks_us(), t_now)) // 1000
+            yield wait if wait > 0 else 0
+
+        elapsed = time.ticks_diff(t_last, t_start)
+        self.straight_loop_hz = count * 1e6 / elapsed if elapsed > 0 else 0
 
     def __go_straight(self, speed=None, t=None, forward=True, sleep_t=10, need_calib=False):
         if speed == None:
@@ -109,20 +271,7 @@ class Rover():
             
 
         try:
-            self.stop()
-            if need_calib:
-                self.motion.calibrateZ()
-
-            if forward == False:
-                speed = -speed
-
-            self.motion.begin()
-            time.sleep(0.1) # sleep to calib right value
-            self.set_wheel_speed(speed, speed)
-            t0 = time.time_ns()
-            while time.time_ns() - t0 < t*1e9:
-                self.__calibrate_speed(speed)
-                time.sleep_ms(sleep_t)
+            self.__run_steps(self.__go_straight_steps(speed, t, forward, sleep_t, need_calib))
 
         finally:
             self.stop()
@@ -136,82 +285,99 @@ class Rover():
             return
 
         if right:
-            self.set_wheel_speed(speed, -speed)
+            self.__drive(speed, -speed)
         else:
-            self.set_wheel_speed(-speed, speed)
+            self.__drive(-speed, speed)
 
         if t != None :
             time.sleep(t)
             self.stop()
 
-    def __turn_angle(self, angle, right=True, speed=15, error=2, need_calib=False):
+    def __turn_angle_steps(self, angle, right, speed, error, need_calib):
         if speed > 15:
             speed = 15
 
         if angle < 30:
             speed = 10
 
-        try:
-            self.stop()
-            if need_calib:
-                self.motion.calibrateZ()
-
-            z0 = 0.0
-            t0 = time.time_ns()
-            t_start = t0
-            limit_time = int((angle + 359) / 360) * 3e9
-
-            self.__turn(right, speed)
-            t_speed_changed = t0
-            z_speed_changed = z0
-
-            self.motion.begin()
-            while (time.time_ns() - t_start) < limit_time:
-                self.motion.updateZ()
-                z_now = self.motion.get_angleZ(True)
-                if z_now + error >= angle:
-                    break
-                
-                t_now = time.time_ns()
-                angle_to_target = angle - z_now
-
-                delta_S = z_now - z0
-                delta_T = t_now - t0            
-                delta_V = delta_S / delta_T
-
-                delta_V_changed = (z_now - z_speed_changed)/(t_now - t_speed_changed)
-                if delta_V > 15e-8: #Delta speed value by detla angle (distance) / delta time that robot can control the precise angle, 100ms for 15 degree
-                    if angle_to_target < 15: #(15 * delta_V / 15e-8) : #15 is degree value that robot can control with speed: 15e-8
-                        speed = 15
-                        self.__turn(right, speed)
-                        t_speed_changed = t_now
-                        z_speed_changed = z_now
-                    else:
-                        if delta_V > 40e-8: #Delta speed value is too fast need to slow down, 100ms for 40 degree
-                            speed -= (speed - 15) / (angle_to_target / delta_S)
-                            if speed < 15:
-                                speed = 15
-                            self.__turn(right, speed)
-                            t_speed_changed = t_now
-                            z_speed_changed = z_now
-                else:          
-                    if delta_V_changed < 3e-8 and t_now - t_speed_changed > 1e8 and speed < 15 : #Robot is moving too slow, 100ms for 3 degree
-                        speed += 5
+        self.__drive(0, 0)
+        yield 20
+        if need_calib:
+            self.motion.warm_start()
+
+        z0 = 0.0
+        t0 = time.time_ns()
+        t_start = t0
+        limit_time = int((angle + 359) / 360) * 3e9
+
+        # heading from 0 before the wheels start (the gyro is calibrated at boot)
+        self.motion.begin()
+        self.__turn(right, speed)
+        t_speed_changed = t0
+        z_speed_changed = z0
+
+        while (time.time_ns() - t_start) < limit_time:
+            self.motion.updateZ()
+            if self.telemetry:
+                self.telemetry.record(TAG_TURN)
+            z_now = self.motion.get_angleZ(True)
+            if z_now + error >= angle:
+                break
+            
+            t_now = time.time_ns()
+            angle_to_target = angle - z_now
+
+            delta_S = z_now - z0
+            delta_T = t_now - t0            
+            delta_V = delta_S / delta_T
+
+            delta_V_changed = (z_now - z_speed_changed)/(t_now - t_speed_changed)
+            if delta_V > 15e-8: #Delta speed value by detla angle (distance) / delta time that robot can control the precise angle, 100ms for 15 degree
+                if angle_to_target < 15: #(15 * delta_V / 15e-8) : #15 is degree value that robot can control with speed: 15e-8
+                    speed = 15
+                    self.__turn(right, speed)
+                    t_speed_changed = t_now
+                    z_speed_changed = z_now
+                else:
+                    if delta_V > 40e-8: #Delta speed value is too fast need to slow down, 100ms for 40 degree
+                        speed -= (speed - 15) / (angle_to_target / delta_S)
+                        if speed < 15:
+                            speed = 15
                         self.__turn(right, speed)
                         t_speed_changed = t_now
                         z_speed_changed = z_now
+            else:          
+                if delta_V_changed < 3e-8 and t_now - t_speed_changed > 1e8 and speed < 15 : #Robot is moving too slow, 100ms for 3 degree
+                    speed += 5
+                    self.__turn(right, speed)
+                    t_speed_changed = t_now
+                    z_speed_changed = z_now
+
+            z0 = z_now
+            t0 = t_now
+            yield 0
 
-                z0 = z_now
-                t0 = t_now
+    def __turn_angle(self, angle, right=True, speed=15, error=2, need_calib=False):
+        try:
+            self.__run_steps(self.__turn_angle_steps(angle, right, speed, error, need_calib))
 
         finally:
             self.stop()
             gc.collect()
+
+    def __timed_steps(self, m1_speed, m2_speed, t):
+        self.__drive(m1_speed, m2_speed)
+        if t == None:
+            return
+        deadline = time.ticks_add(time.ticks_ms(), int(t * 1000))
+        while time.ticks_diff(deadline, time.ticks_ms()) > 0:
+            yield 10
     
     #------------------------------ROBOT PUBLIC DRIVING METHODS--------------------------#
 
     def forward(self, speed=None, t=None, straight=False):
         global mpu_detected
+        self.cancel_motion()
         if mpu_detected == True:
             self.__go(True, speed, t, straight)
         else:
@@ -219,22 +385,26 @@ class Rover():
 
     def backward(self, speed=None, t=None, straight=False):
         global mpu_detected
+        self.cancel_motion()
         if mpu_detected == True:
             self.__go(False, speed, t, straight)
         else:
             self.__go(False, speed, t, False)
 
     def turn_left(self, speed=None, t=None):
+        self.cancel_motion()
         self.__turn(False, speed, t)
 
     def turn_right(self, speed=None, t=None):
+        self.cancel_motion()
         self.__turn(True, speed, t)
 
     def turn_left_angle(self, angle, speed=15, need_calib=False):
         global mpu_detected
         print(mpu_detected)
+        self.cancel_motion()
         if mpu_detected == True:
-            self.__turn_angle(angle, False, speed, need_calib)
+            self.__turn_angle(angle, False, speed, need_calib=need_calib)
         else:
             t = angle/90
             self.__turn(False, speed, t)
@@ -242,65 +412,240 @@ class Rover():
     def turn_right_angle(self, angle, speed=15, need_calib=False):
         global mpu_detected
         print(mpu_detected)
+        self.cancel_motion()
         if mpu_detected == True:
-            self.__turn_angle(angle, True, speed, need_calib)
+            self.__turn_angle(angle, True, speed, need_calib=need_calib)
         else:
             t = angle/90
             self.__turn(True, speed, t)
 
     def stop(self):
+        stopped = self.m1_speed == 0 and self.m2_speed == 0 and self._m1_target == 0 and self._m2_target == 0
         self.set_wheel_speed(0, 0)
-        time.sleep_ms(20)
+        if not stopped:
+            time.sleep_ms(20)
+
+    #------------------------------ROBOT ASYNC DRIVING METHODS--------------------------#
+    # Coroutine versions of the driving methods, for use with uasyncio. They yield to
+    # other tasks while the motion runs and return True when it completed.
+    # Any new driving command (blocking or async) or cancel_motion() preempts the
+    # motion in progress, which then returns False and leaves the wheels to the new
+    # command. Cancelling the task stops the robot.
+
+    def cancel_motion(self):
+        self._motion_id += 1
+
+    def start_bump_detection(self, pin, bump_mg=1000, stop=True, on_bump=None, threshold_mg=250):
+        # Collision detection by the MPU6050 motion interrupt, its INT pin wired
+        # to GPIO pin. A pulse (threshold_mg, at most 510) with a horizontal
+        # acceleration of bump_mg or more is a bump: the wheels stop at once
+        # (if stop) and the motion in progress ends, then on_bump() is called
+        # from the IRQ. Weaker pulses (shakes, jolts) do not stop the robot.
+        # Returns False without an MPU6050.
+        motion = self.motion
+        if not motion:
+            return False
+        self._bump_stop = stop
+        self._on_bump = on_bump
+        motion.on_bump = self._bump_ref
+        motion.start_motion_interrupt(pin, threshold_mg, bump_mg=bump_mg)
+        return True
+
+    def stop_bump_detection(self):
+        if self._motion:
+            self._motion.stop_motion_interrupt()
+            self._motion.on_bump = None
+
+    def _bump(self):
+        self.bumps += 1
+        if self._bump_stop:
+            self.cancel_motion()
+            self.__drive(0, 0) # not stop(): no sleep in the IRQ
+        if self._on_bump:
+            self._on_bump()
+
+    async def __run_async(self, steps, stop=True):
+        self._motion_id += 1
+        motion_id = self._motion_id
+        try:
+            for ms in steps:
+                if self._motion_id != motion_id:
+                    return False
+                await asyncio.sleep_ms(ms)
+            return self._motion_id == motion_id
+        finally:
+            if stop and self._motion_id == motion_id:
+                self.__drive(0, 0)
+
+    async def forward_async(self, speed=None, t=None, straight=False):
+        return await self.__go_async(True, speed, t, straight)
+
+    async def backward_async(self, speed=None, t=None, straight=False):
+        return await self.__go_async(False, speed, t, straight)
+
+    async def __go_async(self, forward, speed, t, straight):
+        global mpu_detected
+        if speed < 0 or speed > 100 or (t != None and t < 0):
+            return False
+
+        if straight == True and mpu_detected == True:
+            if t == None:
+                return False
+            return await self.__run_async(self.__go_straight_steps(speed, t, forward, 10, False))
+
+        if not forward:
+            speed = -speed
+        return await self.__run_async(self.__timed_steps(speed, speed, t), t != None)
+
+    async def turn_left_async(self, speed=None, t=None):
+        return await self.__turn_async(False, speed, t)
+
+    async def turn_right_async(self, speed=None, t=None):
+        return await self.__turn_async(True, speed, t)
+
+    async def __turn_async(self, right, speed, t):
+        if speed < 0 or speed > 100 or (t != None and t < 0):
+            return False
+
+        if right:
+            steps = self.__timed_steps(speed, -speed, t)
+        else:
+            steps = self.__timed_steps(-speed, speed, t)
+        return await self.__run_async(steps, t != None)
+
+    async def turn_left_angle_async(self, angle, speed=15, need_calib=False):
+        return await self.__turn_angle_async(angle, False, speed, need_calib)
+
+    async def turn_right_angle_async(self, angle, speed=15, need_calib=False):
+        return await self.__turn_angle_async(angle, True, speed, need_calib)
+
+    async def __turn_angle_async(self, angle, right, speed, need_calib):
+        global mpu_detected
+        if mpu_detected == True:
+            steps = self.__turn_angle_steps(angle, right, speed, 2, need_calib)
+        else:
+            steps = self.__timed_steps(speed if right else -speed, -speed if right else speed, angle/90)
+        try:
+            return await self.__run_async(steps)
+        finally:
+            gc.collect()
+
+    def set_ramp(self, slew_rate=500, period_ms=10):
+        # slew_rate: speed units per second used to finish large speed changes (0 = no ramp)
+        self._ramp_period = period_ms
+        self._ramp_delta = slew_rate * period_ms / 1000
+
+    def is_ramping(self):
+        return self._ramp_timer != None
 
     def set_wheel_speed(self, m1_speed, m2_speed):
-        # logic to smoothen motion, avoid voltage spike
-        # if wheel speed change > 30, need to change to 30 first
-        if (m1_speed != 0 and abs(m1_speed - self.m1_speed) > 30) and (m2_speed != 0 and abs(m2_speed - self.m2_speed) > 30):
-            if m1_speed > 0:
-                # Forward
-                self.ina1.duty(int(translate(30, 0, 100, 0, 1023)))
-                self.ina2.duty(0)
-            elif m1_speed < 0:
-                # Backward
-                self.ina1.duty(0)
-                self.ina2.duty(int(translate(30, 0, 100, 0, 1023)))
-            
-            if m2_speed > 0:
-                # Forward
-                self.inb1.duty(int(translate(30, 0, 100, 0, 1023)))
-                self.inb2.duty(0)
-            elif m2_speed < 0:
-                # Backward
-                self.inb1.duty(0)
-                self.inb2.duty(int(translate(30, 0, 100, 0, 1023)))
+        self.cancel_motion()
+        self.__drive(m1_speed, m2_speed)
 
-            time.sleep_ms(200)
+    def __drive(self, m1_speed, m2_speed):
+        # logic to smoothen motion, avoid voltage spike
+        # if wheel speed change > 30, jump 30 first then ramp to target on a timer.
+        # Returns immediately, a new call retargets a ramp in progress.
+        self._m1_target = m1_speed
+        self._m2_target = m2_speed
+
+        if self._ramp_delta > 0:
+            m1 = self.__ramp_start(self.m1_speed, m1_speed)
+            m2 = self.__ramp_start(self.m2_speed, m2_speed)
+        else:
+            m1 = m1_speed
+            m2 = m2_speed
+
+        self.__write_wheels(m1, m2)
+
+        if m1 == m1_speed and m2 == m2_speed:
+            self.__stop_ramp()
+        elif self._ramp_timer == None:
+            self._ramp_timer = Timer(_RAMP_TIMER_ID)
+            self._ramp_timer.init(period=self._ramp_period, mode=Timer.PERIODIC, callback=self._ramp_tick_ref)
+
+    def __ramp_start(self, current, target):
+        # first value to apply on the way to target
+        if target == 0:
+            return 0 # stopping is always immediate
+        base = current if current * target > 0 else 0
+        if abs(target - base) <= _RAMP_JUMP:
+            return target
+        return base + _RAMP_JUMP if target > base else base - _RAMP_JUMP
+
+    def __ramp_approach(self, current, target):
+        delta = self._ramp_delta
+        if abs(target - current) <= delta:
+            return target
+        return current + delta if target > current else current - delta
+
+    def _ramp_tick(self, _):
+        if self._ramp_pending:
+            return
+        self._ramp_pending = True
+        try:
+            schedule(self._ramp_step_ref, 0)
+        except RuntimeError:
+            self._ramp_pending = False
 
+    def _ramp_step(self, _):
+        self._ramp_pending = False
+        if self._ramp_timer == None:
+            return
+        m1 = self.__ramp_approach(self.m1_speed, self._m1_target)
+        m2 = self.__ramp_approach(self.m2_speed, self._m2_target)
+        self.__write_wheels(m1, m2)
+        if m1 == self._m1_target and m2 == self._m2_target:
+            self.__stop_ramp()
+
+    def __stop_ramp(self):
+        if self._ramp_timer != None:
+            self._ramp_timer.deinit()
+            self._ramp_timer = None
+
+    def set_motor_trim(self, m1_scale=1.0, m2_scale=1.0, m1_min_duty=0, m2_min_duty=0):
+        # m*_scale: 0..1, lower the faster wheel so the robot drives straight
+        # m*_min_duty: 0..1023, duty where the wheel starts to turn
+        self._m1_duty = _duty_table(m1_scale, m1_min_duty)
+        self._m2_duty = _duty_table(m2_scale, m2_min_duty)
+        self.__write_wheels(self.m1_speed, self.m2_speed)
+
+    def __set_duty(self, channel, duty):
+        if self._duty[channel] != duty:
+            self._pwm[channel].duty(duty)
+            self._duty[channel] = duty
+
+    def __write_wheels(self, m1_speed, m2_speed):
+        # the idle channel of a wheel is written first, so both are never driven together
+        i = int(abs(m1_speed) + 0.5)
+        duty = self._m1_duty[i if i < 100 else 100]
         if m1_speed > 0:
             # Forward
-            self.ina1.duty(int(translate(abs(m1_speed), 0, 100, 0, 1023)))
-            self.ina2.duty(0)
+            self.__set_duty(1, 0)
+            self.__set_duty(0, duty)
         elif m1_speed < 0:
             # Backward
-            self.ina1.duty(0)
-            self.ina2.duty(int(translate(abs(m1_speed), 0, 100, 0, 1023)))
+            self.__set_duty(0, 0)
+            self.__set_duty(1, duty)
         else:
             # Release
-            self.ina1.duty(0)
-            self.ina2.duty(0)
+            self.__set_duty(0, 0)
+            self.__set_duty(1, 0)
 
+        i = int(abs(m2_speed) + 0.5)
+        duty = self._m2_duty[i if i < 100 else 100]
         if m2_speed > 0:
             # Forward
-            self.inb1.duty(int(translate(abs(m2_speed), 0, 100, 0, 1023)))
-            self.inb2.duty(0)
+            self.__set_duty(3, 0)
+            self.__set_duty(2, duty)
         elif m2_speed < 0:
             # Backward
-            self.inb2.duty(int(translate(abs(m2_speed), 0, 100, 0, 1023)))
-            self.inb1.duty(0)
+            self.__set_duty(2, 0)
+            self.__set_duty(3, duty)
         else:
             # Release
-            self.inb1.duty(0)
-            self.inb2.duty(0)
+            self.__set_duty(2, 0)
+            self.__set_duty(3, 0)
         
         self.m1_speed = m1_speed
         self.m2_speed = m2_speed
@@ -343,59 +688,227 @@ class Rover():
 
         else:
             self.stop()
-    def read_line_sensors(self, index=0):
+    def read_line_sensors(self, index=0, max_age_ms=5):
         '''
         self.pcf.pin(0) = 0 white line
         self.pcf.pin(0) = 1 black line
+
+        All 4 sensors are fetched with one I2C transaction. Calls made within
+        max_age_ms of the last read reuse the cached port snapshot.
         '''
         if index < 0 or index > 4:
             return 1
  
-        if index == 0:
-            if self.pcf:
-                return (self.pcf.pin(0), self.pcf.pin(1), self.pcf.pin(2), self.pcf.pin(3))
-            else:
+        if not self.pcf:
+            if index == 0:
                 return (1, 1, 1, 1) # cannot detect black line
+            return 1
+
+        port = self.pcf.read_port(max_age_ms)
+        if index == 0:
+            return (port & 1, (port >> 1) & 1, (port >> 2) & 1, (port >> 3) & 1)
         else:
-            if self.pcf:
-                return self.pcf.pin(index-1)
+            return (port >> (index - 1)) & 1
+
+    #------------------------------ROBOT LINE FOLLOWING--------------------------#
+    # The 4 sensors are read as one port value and mapped to a line position
+    # (see _LINE_POS). A PID steers towards position 0 at a fixed rate. When the
+    # line is lost the robot steers hard towards the side it was last seen on.
+
+    def line_position(self):
+        # -150 (left) .. 150 (right), None if no sensor sees the line
+        if not self.pcf:
+            return None
+        pos = _LINE_POS[self.pcf.read_port() & 0x0f]
+        return None if pos == _LINE_LOST else pos
+
+    def set_line_pid(self, kp=0.25, ki=0.0, kd=0.004, limit=60, d_filter=0.5):
+        # tune the steering used by follow_line
+        self._line_pid.set_gains(kp, ki, kd)
+        self._line_pid.set_limits(-limit, limit)
+        self._line_pid.d_filter = d_filter
+
+    def line_stats(self):
+        # (loop_hz, off_line_ms, longest_off_line_ms, times_lost) of the last/current follow_line
+        elapsed = time.ticks_diff(self._line_t_last, self._line_t_start)
+        loop_hz = self._line_loops * 1e6 / elapsed if elapsed > 0 else 0
+        off_ms = self._line_off_ms
+        longest = self._line_off_max_ms
+        if self._line_off_since != None:
+            # still off the line
+            current = time.ticks_diff(self._line_t_last, self._line_off_since) // 1000
+            off_ms += current
+            longest = max(longest, current)
+        return (loop_hz, off_ms, longest, self._line_lost)
+
+    def __reset_line_stats(self):
+        self._line_loops = 0
+        self._line_t_start = self._line_t_last = time.ticks_us()
+        self._line_off_since = None
+        self._line_off_ms = 0
+        self._line_off_max_ms = 0
+        self._line_lost = 0
+
+    def __follow_line_steps(self, speed, t, rate_hz):
+        pcf = self.pcf
+        if not pcf or rate_hz <= 0:
+            return
+        pid = self._line_pid
+        pid.reset()
+        self.__reset_line_stats()
+
+        period_us = 1000000 // rate_hz
+        duration_us = None if t == None else int(t * 1e6)
+        t_start = t_last = self._line_t_start
+        while duration_us == None or time.ticks_diff(t_last, t_start) < duration_us:
+            pos = _LINE_POS[pcf.read_port() & 0x0f]
+            t_now = time.ticks_us()
+
+            if pos == _LINE_LOST:
+                pos = _LINE_OFF_POS if self._line_side > 0 else -_LINE_OFF_POS
+                if self._line_off_since == None:
+                    self._line_off_since = t_now
+                    self._line_lost += 1
             else:
-                return 1
+                if pos:
+                    self._line_side = 1 if pos > 0 else -1
+                if self._line_off_since != None:
+                    off = time.ticks_diff(t_now, self._line_off_since) // 1000
+                    self._line_off_ms += off
+                    if off > self._line_off_max_ms:
+                        self._line_off_max_ms = off
+                    self._line_off_since = None
+
+            u = pid.update(pos, time.ticks_diff(t_now, t_last) * 1e-6)
+            t_last = self._line_t_last = t_now
+            self._line_loops += 1
+            self.__drive(max(-100, min(100, speed - u)), max(-100, min(100, speed + u)))
+            if self.telemetry:
+                self.telemetry.record(TAG_LINE)
+
+            wait = (period_us - time.ticks_diff(time.ticks_us(), t_now)) // 1000
+            yield wait if wait > 0 else 0
+
+    def follow_line(self, speed=30, t=None, rate_hz=100):
+        # follow a black line for t seconds (None = until interrupted)
+        self.cancel_motion()
+        if speed < 0 or speed > 100 or (t != None and t < 0):
+            return
+        try:
+            self.__run_steps(self.__follow_line_steps(speed, t, rate_hz))
+        finally:
+            self.stop()
+
+    async def follow_line_async(self, speed=30, t=None, rate_hz=100):
+        # like follow_line, runs until t elapsed or another driving command is given
+        if speed < 0 or speed > 100 or (t != None and t < 0):
+            return False
+        return await self.__run_async(self.__follow_line_steps(speed, t, rate_hz))
 
     def show_led(self, index, state):
+        if index == 0: # both led
+            mask = 0x03
+        elif index == 1 or index == 2: # left led, right led
+            mask = index
+        else:
+            return
+        if self.animator.is_playing():
+            # drawn under the animation from its next frame, kept when it ends
+            self.animator.set_base_indicators(mask, state)
+        else:
+            self.__write_indicators(mask, state)
+
+    def __write_indicators(self, mask, state):
+        self._indicators = (self._indicators | mask) if state else (self._indicators & ~mask)
         if self.pcf:
-            if index == 0: # both led
-                self.pcf.pin(4, state)
-                self.pcf.pin(5, state)
-            elif index == 1: # left led
-                self.pcf.pin(4, state)
-            elif index == 2: # right led
-                self.pcf.pin(5, state)
+            self.pcf.write_pins(mask << 4, state)
+
+    def __set_rgb_led(self, i, color):
+        if self.animator.is_playing():
+            # drawn under the animation from its next frame, kept when it ends
+            self.animator.set_base_pixel(i, color)
         else:
-            pass
+            self._set_rgb_pixel(i, color[0], color[1], color[2])
+        # a new colour cancels a pending turn-off of this led
+        self.animator.cancel_off(1 << i)
+
+    def _set_rgb_pixel(self, i, r, g, b):
+        # update one pixel, marking the frame dirty only if the colour changed
+        k = 3 * i
+        shadow = self._led_shadow
+        if shadow[k] != r or shadow[k + 1] != g or shadow[k + 2] != b:
+            shadow[k] = r
+            shadow[k + 1] = g
+            shadow[k + 2] = b
+            if self._np_buf != None:
+                # write the neopixel buffer directly, no tuple per pixel
+                k = self._np_bpp * i
+                order = self._np_order
+                self._np_buf[k + order[0]] = r
+                self._np_buf[k + order[1]] = g
+                self._np_buf[k + order[2]] = b
+            else:
+                self._rgb_leds[i] = (r, g, b)
+            self._led_dirty = True
+
+    def _write_rgb_leds(self):
+        if self._led_dirty:
+            self._rgb_leds.write()
+            self._led_dirty = False
+
+    def _get_rgb_frame(self, frame):
+        # frame layout of rover_led.Animation: (r, g, b) per led + indicator byte
+        n = 3 * self._num_leds
+        frame[:n] = self._led_shadow
+        frame[n] = 0x80 | self._indicators
+
+    def _set_rgb_frame(self, frame):
+        for i in range(self._num_leds):
+            self._set_rgb_pixel(i, frame[3 * i], frame[3 * i + 1], frame[3 * i + 2])
+        self._write_rgb_leds()
+
+        ind = frame[3 * self._num_leds]
+        if ind & 0x80 and (ind & 0x03) != self._indicators:
+            changed = (ind & 0x03) ^ self._indicators
+            if changed & 0x01:
+                self.__write_indicators(0x01, ind & 0x01)
+            if changed & 0x02:
+                self.__write_indicators(0x02, (ind >> 1) & 0x01)
 
     def show_rgb_led(self, index, color, delay=None):
         if index == 0:
             for i in range(self._num_leds):
-                self._rgb_leds[i] = color
-
-            self._rgb_leds.write()
+                self.__set_rgb_led(i, color)
+            mask = (1 << self._num_leds) - 1
 
         elif (index > 0) and (index <= self._num_leds) :
-            self._rgb_leds[index - 1] = color
-            self._rgb_leds.write()
+            self.__set_rgb_led(index - 1, color)
+            mask = 1 << (index - 1)
+
+        else:
+            return
+
+        self._write_rgb_leds()
 
         if delay != None:
-            time.sleep(delay)
-            if index == 0:
-                for i in range(self._num_leds):
-                    self._rgb_leds[i] = (0, 0, 0)
+            # turned off from the led timer instead of sleeping
+            self.animator.turn_off_later(mask, delay)
+
+    def show_rgb_leds(self, colors, delay=None):
+        # set leds 1..n from a sequence of colours with a single write
+        n = min(len(colors), self._num_leds)
+        for i in range(n):
+            self.__set_rgb_led(i, colors[i])
+        self._write_rgb_leds()
+
+        if delay != None:
+            self.animator.turn_off_later((1 << n) - 1, delay)
 
-                self._rgb_leds.write()
+    def play_led_animation(self, anim, layer=rover_led.LAYER_USER, repeat=0):
+        self.animator.play(anim, layer, repeat)
 
-            elif (index > 0) and (index <= self._num_leds) :
-                self._rgb_leds[index - 1] = (0, 0, 0)
-                self._rgb_leds.write()
+    def stop_led_animation(self, layer=None):
+        self.animator.stop(layer)
     
     def servo_write(self, index, value, max=180):
         if index not in [1, 2]:
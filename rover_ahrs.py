@@ -0,0 +1,161 @@
+import math
+from array import array
+
+# Quaternion orientation filters for rover_motion.Motion (see Motion.set_filter).
+# Both take gyro rates in deg/s and the accelerometer in any unit, and keep the
+# orientation in a preallocated quaternion [w, x, y, z]. angles() converts it
+# to the angles of Motion: x and y the tilt (as from the accelerometer in
+# update()), z the heading, counter-clockwise, -180..180.
+
+_DEG2RAD = math.pi / 180
+_RAD2DEG = 180 / math.pi
+
+
+class _Quaternion:
+    def __init__(self):
+        self.q = array('f', (1.0, 0.0, 0.0, 0.0))
+        self.x = self.y = self.z = 0.0
+
+    def reset(self):
+        q = self.q
+        q[0] = 1.0
+        q[1] = q[2] = q[3] = 0.0
+        self.x = self.y = self.z = 0.0
+
+    def _normalize(self, q0, q1, q2, q3):
+        n = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        if n == 0:
+            return
+        n = 1 / n
+        q = self.q
+        q[0] = q0 * n
+        q[1] = q1 * n
+        q[2] = q2 * n
+        q[3] = q3 * n
+
+    def angles(self):
+        # Euler angles in degrees into self.x, self.y, self.z
+        q = self.q
+        q0 = q[0]
+        q1 = q[1]
+        q2 = q[2]
+        q3 = q[3]
+        s = 2 * (q0 * q2 - q1 * q3)
+        if s > 1:
+            s = 1
+        elif s < -1:
+            s = -1
+        self.x = -math.asin(s) * _RAD2DEG # rotation about Y, nose up positive
+        self.y = math.atan2(q0 * q1 + q2 * q3, 0.5 - q1 * q1 - q2 * q2) * _RAD2DEG
+        self.z = math.atan2(q1 * q2 + q0 * q3, 0.5 - q2 * q2 - q3 * q3) * _RAD2DEG
+
+
+class Mahony(_Quaternion):
+    """
+    Mahony filter: the gyro rate is corrected by kp (and ki, integral) times
+    the error between the measured and the estimated gravity direction.
+    kp=2 converges about as fast as the complementary filter of update() (0.5s).
+    """
+    def __init__(self, kp=2.0, ki=0.0):
+        super().__init__()
+        self.kp = kp
+        self.ki = ki
+        self._integral = array('f', (0.0, 0.0, 0.0))
+
+    def reset(self):
+        super().reset()
+        i = self._integral
+        i[0] = i[1] = i[2] = 0.0
+
+    def update(self, gx, gy, gz, ax, ay, az, dt):
+        q = self.q
+        q0 = q[0]
+        q1 = q[1]
+        q2 = q[2]
+        q3 = q[3]
+        gx *= _DEG2RAD
+        gy *= _DEG2RAD
+        gz *= _DEG2RAD
+        n = ax * ax + ay * ay + az * az
+        if n > 0:
+            n = 1 / math.sqrt(n)
+            ax *= n
+            ay *= n
+            az *= n
+            # estimated gravity direction, error = measured x estimated
+            vx = 2 * (q1 * q3 - q0 * q2)
+            vy = 2 * (q0 * q1 + q2 * q3)
+            vz = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+            ex = ay * vz - az * vy
+            ey = az * vx - ax * vz
+            ez = ax * vy - ay * vx
+            if self.ki > 0:
+                i = self._integral
+                i[0] += self.ki * ex * dt
+                i[1] += self.ki * ey * dt
+                i[2] += self.ki * ez * dt
+                gx += i[0]
+                gy += i[1]
+                gz += i[2]
+            gx += self.kp * ex
+            gy += self.kp * ey
+            gz += self.kp * ez
+
+        h = 0.5 * dt
+        gx *= h
+        gy *= h
+        gz *= h
+        self._normalize(
+            q0 - q1 * gx - q2 * gy - q3 * gz,
+            q1 + q0 * gx + q2 * gz - q3 * gy,
+            q2 + q0 * gy - q1 * gz + q3 * gx,
+            q3 + q0 * gz + q1 * gy - q2 * gx)
+
+
+class Madgwick(_Quaternion):
+    """
+    Madgwick filter: one gradient descent step per update towards the
+    orientation matching the accelerometer, at beta rad/s.
+    """
+    def __init__(self, beta=0.1):
+        super().__init__()
+        self.beta = beta
+
+    def update(self, gx, gy, gz, ax, ay, az, dt):
+        q = self.q
+        q0 = q[0]
+        q1 = q[1]
+        q2 = q[2]
+        q3 = q[3]
+        gx *= _DEG2RAD
+        gy *= _DEG2RAD
+        gz *= _DEG2RAD
+        d0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        d1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        d2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        d3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        n = ax * ax + ay * ay + az * az
+        if n > 0:
+            n = 1 / math.sqrt(n)
+            ax *= n
+            ay *= n
+            az *= n
+            q0q0 = q0 * q0
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+            # gradient of the gravity error
+            s0 = 4 * q0 * (q1q1 + q2q2) + 2 * (q2 * ax - q1 * ay)
+            s1 = 4 * q1 * (q3q3 + q0q0 - 1 + 2 * (q1q1 + q2q2) + az) - 2 * (q3 * ax + q0 * ay)
+            s2 = 4 * q2 * (q0q0 + q3q3 - 1 + 2 * (q1q1 + q2q2) + az) + 2 * (q0 * ax - q3 * ay)
+            s3 = 4 * q3 * (q1q1 + q2q2) - 2 * (q1 * ax + q2 * ay)
+            n = s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3
+            if n > 0:
+                n = self.beta / math.sqrt(n)
+                d0 -= s0 * n
+                d1 -= s1 * n
+                d2 -= s2 * n
+                d3 -= s3 * n
+
+        self._normalize(q0 + d0 * dt, q1 + d1 * dt, q2 + d2 * dt, q3 + d3 * dt)
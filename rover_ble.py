@@ -0,0 +1,460 @@
+import time
+import uasyncio as asyncio
+from micropython import const
+from ubinascii import unhexlify, hexlify, a2b_base64, b2a_base64
+
+# Control frame, 8 bytes:
+#   0  header 0xA5
+#   1  flags (which fields below are set)
+#   2  left wheel speed, int8 -100..100
+#   3  right wheel speed, int8 -100..100
+#   4  servo 1 angle 0..180
+#   5  servo 2 angle 0..180
+#   6  mode
+#   7  checksum, sum of bytes 0..6 & 0xff
+# BLE string messages carry it as '#' + 16 hex digits.
+FRAME_HEADER = const(0xA5)
+FRAME_SIZE = const(8)
+FLAG_DRIVE = const(0x01)
+FLAG_SERVO1 = const(0x02)
+FLAG_SERVO2 = const(0x04)
+FLAG_MODE = const(0x08)
+FLAG_STOP = const(0x10)
+
+
+def encode_frame(left=0, right=0, servo1=None, servo2=None, mode=None, stop=False, drive=True):
+    flags = FLAG_DRIVE if drive else 0
+    if servo1 != None:
+        flags |= FLAG_SERVO1
+    if servo2 != None:
+        flags |= FLAG_SERVO2
+    if mode != None:
+        flags |= FLAG_MODE
+    if stop:
+        flags |= FLAG_STOP
+    frame = bytearray(FRAME_SIZE)
+    frame[0] = FRAME_HEADER
+    frame[1] = flags
+    frame[2] = int(left) & 0xff
+    frame[3] = int(right) & 0xff
+    frame[4] = servo1 or 0
+    frame[5] = servo2 or 0
+    frame[6] = mode or 0
+    frame[7] = sum(frame[:7]) & 0xff
+    return frame
+
+def frame_to_text(frame):
+    return '#' + hexlify(frame).decode()
+
+def is_frame(msg):
+    if isinstance(msg, str):
+        return len(msg) == 2 * FRAME_SIZE + 1 and msg[0] == '#'
+    return len(msg) == FRAME_SIZE and msg[0] == FRAME_HEADER
+
+def _int8(b):
+    return b - 256 if b & 0x80 else b
+
+def _int16(lo, hi):
+    v = lo | (hi << 8)
+    return v - 65536 if v & 0x8000 else v
+
+def _put16(buf, i, v):
+    buf[i] = v & 0xff
+    buf[i + 1] = (v >> 8) & 0xff
+
+
+class ControlDispatcher:
+    """
+    Applies BLE control frames with "latest wins" semantics.
+
+    feed() is called from the BLE callback: it only validates the frame and
+    stores the newest drive setpoint. update(), called from the control loop,
+    applies it once, so a burst of frames costs one motor update. Frames that
+    were overwritten before being applied are counted in coalesced.
+    When drive frames stop arriving for timeout_ms while the wheels turn,
+    the dead-man stops the motors.
+    """
+    def __init__(self, rover, timeout_ms=500, on_mode=None):
+        self._rover = rover
+        self.timeout_ms = timeout_ms
+        self.on_mode = on_mode
+
+        self._buf = bytearray(FRAME_SIZE)
+        self._left = 0
+        self._right = 0
+        self._pending = False
+        self._deadman = False
+        self._received = 0 # ticks_us of the pending setpoint
+        self._last_frame = time.ticks_ms()
+        self._moving = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.bad_frames = 0
+        self.coalesced = 0
+        self.deadman_stops = 0
+        self.latency_max_us = 0
+        self._latency_sum = 0
+        self._latency_count = 0
+
+    def latency_avg_us(self):
+        if not self._latency_count:
+            return 0
+        return self._latency_sum // self._latency_count
+
+    def feed(self, msg):
+        # msg: raw frame bytes or '#'-prefixed hex text. Returns False if invalid.
+        buf = self._buf
+        try:
+            data = unhexlify(msg[1:]) if isinstance(msg, str) else msg
+            valid = len(data) == FRAME_SIZE
+        except (ValueError, TypeError):
+            valid = False
+        if not valid:
+            # wrong length: checked before the copy, which would resize buf
+            self.bad_frames += 1
+            return False
+        buf[:] = data
+        if buf[0] != FRAME_HEADER or (sum(buf) - buf[7]) & 0xff != buf[7]:
+            self.bad_frames += 1
+            return False
+
+        self.frames += 1
+        self._last_frame = time.ticks_ms()
+        flags = buf[1]
+        if flags & FLAG_STOP:
+            self.set_drive(0, 0, True)
+        elif flags & FLAG_DRIVE:
+            self.set_drive(_int8(buf[2]), _int8(buf[3]), True)
+        if flags & FLAG_SERVO1:
+            self._rover.servo_write(1, buf[4])
+        if flags & FLAG_SERVO2:
+            self._rover.servo_write(2, buf[5])
+        if flags & FLAG_MODE and self.on_mode:
+            self.on_mode(buf[6])
+        return True
+
+    def set_drive(self, left, right, deadman=False):
+        # newest wheel setpoint, applied by the next update()
+        # deadman: stop if no new setpoint arrives within timeout_ms
+        if self._pending:
+            self.coalesced += 1
+        self._left = max(-100, min(100, left))
+        self._right = max(-100, min(100, right))
+        self._deadman = deadman
+        self._last_frame = time.ticks_ms()
+        self._received = time.ticks_us()
+        self._pending = True
+
+    def update(self):
+        if self._pending:
+            self._pending = False
+            if self._left == 0 and self._right == 0:
+                self._rover.stop()
+            else:
+                self._rover.set_wheel_speed(self._left, self._right)
+            self._moving = self._left != 0 or self._right != 0
+            latency = time.ticks_diff(time.ticks_us(), self._received)
+            if latency > self.latency_max_us:
+                self.latency_max_us = latency
+            self._latency_sum += latency
+            self._latency_count += 1
+        elif self._moving and self._deadman and \
+                time.ticks_diff(time.ticks_ms(), self._last_frame) > self.timeout_ms:
+            self._rover.stop()
+            self._moving = False
+            self.deadman_stops += 1
+
+    async def run(self, period_ms=20):
+        while True:
+            self.update()
+            await asyncio.sleep_ms(period_ms)
+
+
+# Telemetry frame, robot to app:
+#   0  header 0x5A
+#   1  fields (which values each sample has, in the order of the bits below)
+#   2  sequence number, +1 per frame, so lost frames show
+#   3  number of samples
+#   4  samples dropped before this frame (ring full or link too slow), max 255
+#   5  samples, little endian:
+#        FIELD_TIME      uint16 ticks_ms (wraps every 65.5s)
+#        FIELD_HEADING   int16 angleZ in 1/10 degree, -1800..1799
+#        FIELD_DISTANCE  uint16 ultrasonic distance in mm
+#        FIELD_SPEEDS    int8 m1, int8 m2 wheel speeds
+#        FIELD_LINE      uint8 line sensor bits, 0xff without sensors
+#        FIELD_LOOP_HZ   uint16 rate of the sample() calls
+# BLE string messages carry it as '$' + base64. A notification holds at most
+# BLE_MSG_MAX bytes (ATT MTU 23 - 3 unless the app negotiates a larger one,
+# the BLE stack cuts longer ones), so a longer message is sent in pieces of
+# max_msg characters, the first starting with '$', the next ones with '+'.
+# The frame size in the header tells the receiver when it has all of them
+# (telemetry_frame_size). Raw frames (text=False) are split the same way,
+# without prefix.
+BLE_MSG_MAX = const(20)
+TELEMETRY_HEADER = const(0x5A)
+_TELEMETRY_HEAD = const(5)
+FIELD_TIME = const(0x01)
+FIELD_HEADING = const(0x02)
+FIELD_DISTANCE = const(0x04)
+FIELD_SPEEDS = const(0x08)
+FIELD_LINE = const(0x10)
+FIELD_LOOP_HZ = const(0x20)
+FIELDS_DEFAULT = const(0x1f)
+_FIELD_SIZES = ((FIELD_TIME, 2), (FIELD_HEADING, 2), (FIELD_DISTANCE, 2),
+                (FIELD_SPEEDS, 2), (FIELD_LINE, 1), (FIELD_LOOP_HZ, 2))
+_FIELD_NAMES = ((FIELD_TIME, ('t_ms',)), (FIELD_HEADING, ('heading_deg',)),
+                (FIELD_DISTANCE, ('distance_cm',)), (FIELD_SPEEDS, ('m1', 'm2')),
+                (FIELD_LINE, ('line',)), (FIELD_LOOP_HZ, ('loop_hz',)))
+
+def sample_size(fields):
+    return sum(size for bit, size in _FIELD_SIZES if fields & bit)
+
+def telemetry_frame_size(head):
+    # size in bytes of the frame starting with head (at least its first 5 bytes), 0 if invalid
+    if len(head) < _TELEMETRY_HEAD or head[0] != TELEMETRY_HEADER:
+        return 0
+    size = sample_size(head[1])
+    return _TELEMETRY_HEAD + head[3] * size if size else 0
+
+def telemetry_columns(fields):
+    # names of the values of a decoded sample
+    names = []
+    for bit, cols in _FIELD_NAMES:
+        if fields & bit:
+            names.extend(cols)
+    return names
+
+def decode_telemetry(msg):
+    # '$'-prefixed base64 text or raw frame bytes -> (fields, seq, dropped,
+    # samples), samples a list of tuples in telemetry_columns() order.
+    # None if msg is not a valid telemetry frame.
+    try:
+        frame = a2b_base64(msg[1:]) if isinstance(msg, str) else bytes(msg)
+    except (ValueError, TypeError):
+        return None
+    if len(frame) < _TELEMETRY_HEAD or frame[0] != TELEMETRY_HEADER:
+        return None
+    fields, seq, count, dropped = frame[1], frame[2], frame[3], frame[4]
+    size = sample_size(fields)
+    if not size or len(frame) != _TELEMETRY_HEAD + count * size:
+        return None
+    samples = []
+    i = _TELEMETRY_HEAD
+    for _ in range(count):
+        values = []
+        if fields & FIELD_TIME:
+            values.append(frame[i] | (frame[i + 1] << 8))
+            i += 2
+        if fields & FIELD_HEADING:
+            values.append(_int16(frame[i], frame[i + 1]) / 10)
+            i += 2
+        if fields & FIELD_DISTANCE:
+            values.append((frame[i] | (frame[i + 1] << 8)) / 10)
+            i += 2
+        if fields & FIELD_SPEEDS:
+            values.append(_int8(frame[i]))
+            values.append(_int8(frame[i + 1]))
+            i += 2
+        if fields & FIELD_LINE:
+            values.append(frame[i])
+            i += 1
+        if fields & FIELD_LOOP_HZ:
+            values.append(frame[i] | (frame[i + 1] << 8))
+            i += 2
+        samples.append(tuple(values))
+    return fields, seq, dropped, samples
+
+
+class TelemetryStreamer:
+    """
+    Streams rover state to the app, several samples per BLE message.
+
+    sample() stores one sample (at most rate_hz per second) in a preallocated
+    ring without I/O; it can be called from a control loop, or the streamer
+    can be set as rover.telemetry so the driving loops call it. run() samples
+    too and sends a frame when one is full or max_delay_ms passed. When the
+    link cannot keep up (send() raising OSError or not enough frames per run
+    period) the oldest samples are overwritten, so the producer never waits.
+
+    send is yolobit's ble.send: it notifies the message as is and raises
+    OSError when the BLE stack has no buffer left; a message over the
+    notification size would be cut, so frames go out in messages of at most
+    max_msg characters (a max_frame bytes frame makes 1 + 4/3 * max_frame).
+    A frame interrupted by OSError goes on from the piece that failed.
+
+    The heading (motion.angleZ) and distance (ultrasonic.last_cm()) are sent
+    as stored: the program keeps them current while streaming, e.g. with
+    motion.start_background() and regular distance_cm() calls as main.py does.
+    """
+    def __init__(self, rover, send, rate_hz=20, fields=FIELDS_DEFAULT, max_frame=60,
+                 ring=32, max_delay_ms=250, text=True, max_msg=BLE_MSG_MAX):
+        self._rover = rover
+        self._send = send
+        self.text = text
+        self.max_msg = max(2, max_msg)
+        self.enabled = True
+        self.max_delay_ms = max_delay_ms
+        self._fields = fields
+        self._sample_size = sample_size(fields)
+        self._per_frame = max(1, (max_frame - _TELEMETRY_HEAD) // self._sample_size)
+        self._size = ring
+        self._ring = bytearray(ring * self._sample_size)
+        self._frame = bytearray(_TELEMETRY_HEAD + self._per_frame * self._sample_size)
+        self._head = 0
+        self._tail = 0
+        self._count = 0
+        self._seq = 0
+        self._dropped_since = 0
+        self._out = None # message being sent, in pieces
+        self._out_pos = 0
+        self._calls = 0
+        self._t_frame = time.ticks_ms()
+        self.set_rate(rate_hz)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.samples = 0
+        self.frames = 0
+        self.messages = 0
+        self.dropped = 0
+        self.send_errors = 0
+
+    def set_rate(self, rate_hz):
+        self._period_us = 1000000 // rate_hz
+        self._t_sample = time.ticks_add(time.ticks_us(), -self._period_us)
+
+    def pending(self):
+        return self._count
+
+    def sample(self, tag=0):
+        # tag: unused, so the streamer can stand in for rover_telemetry.Telemetry.record
+        if not self.enabled:
+            return
+        self._calls += 1
+        now = time.ticks_us()
+        elapsed = time.ticks_diff(now, self._t_sample)
+        if elapsed < self._period_us:
+            return
+        loop_hz = self._calls * 1000000 // elapsed
+        self._calls = 0
+        self._t_sample = now
+
+        if self._count == self._size:
+            # ring full: the oldest sample goes
+            self._tail = (self._tail + 1) % self._size
+            self._count -= 1
+            self.dropped += 1
+            if self._dropped_since < 255:
+                self._dropped_since += 1
+
+        buf = self._ring
+        i = self._head * self._sample_size
+        fields = self._fields
+        rover = self._rover
+        if fields & FIELD_TIME:
+            _put16(buf, i, time.ticks_ms())
+            i += 2
+        if fields & FIELD_HEADING:
+            motion = rover.motion
+            z = int(motion.angleZ * 10) % 3600 if motion != None else 0
+            _put16(buf, i, z - 3600 if z >= 1800 else z)
+            i += 2
+        if fields & FIELD_DISTANCE:
+            _put16(buf, i, min(0xffff, int(rover.ultrasonic.last_cm() * 10)))
+            i += 2
+        if fields & FIELD_SPEEDS:
+            buf[i] = int(rover.m1_speed) & 0xff
+            buf[i + 1] = int(rover.m2_speed) & 0xff
+            i += 2
+        if fields & FIELD_LINE:
+            pcf = rover._pcf
+            buf[i] = pcf.snapshot() & 0x0f if pcf != None else 0xff
+            i += 1
+        if fields & FIELD_LOOP_HZ:
+            _put16(buf, i, min(0xffff, loop_hz))
+        self._head = (self._head + 1) % self._size
+        self._count += 1
+        self.samples += 1
+
+    record = sample
+
+    def send_pending(self, max_frames=1):
+        # send up to max_frames frames of the oldest samples, returns the number sent
+        sent = 0
+        while sent < max_frames:
+            if self._out == None:
+                if not self._count:
+                    break
+                self._out = self.__next_frame()
+                self._out_pos = 0
+            try:
+                self.__send_rest()
+            except OSError:
+                # link busy or gone: the frame goes on from this piece next time
+                self.send_errors += 1
+                break
+            self._out = None
+            self.frames += 1
+            sent += 1
+        self._t_frame = time.ticks_ms()
+        return sent
+
+    def __next_frame(self):
+        # the oldest samples (taken off the ring) as the message to send
+        size = self._sample_size
+        n = self._count if self._count < self._per_frame else self._per_frame
+        frame = self._frame
+        frame[0] = TELEMETRY_HEADER
+        frame[1] = self._fields
+        frame[2] = self._seq
+        frame[3] = n
+        frame[4] = self._dropped_since
+        j = _TELEMETRY_HEAD
+        k = self._tail
+        ring = self._ring
+        for _ in range(n):
+            i = k * size
+            for b in range(size):
+                frame[j + b] = ring[i + b]
+            j += size
+            k = (k + 1) % self._size
+        self._tail = k
+        self._count -= n
+        self._seq = (self._seq + 1) & 0xff
+        self._dropped_since = 0
+        payload = memoryview(frame)[:j]
+        if self.text:
+            return '$' + b2a_base64(payload).decode().strip()
+        return bytes(payload)
+
+    def __send_rest(self):
+        # the pieces of the current message not sent yet, max_msg characters each
+        out = self._out
+        step = self.max_msg
+        while self._out_pos < len(out):
+            i = self._out_pos
+            if not self.text:
+                piece = out[i:i + step]
+                i += step
+            elif i == 0:
+                piece = out[:step]
+                i = step
+            else:
+                piece = '+' + out[i:i + step - 1]
+                i += step - 1
+            self._send(piece)
+            self._out_pos = i
+            self.messages += 1
+
+    async def run(self, period_ms=None):
+        # sample at the configured rate, send full frames, or what is there every max_delay_ms
+        period_ms = period_ms or max(1, self._period_us // 1000)
+        while True:
+            self.sample()
+            if self.enabled and (self._out != None or self._count and (self._count >= self._per_frame or
+                    time.ticks_diff(time.ticks_ms(), self._t_frame) >= self.max_delay_ms)):
+                self.send_pending()
+            await asyncio.sleep_ms(period_ms)
+
@@ -0,0 +1,84 @@
+import time
+import uasyncio as asyncio
+from array import array
+from micropython import const
+
+_QUEUE_SIZE = const(16)
+
+
+class EventBus:
+    """
+    Bounded queue of (event, value) pairs shared by all inputs.
+
+    Producers (button, IR, BLE callbacks) call post() or post_mapped(), which
+    only store two small ints, never allocate and never block. The value is
+    an int, saturated to -32768..32767 (convert floats before posting). When the queue
+    is full the new event is dropped and counted in drops.
+    The main program takes events with get() and sleeps in wait(), which
+    returns as soon as something is queued.
+
+    A keymap is a dict from an input code (IR command, BLE message...) to an
+    (event, value) tuple, so decoding an input is one dict lookup.
+    """
+    def __init__(self, size=_QUEUE_SIZE):
+        self._size = size
+        self._events = bytearray(size)
+        self._values = array('h', (0 for _ in range(size)))
+        self._head = 0 # written by post() only
+        self._tail = 0 # written by get() only
+        self._flag = asyncio.ThreadSafeFlag()
+        self.drops = 0
+        self.unmapped = 0
+
+    def post(self, event, value=0):
+        head = self._head
+        nxt = (head + 1) % self._size
+        if nxt == self._tail:
+            self.drops += 1
+            return False
+        self._events[head] = event
+        self._values[head] = -32768 if value < -32768 else 32767 if value > 32767 else value
+        self._head = nxt
+        self._flag.set()
+        return True
+
+    def post_mapped(self, keymap, code, default=None):
+        # default: (event, value) posted for codes missing from the keymap
+        entry = keymap.get(code, default)
+        if entry == None:
+            self.unmapped += 1
+            return False
+        return self.post(entry[0], entry[1])
+
+    def pending(self):
+        return (self._head - self._tail) % self._size
+
+    def get(self):
+        # oldest (event, value) or None if the queue is empty
+        tail = self._tail
+        if tail == self._head:
+            return None
+        event = (self._events[tail], self._values[tail])
+        self._tail = (tail + 1) % self._size
+        return event
+
+    def clear(self):
+        self._tail = self._head
+
+    async def wait(self, timeout_ms=None):
+        # True as soon as an event is queued, False after timeout_ms without one
+        if timeout_ms == None:
+            while self._head == self._tail:
+                await self._flag.wait()
+            return True
+
+        deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while self._head == self._tail:
+            left = time.ticks_diff(deadline, time.ticks_ms())
+            if left <= 0:
+                return False
+            try:
+                await asyncio.wait_for_ms(self._flag.wait(), left)
+            except asyncio.TimeoutError:
+                return self._head != self._tail
+        return True
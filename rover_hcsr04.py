@@ -1 +1 @@
-import machine, timefrom machine import Pinfrom yolobit import *from micropython import const__version__ = '0.2.0'__author__ = 'Roberto Sánchez'__license__ = "Apache License 2.0. https://www.apache.org/licenses/LICENSE-2.0"_MAX_DISTANCE_CM = const(200) #cmclass HCSR04:    """    Driver to use the untrasonic sensor HC-SR04.    The sensor range is between 2cm and 4m.    The timeouts received listening to echo pin are converted to OSError('Out of range')    """    # echo_timeout_us is based in chip range limit (400cm)    def __init__(self, trigger_pin, echo_pin, echo_timeout_us=500*2*30):        """        trigger_pin: Output pin to send pulses        echo_pin: Readonly pin to measure the distance. The pin should be protected with 1k resistor        echo_timeout_us: Timeout in microseconds to listen to echo pin.         By default is based in sensor limit range (4m)        """        self.echo_timeout_us = echo_timeout_us        self._ars = []        self._ats = []        # Init trigger pin (out)        self.trigger = Pin(trigger_pin, mode=Pin.OUT, pull=None)        self.trigger.value(0)        # Init echo pin (in)        self.echo = Pin(echo_pin, mode=Pin.IN, pull=None)            def _send_pulse_and_wait(self):        """        Send the pulse to trigger and listen on echo pin.        We use the method `machine.time_pulse_us()` to get the microseconds until the echo is received.        """        self.trigger.value(0) # Stabilize the sensor        time.sleep_us(5)        self.trigger.value(1)        # Send a 10us pulse.        time.sleep_us(10)        self.trigger.value(0)        try:            pulse_time = machine.time_pulse_us(self.echo, 1, self.echo_timeout_us)            return pulse_time        except OSError as ex:            if ex.args[0] == 110: # 110 = ETIMEDOUT                raise OSError('Out of range')            raise ex    def distance_mm(self):        return self.distance_cm()*10    def distance_cm(self, filter=True):        """        Get the distance in centimeters with floating point operations.        It returns a float        """        pulse_time = self._send_pulse_and_wait()        # To calculate the distance we get the pulse_time and divide it by 2         # (the pulse walk the distance twice) and by 29.1 becasue        # the sound speed on air (343.2 m/s), that It's equivalent to        # 0.034320 cm/us that is 1cm each 29.1us        cms = (pulse_time / 2) / 29.1                if cms < 0 or cms > _MAX_DISTANCE_CM:            cms = _MAX_DISTANCE_CM        if not filter:            return cms                self._ars.append(cms)        self._ats.append(time.time_ns())        if len(self._ars) > 5:            self._ars.pop(0)            self._ats.pop(0)        while True:            if self._ats[len(self._ats) - 1] - self._ats[0] > 5e8:                self._ars.pop(0)                self._ats.pop(0)            else:                break        if len(self._ars) < 2:            time.sleep_ms(30)            pulse_time = self._send_pulse_and_wait()            cms = (pulse_time / 2) / 29.1            if cms < 0 or cms > _MAX_DISTANCE_CM:                cms = _MAX_DISTANCE_CM            self._ars.append(cms)            self._ats.append(time.time_ns())                N = len(self._ars)        Fi = Fd = [1] * N        maxd = vald = 0        for i in range(N):            for j in range(i):                if (self._ars[i] >= self._ars[j]) and (self._ars[i] - self._ars[j]) < 10:                    Fi[i] = max(Fi[i], Fi[j] + 1)                if (self._ars[i] <= self._ars[j]) and (self._ars[j] - self._ars[i]) < 10:                    Fd[i] = max(Fd[i], Fd[j] + 1)                if maxd < Fi[i] or maxd < Fd[i]:                    maxd = max(Fi[i], Fd[i])                    vald = self._ars[i]        if maxd <= N/2:            vald = sum(self._ars) / N                return round(vald * 10) / 10
\ No newline at end of file
+import machine, timefrom machine import Pinfrom array import arrayfrom yolobit import *from micropython import const__version__ = '0.2.0'__author__ = 'Roberto Sánchez'__license__ = "Apache License 2.0. https://www.apache.org/licenses/LICENSE-2.0"_MAX_DISTANCE_CM = const(200) #cm_MAX_WIDTH_US = const(11640)    # echo width of _MAX_DISTANCE_CM, stored when no echo came back_RING_SIZE = const(5)           # samples kept for the median filter_MAX_AGE_MS = const(500)        # samples older than this are not filtered_MIN_INTERVAL_MS = const(60)    # datasheet minimum measurement cycleclass HCSR04:    """    Driver to use the untrasonic sensor HC-SR04.    The sensor range is between 2cm and 4m.    Ranging is interrupt driven: distance_cm() fires the trigger (at most every    60ms), the echo edges are timestamped in a pin IRQ and the pulse widths go    into a small ring buffer. distance_cm() returns at once with the median of    the recent samples; age_ms() tells how old the newest one is.    A measurement without echo (nothing in range, ~38ms pulse, or no pulse    before the next trigger) counts as _MAX_DISTANCE_CM, and so does a newest    sample older than _MAX_AGE_MS: an obstacle that left is not kept.    """    # echo_timeout_us is based in chip range limit (400cm)    def __init__(self, trigger_pin, echo_pin, echo_timeout_us=500*2*30):        """        trigger_pin: Output pin to send pulses        echo_pin: Readonly pin to measure the distance. The pin should be protected with 1k resistor        echo_timeout_us: Longest echo pulse accepted, and how long the first        distance_cm() call waits for a sample. By default is based in sensor limit range (4m)        """        self.echo_timeout_us = echo_timeout_us        # ring buffer of echo widths (us) and the ticks_ms they were taken at        self._widths = array('i', (0 for _ in range(_RING_SIZE)))        self._times = array('i', (0 for _ in range(_RING_SIZE)))        self._sorted = array('i', (0 for _ in range(_RING_SIZE)))        self._head = 0        self._count = 0        self._rise = 0        self._high = False # echo edge expected next: False rising, True falling        self._waiting = False # triggered, no falling echo edge yet        self._last_trigger = time.ticks_add(time.ticks_ms(), -_MIN_INTERVAL_MS)        self._filtered = _MAX_DISTANCE_CM        self._filtered_head = -1        self.timeouts = 0        # Init trigger pin (out)        self.trigger = Pin(trigger_pin, mode=Pin.OUT, pull=None)        self.trigger.value(0)        # Init echo pin (in)        self.echo = Pin(echo_pin, mode=Pin.IN, pull=None)        self._echo_ref = self._echo_irq        # hard IRQ: the edge is timestamped when it happens, not when the scheduler gets to it        self.echo.irq(handler=self._echo_ref, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, hard=True)    def _echo_irq(self, pin):        # Hard interrupt context: only ints and preallocated arrays, no allocation.        # The edge direction comes from _high, the pin may have changed again by now.        t = time.ticks_us()        if not self._high:            self._rise = t            self._high = True            return        self._high = False        self._waiting = False        width = time.ticks_diff(t, self._rise)        if width <= 0 or width > self.echo_timeout_us:            self.timeouts += 1            width = _MAX_WIDTH_US        self._push(width)    def _push(self, width):        i = self._head        self._widths[i] = width        self._times[i] = time.ticks_ms()        self._head = (i + 1) % _RING_SIZE        if self._count < _RING_SIZE:            self._count += 1    def _trigger(self):        """        Send a 10us pulse to trigger a measurement if the previous one is done.        """        now = time.ticks_ms()        if time.ticks_diff(now, self._last_trigger) < _MIN_INTERVAL_MS:            return        self._last_trigger = now        if self._waiting:            # no echo since the last trigger: nothing in range            irq_state = machine.disable_irq()            self.timeouts += 1            self._push(_MAX_WIDTH_US)            machine.enable_irq(irq_state)        self._waiting = True        self._high = False # the echo is low between measurements        self.trigger.value(0) # Stabilize the sensor        time.sleep_us(5)        self.trigger.value(1)        # Send a 10us pulse.        time.sleep_us(10)        self.trigger.value(0)    def _width_to_cm(self, width):        # To calculate the distance we get the pulse_time and divide it by 2         # (the pulse walk the distance twice) and by 29.1 becasue        # the sound speed on air (343.2 m/s), that It's equivalent to        # 0.034320 cm/us that is 1cm each 29.1us        cms = (width / 2) / 29.1        if cms < 0 or cms > _MAX_DISTANCE_CM:            cms = _MAX_DISTANCE_CM        return cms    def _update_filter(self):        # median of the samples taken in the last _MAX_AGE_MS, recomputed only        # on new data or once the newest sample is too old        head = self._head        newest = (head - 1) % _RING_SIZE        now = time.ticks_ms()        fresh = self._count and time.ticks_diff(now, self._times[newest]) <= _MAX_AGE_MS        if self._filtered_head == head and fresh:            return        srt = self._sorted        n = 0        for k in range(self._count):            i = (newest - k) % _RING_SIZE            if time.ticks_diff(now, self._times[i]) > _MAX_AGE_MS:                break            # insertion sort into the preallocated buffer            w = self._widths[i]            j = n            while j > 0 and srt[j - 1] > w:                srt[j] = srt[j - 1]                j -= 1            srt[j] = w            n += 1        self._filtered = self._width_to_cm(srt[n // 2]) if n else _MAX_DISTANCE_CM        self._filtered_head = head    def age_ms(self):        """        Age in ms of the newest sample, -1 if there is none yet.        """        if not self._count:            return -1        return time.ticks_diff(time.ticks_ms(), self._times[(self._head - 1) % _RING_SIZE])    def distance_mm(self):        return self.distance_cm()*10    def distance_cm(self, filter=True):        """        Get the latest distance in centimeters (float), without waiting for the echo.        Starts a new measurement when the sensor is ready for one.        """        self._trigger()        if not self._count:            # first call: wait once for a sample            t0 = time.ticks_us()            while not self._count and time.ticks_diff(time.ticks_us(), t0) < self.echo_timeout_us:                pass            if not self._count:                return _MAX_DISTANCE_CM        if not filter:            if self.age_ms() > _MAX_AGE_MS:                return _MAX_DISTANCE_CM            return round(self._width_to_cm(self._widths[(self._head - 1) % _RING_SIZE]) * 10) / 10        self._update_filter()        return round(self._filtered * 10) / 10    def last_cm(self):        """        The filtered distance of the last distance_cm() call, without any        measurement (for logging from hot paths).        """        return self._filtered    def read(self, filter=True):        """        Returns (distance_cm, age_ms) of the latest value.        """        return (self.distance_cm(filter), self.age_ms())
\ No newline at end of file
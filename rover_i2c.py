@@ -0,0 +1,86 @@
+import machine
+from micropython import const
+
+# Set to True before importing rover to use the hardware I2C peripheral
+USE_HARDWARE_I2C = False
+I2C_FREQ = const(400000)
+
+class I2CBus:
+    """
+    Shared I2C bus for all Rover peripherals.
+
+    The bus is scanned once and scan() returns the cached result, so drivers
+    probing for their address do not each hit the bus. The read/write methods
+    are the ones of the underlying machine.I2C/SoftI2C object (no wrapper cost),
+    so an I2CBus can be passed wherever an i2c object is expected.
+
+    Use `with bus:` around multi-step sequences in the main program. Code run
+    from timer/scheduled callbacks must call try_acquire() and skip its work
+    when it returns False, so it never interleaves with such a sequence.
+    """
+    def __init__(self, scl=22, sda=21, freq=I2C_FREQ, hardware=None, bus_id=0):
+        if hardware == None:
+            hardware = USE_HARDWARE_I2C
+        if hardware:
+            self.i2c = machine.I2C(bus_id, scl=machine.Pin(scl), sda=machine.Pin(sda), freq=freq)
+        else:
+            self.i2c = machine.SoftI2C(scl=machine.Pin(scl), sda=machine.Pin(sda), freq=freq)
+        self.hardware = hardware
+
+        i2c = self.i2c
+        self.readfrom_into = i2c.readfrom_into
+        self.readfrom_mem = i2c.readfrom_mem
+        self.readfrom_mem_into = i2c.readfrom_mem_into
+        self.writeto = i2c.writeto
+        self.writeto_mem = i2c.writeto_mem
+        # hardware I2C has no bare start/stop conditions, the transactions send their own
+        self.start = self._no_op if hardware else i2c.start
+        self.stop = self._no_op if hardware else i2c.stop
+
+        self._devices = None
+        self._depth = 0
+
+    def _no_op(self):
+        pass
+
+    def scan(self, refresh=False):
+        if self._devices == None or refresh:
+            try:
+                self._devices = self.i2c.scan()
+            except OSError:
+                self._devices = []
+        return self._devices
+
+    def has(self, address):
+        return address in self.scan()
+
+    # lock
+
+    def try_acquire(self):
+        if self._depth:
+            return False
+        self._depth = 1
+        return True
+
+    def release(self):
+        if self._depth:
+            self._depth -= 1
+
+    def locked(self):
+        return self._depth > 0
+
+    def __enter__(self):
+        self._depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+_bus = None
+
+def get_bus():
+    global _bus
+    if _bus == None:
+        _bus = I2CBus()
+    return _bus
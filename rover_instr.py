@@ -0,0 +1,184 @@
+import gc
+from array import array
+from time import ticks_us, ticks_diff
+from micropython import const
+
+# Opt-in timing of the Rover hot paths.
+#
+#   import rover_instr
+#   rover_instr.enable(rover)      # wrap the driving, sensor and I2C methods
+#   ...
+#   rover_instr.dump()             # or rover_instr.dump(ble.send, rover_ble.BLE_MSG_MAX)
+#
+# Nothing is wrapped until enable() is called, so a program that does not
+# enable it runs the original methods. probe() returns a shared no-op probe
+# while disabled, so begin()/end() pairs left in a loop cost two empty calls.
+
+_BINS = const(16) # bin i: durations below 2**i us, the last bin takes the rest
+
+_enabled = False
+_probes = {}
+_wrapped = [] # (object, attribute, original) to restore on disable()
+_i2c_count = 0 # I2C transactions issued since enable()
+
+
+class Probe:
+    """
+    Counts calls of one code path with their duration (min/mean/max and a
+    log2 histogram in us), the bytes allocated and the I2C transactions made.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.hist = array('I', (0 for _ in range(_BINS)))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+        self.alloc = 0
+        self.i2c = 0
+        for i in range(_BINS):
+            self.hist[i] = 0
+        self._t = 0
+        self._mem = 0
+        self._i2c = 0
+        self._open = False
+
+    def begin(self):
+        self._open = True
+        self._mem = gc.mem_alloc()
+        self._i2c = _i2c_count
+        self._t = ticks_us()
+
+    def end(self):
+        # no-op without a begin(), so a loop can call end(); begin() at its top
+        if not self._open:
+            return
+        self._open = False
+        self.record(ticks_diff(ticks_us(), self._t), gc.mem_alloc() - self._mem, _i2c_count - self._i2c)
+
+    def record(self, us, alloc=0, i2c=0):
+        if not self.count or us < self.min_us:
+            self.min_us = us
+        if us > self.max_us:
+            self.max_us = us
+        self.count += 1
+        self.total_us += us
+        if alloc > 0: # a collection during the call makes the delta negative
+            self.alloc += alloc
+        self.i2c += i2c
+        b = 0
+        while us and b < _BINS - 1:
+            us >>= 1
+            b += 1
+        self.hist[b] += 1
+
+    def mean_us(self):
+        return self.total_us // self.count if self.count else 0
+
+
+class _NullProbe:
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+_null_probe = _NullProbe()
+
+
+def probe(name):
+    # probe for a code path of the program, e.g. one mode loop iteration
+    if not _enabled:
+        return _null_probe
+    p = _probes.get(name)
+    if p == None:
+        p = _probes[name] = Probe(name)
+    return p
+
+def wrap(obj, attr, name=None):
+    # replace obj.attr by a timed version, restored by disable()
+    fn = getattr(obj, attr)
+    p = probe(name or attr)
+    if p is _null_probe:
+        return
+
+    def timed(*args, **kwargs):
+        mem = gc.mem_alloc()
+        i2c = _i2c_count
+        t = ticks_us()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            p.record(ticks_diff(ticks_us(), t), gc.mem_alloc() - mem, _i2c_count - i2c)
+
+    _wrapped.append((obj, attr, fn))
+    setattr(obj, attr, timed)
+
+def _count_i2c(bus, attr):
+    fn = getattr(bus, attr)
+
+    def counted(*args):
+        global _i2c_count
+        _i2c_count += 1
+        return fn(*args)
+
+    _wrapped.append((bus, attr, fn))
+    setattr(bus, attr, counted)
+
+def enable(rover=None):
+    global _enabled, _i2c_count
+    if _enabled:
+        return
+    _enabled = True
+    if rover == None:
+        return
+
+    for attr in ('readfrom_into', 'readfrom_mem', 'readfrom_mem_into', 'writeto', 'writeto_mem'):
+        _count_i2c(rover.i2c, attr)
+    for attr in ('set_wheel_speed', 'stop', 'read_line_sensors'):
+        wrap(rover, attr)
+    motion = rover.motion
+    if motion != None:
+        wrap(motion, 'updateZ', 'motion.updateZ')
+        wrap(motion, 'update', 'motion.update')
+    _i2c_count = 0 # not the calibration done by constructing motion
+
+def disable():
+    global _enabled
+    while _wrapped:
+        obj, attr, fn = _wrapped.pop()
+        setattr(obj, attr, fn)
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    global _i2c_count
+    _i2c_count = 0
+    for p in _probes.values():
+        p.reset()
+
+def dump(write=print, width=0):
+    # two lines per probe, then its non-empty histogram bins; with width
+    # (e.g. rover_ble.BLE_MSG_MAX for ble.send) longer lines go out in pieces
+    _write(write, width, 'i2c total {}'.format(_i2c_count))
+    for name in sorted(_probes):
+        p = _probes[name]
+        _write(write, width, '{} n={} us={}/{}/{}'.format(name, p.count, p.min_us, p.mean_us(), p.max_us))
+        _write(write, width, '{} alloc={} i2c={}'.format(name, p.alloc, p.i2c))
+        for b in range(_BINS - 1):
+            if p.hist[b]:
+                _write(write, width, '{} <{}us: {}'.format(name, 1 << b, p.hist[b]))
+        if p.hist[_BINS - 1]:
+            _write(write, width, '{} >={}us: {}'.format(name, 1 << (_BINS - 2), p.hist[_BINS - 1]))
+
+def _write(write, width, line):
+    if width <= 0:
+        write(line)
+        return
+    for i in range(0, len(line), width):
+        write(line[i:i + width])
@@ -1,11 +1,10 @@
 # Author: Peter Hinch
 # Copyright Peter Hinch 2020-2021 Released under the MIT license
 
-import gc
 from machine import Timer, Pin
 from array import array
 from utime import ticks_ms, ticks_us, ticks_diff
-from micropython import const
+from micropython import const, schedule
 
 # Save RAM
 from micropython import alloc_emergency_exception_buf
@@ -62,6 +61,54 @@ _errors = {_BADSTART : 'Invalid start pulse',
 _EDGES = const(68)
 _TBLOCK = const(80)
 
+# Without an on_received() callback, decoded keys are pushed by the timer
+# callback into a ring buffer read by get_events()/poll(). One producer and one
+# consumer, so no locking is needed.
+_QUEUE_SIZE = const(16) # power of 2
+_QUEUE_MASK = const(_QUEUE_SIZE - 1)
+
+def decode_nec(widths, n):
+    """
+    Decode one NEC frame from pulse durations, whatever captured them.
+    widths[i]: duration in us between edge i and edge i+1 (marks and spaces
+    alternate, starting with the 9ms leading mark), n: number of edges.
+    Returns cmd | (addr << 8), or a negative code (_REPEAT or an error).
+    Works on small ints only so it can run on the host or in a callback.
+    """
+    if n > _EDGES:
+        return _OVERRUN
+    if n < 3:
+        return _BADSTART
+    #if widths[0] < 4000:  # 9ms leading mark for all valid data
+    #    return _BADSTART
+    width = widths[1]
+    if width > 2500:  # 4.5ms space for normal data
+        #if n < 68:  # Haven't received the correct number of edges
+        #    return _BADBLOCK
+        # Time spaces only (marks are always 562.5us)
+        # Space is 1.6875ms (1) or 562.5us (0), LSB first:
+        # address, inverted address, command, inverted command
+        addr = addr_inv = cmd = 0
+        for bit in range(32):
+            i = 3 + 2 * bit
+            if i >= n - 1:
+                break
+            if widths[i] > 1120:
+                if bit < 8:
+                    addr |= 1 << bit
+                elif bit < 16:
+                    addr_inv |= 1 << (bit - 8)
+                elif bit < 24:
+                    cmd |= 1 << (bit - 16)
+        #if cmd != cmd_inv ^ 0xff:
+        #    return _BADDATA
+        if addr != addr_inv ^ 0xff:  # 8 bit addr doesn't match check
+            addr |= addr_inv << 8  # pass assumed 16 bit address to callback
+        return cmd | (addr << 8)
+    elif width > 50: # 2.5ms space for a repeat code. Should have exactly 4 edges.
+        return _REPEAT
+    return _BADSTART
+
 class IR_RX():
     def __init__(self, pin, callback=None, error_callback=None):
         self._pin = pin
@@ -76,9 +123,31 @@ class IR_RX():
         self._key_pressed = None
         self._last_key_pressed = None
         self._last_key_pressed_time = 0
-        self._raw_code = None
+        # last raw code, formatted only when get_raw_code() asks for it
+        self._raw_cmd = 0
+        self._raw_addr = 0
+        self._raw_state = 0 # 0: none, 1: data, 2: unsupported
+
+        # event queue: key, address, 1 if repeat code, ticks_ms
+        self._q_cmd = array('h', (0 for _ in range(_QUEUE_SIZE)))
+        self._q_addr = array('H', (0 for _ in range(_QUEUE_SIZE)))
+        self._q_repeat = array('B', (0 for _ in range(_QUEUE_SIZE)))
+        self._q_time = array('i', (0 for _ in range(_QUEUE_SIZE)))
+        self._q_head = 0 # written by the decoder only
+        self._q_tail = 0 # written by the consumer only
+
+        # counters
+        self.drops = 0    # events lost because the queue was full
+        self.schedule_drops = 0 # callbacks lost because the schedule queue was full
+        self.overruns = 0 # frames with too many edges
+        self.repeats = 0  # NEC repeat codes received
+
+        # callbacks run later through micropython.schedule, not in the timer callback
+        self._dispatch_ref = self._dispatch
+        self._dispatch_error_ref = self._dispatch_error
 
         self._times = array('i',  (0 for _ in range(_EDGES + 1)))  # +1 for overrun
+        self._widths = array('i',  (0 for _ in range(_EDGES)))  # durations between edges
         self.edge = 0
         self.cb = self._decode
         self.start()
@@ -97,43 +166,24 @@ class IR_RX():
         if self.verbose:
             self._print_raw()
 
-        try:
-            if self.edge > 68:
-                raise RuntimeError(_OVERRUN)
-            width = ticks_diff(self._times[1], self._times[0])
-            #if width < 4000:  # 9ms leading mark for all valid data
-            #    raise RuntimeError(BADSTART)
-            width = ticks_diff(self._times[2], self._times[1])
-            if width > 2500:  # 4.5ms space for normal data
-                #if self.edge < 68:  # Haven't received the correct number of edges
-                #    raise RuntimeError(BADBLOCK)
-                # Time spaces only (marks are always 562.5µs)
-                # Space is 1.6875ms (1) or 562.5µs (0)
-                # Skip last bit which is always 1
-                val = 0
-                for edge in range(3, 68 - 2, 2):
-                    val >>= 1
-                    if ticks_diff(self._times[edge + 1], self._times[edge]) > 1120:
-                        val |= 0x80000000
-            elif width > 50: # 2.5ms space for a repeat code. Should have exactly 4 edges.
-                raise RuntimeError(_REPEAT if (self.edge >= 3 or self.edge <= 8) else _BADREP)  # Treat REPEAT as error.
-            else:
-                raise RuntimeError(_BADSTART)
-            addr = val & 0xff  # 8 bit addr
-            cmd = (val >> 16) & 0xff
-            #if cmd != (val >> 24) ^ 0xff:
-            #    raise RuntimeError(_BADDATA)
-            if addr != ((val >> 8) ^ 0xff) & 0xff:  # 8 bit addr doesn't match check
-                #if not self._extended:
-                #    raise RuntimeError(_BADADDR)
-                addr |= val & 0xff00  # pass assumed 16 bit address to callback
+        # edge timestamps -> durations between edges, then the common NEC decoder
+        n = self.edge
+        widths = self._widths
+        for i in range((n if n <= _EDGES else _EDGES) - 1):
+            widths[i] = ticks_diff(self._times[i + 1], self._times[i])
+        self._decode_widths(n)
+
+    def _decode_widths(self, n):
+        res = decode_nec(self._widths, n)
+        if res >= 0:
+            cmd = res & 0xff
+            addr = res >> 8
             self._addr = addr
-        except RuntimeError as e:
-            cmd = e.args[0]
+        else:
+            cmd = res
             addr = self._addr if cmd == _REPEAT else 0  # REPEAT uses last address
-        # Set up for new data burst and run user callback
+        # Set up for new data burst, schedule the user callback or queue the event
         self.do_callback(cmd, addr, 0, _REPEAT)
-        gc.collect()
 
     def _print_raw(self):
         lb = self.edge - 1  # Possible length of burst
@@ -151,29 +201,39 @@ class IR_RX():
     def do_callback(self, cmd, addr, ext, thresh=0):
         self.edge = 0
         if cmd >= thresh:
+            repeat = 0
             if cmd < 0:  # NEC protocol sends repeat codes.
-                #self._raw_code = 'Repeat code'
+                self.repeats += 1
                 if self.verbose:
                     print('Repeat code.')
                 # keep data old
                 if (ticks_ms() - self._last_key_pressed_time) < 1000:
                     self._key_pressed = self._last_key_pressed
+                    repeat = 1
                 else:
                     # last data is too old
                     return
             else:
-                self._raw_code = 'Data: {:d}, Addr: {:d}'.format(cmd, addr)
+                self._raw_cmd = cmd
+                self._raw_addr = addr
+                self._raw_state = 1
                 if self.verbose:
-                    print(self._raw_code)
+                    print(self.get_raw_code())
                 self._key_pressed = cmd
                 self._last_key_pressed = self._key_pressed
 
             self._last_key_pressed_time = ticks_ms()
-
             if self._callback:
-                self._callback(self._key_pressed, addr, ext)
+                try:
+                    schedule(self._dispatch_ref, (self._key_pressed & 0xff) | ((addr & 0xffff) << 8))
+                except RuntimeError:
+                    self.schedule_drops += 1
+            else:
+                self.__push(self._key_pressed, addr, repeat)
         else:
-            self._raw_code = 'Unsupported code'
+            self._raw_state = 2
+            if cmd == _OVERRUN:
+                self.overruns += 1
             if self.verbose:
                 if cmd in _errors:
                     print(_errors[cmd])
@@ -183,9 +243,60 @@ class IR_RX():
             #self._key_pressed = None
             #self._last_key_pressed = None
             if self._error_callback:
-                self._error_callback(cmd)
+                try:
+                    schedule(self._dispatch_error_ref, cmd)
+                except RuntimeError:
+                    pass
+
+    def __push(self, cmd, addr, repeat):
+        head = self._q_head
+        if ((head + 1) & _QUEUE_MASK) == self._q_tail:
+            self.drops += 1 # full, keep the older events
+            return
+        self._q_cmd[head] = cmd
+        self._q_addr[head] = addr & 0xffff
+        self._q_repeat[head] = repeat
+        self._q_time[head] = ticks_ms()
+        self._q_head = (head + 1) & _QUEUE_MASK
+
+    def _dispatch(self, arg):
+        if self._callback:
+            self._callback(arg & 0xff, arg >> 8, 0)
+
+    def _dispatch_error(self, cmd):
+        if self._error_callback:
+            self._error_callback(cmd)
+
+    def pending(self):
+        return (self._q_head - self._q_tail) & _QUEUE_MASK
+
+    def poll(self):
+        # oldest queued key code (repeats included), None if the queue is empty
+        tail = self._q_tail
+        if tail == self._q_head:
+            return None
+        cmd = self._q_cmd[tail]
+        self._q_tail = (tail + 1) & _QUEUE_MASK
+        return cmd
+
+    def get_events(self, max_events=_QUEUE_SIZE):
+        # all queued events, oldest first, as (key, addr, is_repeat, ticks_ms) tuples
+        events = []
+        tail = self._q_tail
+        while tail != self._q_head and len(events) < max_events:
+            events.append((self._q_cmd[tail], self._q_addr[tail], self._q_repeat[tail] == 1, self._q_time[tail]))
+            tail = (tail + 1) & _QUEUE_MASK
+        self._q_tail = tail
+        return events
+
+    def clear_events(self):
+        self._q_tail = self._q_head
+
+    def reset_stats(self):
+        self.drops = self.schedule_drops = self.overruns = self.repeats = 0
 
     def on_received(self, cb):
+        # cb(key, addr, ext) for every key; while one is set the queue stays empty
         self._callback = cb
     
     def on_error(self, cb):
@@ -195,10 +306,14 @@ class IR_RX():
         return self._key_pressed
     
     def get_raw_code(self):
-        return self._raw_code
+        if self._raw_state == 1:
+            return 'Data: {:d}, Addr: {:d}'.format(self._raw_cmd, self._raw_addr)
+        if self._raw_state == 2:
+            return 'Unsupported code'
+        return None
     
     def clear_code(self):
-        self._raw_code = None
+        self._raw_state = 0
         self._key_pressed = None
 
     def start(self):
@@ -210,3 +325,63 @@ class IR_RX():
         self._pin.irq(handler = None)
         if self._tim:
             self._tim.deinit()
+
+
+class IR_RX_RMT(IR_RX):
+    """
+    IR receiver that lets a hardware peripheral capture the pulse train instead
+    of taking one Python interrupt per edge (up to 68 per NEC frame).
+
+    rmt: a receive-capable capture object. Its read_pulses() must return the
+    durations (us, the sign/level is ignored) of the last complete frame, or
+    None/empty if none arrived since the previous call. It is polled from
+    Timer(3) every poll_ms and the durations go to the same NEC decoder as IR_RX.
+
+    Firmware: mainline MicroPython's esp32.RMT only transmits, it has no
+    read_pulses(), and neither has the stock Yolo:Bit firmware built on it.
+    This backend needs a firmware with an RMT receive binding added (or any
+    other capture object with read_pulses()); on stock firmware
+    create_ir_rx() uses the pin-interrupt IR_RX. sim/ir.py replays NEC pulse
+    trains, synthetic or recorded with IR_RX.verbose, through both backends.
+    """
+    def __init__(self, pin, rmt, callback=None, error_callback=None, poll_ms=20):
+        self._rmt = rmt
+        self._poll_ms = poll_ms
+        self._poll_ref = self._poll
+        super().__init__(pin, callback, error_callback)
+
+    def _poll(self, _):
+        pulses = self._rmt.read_pulses()
+        if not pulses:
+            return
+        n = len(pulses)
+        if n > _EDGES - 1:
+            n = _EDGES - 1
+            self.edge = _EDGES + 1 # report the overrun
+        else:
+            self.edge = n + 1 # n durations between n + 1 edges
+        widths = self._widths
+        for i in range(n):
+            w = pulses[i]
+            widths[i] = w if w >= 0 else -w
+        self._decode_widths(self.edge)
+
+    def _print_raw(self):
+        pass
+
+    def start(self):
+        self.stop()
+        self._tim = Timer(3)
+        self._tim.init(period=self._poll_ms, mode=Timer.PERIODIC, callback=self._poll_ref)
+
+    def stop(self):
+        if self._tim:
+            self._tim.deinit()
+
+
+def create_ir_rx(pin, rmt=None, callback=None, error_callback=None):
+    # RMT capture when a receive-capable capture object is given (not on stock
+    # firmware, see IR_RX_RMT), else pin interrupts
+    if rmt != None and hasattr(rmt, 'read_pulses'):
+        return IR_RX_RMT(pin, rmt, callback, error_callback)
+    return IR_RX(pin, callback, error_callback)
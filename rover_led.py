@@ -0,0 +1,276 @@
+import time
+from array import array
+from machine import Timer
+from micropython import const, schedule
+
+LED_TIMER_ID = const(0) # Timer(1) ramps the motors, Timer(2) samples the IMU, Timer(3) decodes IR
+
+LAYER_USER = const(0)
+LAYER_STATUS = const(1)
+_LAYERS = const(2)
+
+# Indicator byte of a frame: bit 0 left led, bit 1 right led,
+# bit 7 set if the frame drives the indicators (otherwise they are left alone)
+IND_LEFT = const(0x01)
+IND_RIGHT = const(0x02)
+_IND_USED = const(0x80)
+
+
+class Animation:
+    """
+    Precomputed frames packed in one bytearray. Each frame is num_leds (r, g, b)
+    triples followed by one indicator byte. On the status layer a black pixel is
+    transparent and shows the layer below.
+    """
+    def __init__(self, n_frames, num_leds=6):
+        self.num_leds = num_leds
+        self.stride = 3 * num_leds + 1
+        self.n_frames = n_frames
+        self.frames = bytearray(self.stride * n_frames)
+
+    def set_pixel(self, frame, led, color):
+        k = frame * self.stride + 3 * led
+        self.frames[k] = color[0]
+        self.frames[k + 1] = color[1]
+        self.frames[k + 2] = color[2]
+
+    def fill(self, frame, color, mask=0xff):
+        for i in range(self.num_leds):
+            if mask & (1 << i):
+                self.set_pixel(frame, i, color)
+
+    def set_indicators(self, frame, bits):
+        self.frames[frame * self.stride + self.stride - 1] = _IND_USED | bits
+
+
+def _scale(color, level, steps):
+    return (color[0] * level // steps, color[1] * level // steps, color[2] * level // steps)
+
+def blink(color, on_frames=5, off_frames=5, mask=0xff, indicators=False, num_leds=6):
+    anim = Animation(on_frames + off_frames, num_leds)
+    for f in range(on_frames):
+        anim.fill(f, color, mask)
+    if indicators:
+        for f in range(anim.n_frames):
+            anim.set_indicators(f, IND_LEFT | IND_RIGHT if f < on_frames else 0)
+    return anim
+
+def breathe(color, steps=20, num_leds=6):
+    # fade in then out, quadratic so it looks even to the eye
+    anim = Animation(2 * steps, num_leds)
+    for f in range(steps):
+        level = (f + 1) * (f + 1)
+        c = _scale(color, level, steps * steps)
+        anim.fill(f, c)
+        anim.fill(2 * steps - 1 - f, c)
+    return anim
+
+def chase(color, tail=2, num_leds=6):
+    anim = Animation(num_leds, num_leds)
+    for f in range(num_leds):
+        for t in range(tail + 1):
+            anim.set_pixel(f, (f - t) % num_leds, _scale(color, tail + 1 - t, tail + 1))
+    return anim
+
+def progress(color, levels=None, num_leds=6):
+    # one frame per level: frame k lights the first k leds (k = 0..num_leds),
+    # a single level lights them all
+    if levels == None:
+        levels = num_leds + 1
+    anim = Animation(levels, num_leds)
+    for f in range(levels):
+        lit = f * num_leds // (levels - 1) if levels > 1 else num_leds
+        anim.fill(f, color, (1 << lit) - 1)
+    return anim
+
+
+class LedAnimator:
+    """
+    Plays Animations on the Rover RGB leds (and indicator leds) from a hardware
+    timer at a fixed frame rate. LAYER_STATUS is drawn over LAYER_USER, both
+    over the base colours: those on the leds when playing started, updated by
+    set_base_pixel()/set_base_indicators() meanwhile, and shown again when
+    nothing plays any more.
+    It also runs the delayed turn-off of Rover.show_rgb_led(..., delay).
+    Frames are composed into preallocated buffers, playing does not allocate.
+    """
+    def __init__(self, rover, fps=25, timer_id=LED_TIMER_ID):
+        self._rover = rover
+        self._num_leds = rover._num_leds
+        self._stride = 3 * self._num_leds + 1
+        self._timer_id = timer_id
+        self._timer = None
+        self._periodic = False
+        self._pending = False
+        self._tick_ref = self._tick
+        self._step_ref = self._step
+        self.set_fps(fps)
+
+        self._anims = [None] * _LAYERS
+        self._frame = array('H', (0 for _ in range(_LAYERS)))
+        self._repeat = array('H', (0 for _ in range(_LAYERS)))
+        self._base = bytearray(self._stride)
+        self._out = bytearray(self._stride)
+        self.frames_late = 0
+
+        # delayed turn-off of leds set with show_rgb_led(..., delay)
+        self._off_at = array('i', (0 for _ in range(self._num_leds)))
+        self._off_pending = 0
+
+    def set_fps(self, fps):
+        self._period = max(1, 1000 // fps)
+        if self._periodic:
+            self._arm()
+
+    def play(self, anim, layer=LAYER_USER, repeat=0):
+        # repeat: number of times to play, 0 = loop until stopped
+        if not self.is_playing():
+            # keep what is on the leds now, shown again when everything stops
+            self._rover._get_rgb_frame(self._base)
+        self._anims[layer] = anim
+        self._frame[layer] = 0
+        self._repeat[layer] = repeat
+        self._arm()
+
+    def stop(self, layer=None):
+        for i in range(_LAYERS):
+            if layer == None or layer == i:
+                self._anims[i] = None
+        if not self.is_playing():
+            self._rover._set_rgb_frame(self._base)
+            self._arm()
+
+    def is_playing(self, layer=None):
+        if layer != None:
+            return self._anims[layer] != None
+        for a in self._anims:
+            if a != None:
+                return True
+        return False
+
+    def set_base_pixel(self, i, color):
+        # colour of led i under the animations, shown from the next frame
+        k = 3 * i
+        base = self._base
+        base[k] = color[0]
+        base[k + 1] = color[1]
+        base[k + 2] = color[2]
+
+    def set_base_indicators(self, mask, state):
+        k = self._stride - 1
+        bits = self._base[k] & (IND_LEFT | IND_RIGHT)
+        bits = (bits | mask) if state else (bits & ~mask)
+        self._base[k] = _IND_USED | bits
+
+    def turn_off_later(self, mask, delay):
+        deadline = time.ticks_add(time.ticks_ms(), int(delay * 1000))
+        for i in range(self._num_leds):
+            if mask & (1 << i):
+                self._off_at[i] = deadline
+        self._off_pending |= mask
+        if not self._periodic:
+            self._arm()
+
+    def cancel_off(self, mask):
+        self._off_pending &= ~mask
+
+    def _arm(self):
+        # periodic at the frame rate while playing, else one-shot for the next turn-off
+        if self.is_playing():
+            if self._timer == None:
+                self._timer = Timer(self._timer_id)
+            self._timer.init(period=self._period, mode=Timer.PERIODIC, callback=self._tick_ref)
+            self._periodic = True
+            return
+
+        self._periodic = False
+        now = time.ticks_ms()
+        wait = -1
+        for i in range(self._num_leds):
+            if self._off_pending & (1 << i):
+                left = time.ticks_diff(self._off_at[i], now)
+                if wait < 0 or left < wait:
+                    wait = left
+        if wait < 0:
+            if self._timer != None:
+                self._timer.deinit()
+                self._timer = None
+            return
+        if self._timer == None:
+            self._timer = Timer(self._timer_id)
+        self._timer.init(period=max(1, wait), mode=Timer.ONE_SHOT, callback=self._tick_ref)
+
+    def _tick(self, _):
+        if self._pending:
+            self.frames_late += 1
+            return
+        self._pending = True
+        try:
+            schedule(self._step_ref, 0)
+        except RuntimeError:
+            self._pending = False
+            self.frames_late += 1
+
+    def _step(self, _):
+        self._pending = False
+        if self._off_pending:
+            self.__turn_off_due()
+        if self.is_playing():
+            self.__render()
+        elif not self._periodic:
+            self._arm()
+
+    def __turn_off_due(self):
+        now = time.ticks_ms()
+        mask = 0
+        for i in range(self._num_leds):
+            if self._off_pending & (1 << i) and time.ticks_diff(now, self._off_at[i]) >= 0:
+                mask |= 1 << i
+        if mask:
+            self._off_pending &= ~mask
+            base = self._base
+            for i in range(self._num_leds):
+                if mask & (1 << i):
+                    # while animating, the turn-off applies to the restored colours
+                    base[3 * i] = base[3 * i + 1] = base[3 * i + 2] = 0
+                    if not self.is_playing():
+                        self._rover._set_rgb_pixel(i, 0, 0, 0)
+            if not self.is_playing():
+                self._rover._write_rgb_leds()
+
+    def __render(self):
+        out = self._out
+        stride = self._stride
+        out[:] = self._base
+
+        for layer in range(_LAYERS):
+            anim = self._anims[layer]
+            if anim == None:
+                continue
+            frames = anim.frames
+            start = self._frame[layer] * stride
+            for k in range(stride - 1):
+                if layer == LAYER_USER:
+                    out[k] = frames[start + k]
+                elif k % 3 == 0 and (frames[start + k] or frames[start + k + 1] or frames[start + k + 2]):
+                    out[k] = frames[start + k]
+                    out[k + 1] = frames[start + k + 1]
+                    out[k + 2] = frames[start + k + 2]
+            if frames[start + stride - 1] & _IND_USED:
+                out[stride - 1] = frames[start + stride - 1]
+
+            # advance, drop the layer when its repeats are done
+            f = self._frame[layer] + 1
+            if f >= anim.n_frames:
+                f = 0
+                if self._repeat[layer]:
+                    self._repeat[layer] -= 1
+                    if not self._repeat[layer]:
+                        self._anims[layer] = None
+            self._frame[layer] = f
+
+        self._rover._set_rgb_frame(out)
+        if not self.is_playing():
+            # last layer finished: back to the colours from before
+            self._rover._set_rgb_frame(self._base)
+            self._arm()
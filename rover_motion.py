@@ -1,7 +1,10 @@
 import time
 import math
-from machine import SoftI2C, Pin
-from micropython import const
+import struct
+from array import array
+from machine import SoftI2C, Pin, Timer
+from micropython import const, schedule
+import rover_ahrs
 #from utility import *
 
 PWR_MGMT_1   = const(0x6B)
@@ -9,7 +12,11 @@ SMPLRT_DIV   = const(0x19)
 CONFIG       = const(0x1A)
 GYRO_CONFIG  = const(0x1B)
 ACCEL_CONFIG = const(0x1C)
+MOT_THR      = const(0x1F)
+MOT_DUR      = const(0x20)
+INT_PIN_CFG  = const(0x37)
 INT_ENABLE   = const(0x38)
+INT_STATUS   = const(0x3A)
 ACCEL_XOUT_H = const(0x3B)
 ACCEL_YOUT_H = const(0x3D)
 ACCEL_ZOUT_H = const(0x3F)
@@ -17,6 +24,48 @@ GYRO_XOUT_H  = const(0x43)
 GYRO_YOUT_H  = const(0x45)
 GYRO_ZOUT_H  = const(0x47)
 TEMP_OUT_H   = const(0X41)
+FIFO_EN      = const(0x23)
+USER_CTRL    = const(0x6A)
+FIFO_COUNTH  = const(0x72)
+FIFO_R_W     = const(0x74)
+
+_FIFO_SIZE   = const(1024)
+_FIFO_CHUNK  = const(32) # GyZ samples read per FIFO transaction
+
+_BG_TIMER_ID = const(2) # Timer(3) is used by the IR receiver
+
+_MOT_EN      = const(0x40) # INT_ENABLE/INT_STATUS motion detection bit
+_ACCEL_HPF   = const(0x01) # ACCEL_CONFIG high-pass filter at 5Hz, feeds the motion detection
+MOT_THR_MAX_MG = const(510) # MOT_THR is one byte of 2mg
+
+# Calibration file: magic, die temperature, GyZ offset/min/max,
+# GyX/GyY/AcX/AcY/AcZ offsets and a flag telling if those were calibrated
+CALIB_FILE = 'rover_calib.bin'
+_CALIB_MAGIC = b'RVC1'
+_CALIB_FMT = '<4s9fB'
+
+# Slots of a decoded sample, in MPU6050 register order (ACCEL_XOUT_H..GYRO_ZOUT_L)
+_AX  = const(0)
+_AY  = const(1)
+_AZ  = const(2)
+_TMP = const(3)
+_GX  = const(4)
+_GY  = const(5)
+_GZ  = const(6)
+
+class _NoLock:
+    # stands in for rover_i2c.I2CBus locking when Motion gets a plain i2c object
+    def try_acquire(self):
+        return True
+    def release(self):
+        pass
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        pass
+
+_NAME_REG = {'AcX': ACCEL_XOUT_H, 'AcY': ACCEL_YOUT_H, 'AcZ': ACCEL_ZOUT_H,
+             'GyX': GYRO_XOUT_H, 'GyY': GYRO_YOUT_H, 'GyZ': GYRO_ZOUT_H}
 
 class Motion:
     def __init__(self, i2c, address=0x68):
@@ -24,6 +73,59 @@ class Motion:
         #self._addr = address
         self._i2c = i2c
         self._addr = address
+        # a shared rover_i2c.I2CBus also serializes multi-step sequences
+        self._lock = i2c if hasattr(i2c, 'try_acquire') else _NoLock()
+
+        # Preallocated buffers so sampling does not allocate:
+        # 14 raw bytes of a burst read, 2 bytes of a single register read,
+        # decoded words, per-slot sums for averaging and the scaled sample.
+        self._buf = bytearray(14)
+        self._word = bytearray(2)
+        self._raw = array('h', (0 for _ in range(7)))
+        self._acc = array('i', (0 for _ in range(7)))
+        self._sample = array('f', (0 for _ in range(7)))
+
+        # FIFO streaming (off until start_fifo), one view per read length
+        self._fifo_mode = False
+        self._fifo_period = 0.0
+        self._fifo_buf = bytearray(2 * _FIFO_CHUNK)
+        mv = memoryview(self._fifo_buf)
+        self._fifo_views = [mv[:2 * (i + 1)] for i in range(_FIFO_CHUNK)]
+        self.fifo_samples = 0
+        self.fifo_overflows = 0
+
+        # background sampler (off until start_background)
+        self._bg_timer = None
+        self._bg_running = False
+        self._bg_pending = False
+        self._bg_full = False
+        self._bg_rate = 0
+        self._bg_tick_ref = self._bg_tick # bound methods allocated once, not in the timer callback
+        self._bg_step_ref = self._bg_step
+        self.background_samples = 0
+        self.background_overruns = 0
+
+        # motion interrupt (off until start_motion_interrupt)
+        self.on_bump = None
+        self.on_shake = None
+        self._int_pin = None
+        self._motion_irq_ref = self._motion_irq
+        self._shake_times = None
+        self._shake_head = 0
+        self._shake_n = 0
+        self._shake_window = 0
+        self._bump_lim = 0
+        self._bump_x0 = 0
+        self._bump_y0 = 0
+        self._int_buf = bytearray(4) # AcX, AcY read by the IRQ
+        self.motion_latched = False
+        self.motion_events = 0
+        self.shakes = 0
+
+        # orientation filter of update(): None = complementary, else rover_ahrs.Mahony/Madgwick
+        self._ahrs = None
+        self._yaw_last = 0.0
+        self._step_dt = 0.01
 
         #Close the sleep mode
         #Write to power management register to wake up mpu6050
@@ -47,12 +149,19 @@ class Motion:
         self.__get_scale_range()
 
         self.gyroXoffs = self.gyroYoffs = self.gyroZoffs = 0
+        self.gyroZoffs_min = self.gyroZoffs_max = 0
+        self.acXoffs = self.acYoffs = self.acZoffs = 0
+        self._all_calibrated = False
+        self.calib_temp = None
+
+        self.begin()
 
     def __get_scale_range(self):
         scale = 1
         
         #set the gyro scale to 500 deg/s: 250 deg/s (131) --> 0x00, 500 deg/s (65.5) --> 0x08, 1000 deg/s (32.8) --> 0x10, 2000 deg/s (16.4)--> 0x18
         x = self.__read_raw_data(GYRO_CONFIG, 1)
+        x = bytes((x[0] & 0x18,)) # range bits only
         if x == b'\x00':
             scale = 250
         elif x == b'\x08':
@@ -66,6 +175,7 @@ class Motion:
 
         # #set the accelerometer scale to 4g: 2g (16384)--> 0x00, 4g (8192)--> 0x08, 8g (4096) --> 0x10, 16g (2048)--> 0x18
         x = self.__read_raw_data(ACCEL_CONFIG, 1)        
+        x = bytes((x[0] & 0x18,)) # range bits only, not the high-pass filter
         if x == b'\x00':
             scale = 2
         elif x == b'\x08':
@@ -78,14 +188,10 @@ class Motion:
         self.scaleFactorAccel = scale * 1.0 / 32768.0
 
     def __register(self, reg, data): #Write the registor of i2c device.
-        self._i2c.start()
-        self._i2c.writeto(self._addr, bytearray([reg, data]))
-        self._i2c.stop()
-
-    def __bytes_toint(self, firstbyte, secondbyte):
-        if not firstbyte & 0x80:
-            return firstbyte << 8 | secondbyte
-        return - (((firstbyte ^ 255) << 8) | (secondbyte ^ 255) + 1)
+        with self._lock:
+            self._i2c.start()
+            self._i2c.writeto(self._addr, bytearray([reg, data]))
+            self._i2c.stop()
 
     def __read_raw_data(self, addr, size):
         try:
@@ -96,122 +202,318 @@ class Motion:
             self._i2c.stop()
             return a
 
-    def __get_raw_value(self, name=None):
-        if name == None:
-            raw_ints = self.__read_raw_data(ACCEL_XOUT_H, 14)
-            vals = {}
-            vals["AcX"] = self.__bytes_toint(raw_ints[0], raw_ints[1])
-            vals["AcY"] = self.__bytes_toint(raw_ints[2], raw_ints[3])
-            vals["AcZ"] = self.__bytes_toint(raw_ints[4], raw_ints[5])
-            vals["Tmp"] = self.__bytes_toint(raw_ints[6], raw_ints[7]) / 340.00 + 36.53
-            vals["GyX"] = self.__bytes_toint(raw_ints[8], raw_ints[9])
-            vals["GyY"] = self.__bytes_toint(raw_ints[10], raw_ints[11])
-            vals["GyZ"] = self.__bytes_toint(raw_ints[12], raw_ints[13])
-            return vals
-
-        a = [0,0]
-        if (name == 'GyZ'):
-            a = self.__read_raw_data(GYRO_ZOUT_H, 2)
-        elif name == 'GyY':
-            a = self.__read_raw_data(GYRO_YOUT_H, 2)
-        elif name == 'GyX':
-            a = self.__read_raw_data(GYRO_XOUT_H, 2)
-        elif name == 'AcX':
-            a = self.__read_raw_data(ACCEL_XOUT_H, 2)
-        elif name == 'AcY':
-            a = self.__read_raw_data(ACCEL_YOUT_H, 2)
-        elif name == 'AcZ':
-            a = self.__read_raw_data(ACCEL_ZOUT_H, 2)
-        return self.__bytes_toint(a[0], a[1])
-    
+    def __read_burst(self):
+        # Read AcX..GyZ in one 14-byte transaction and decode in place.
+        # On a bus error the previous sample is kept.
+        try:
+            self._i2c.readfrom_mem_into(self._addr, ACCEL_XOUT_H, self._buf)
+        except OSError:
+            return self._raw
+        buf = self._buf
+        raw = self._raw
+        for i in range(7):
+            v = (buf[2 * i] << 8) | buf[2 * i + 1]
+            raw[i] = v - 65536 if v & 0x8000 else v
+        return raw
+
+    def __read_word(self, reg):
+        # Read one signed 16-bit register pair, 0 on bus error
+        try:
+            self._i2c.readfrom_mem_into(self._addr, reg, self._word)
+        except OSError:
+            return 0
+        v = (self._word[0] << 8) | self._word[1]
+        return v - 65536 if v & 0x8000 else v
+
     def __get_value(self, name=None, n_samples=1, sleep=0):
+        # name=None: average n_samples bursts into the reusable sample array
+        # [AcX, AcY, AcZ, Tmp, GyX, GyY, GyZ] (scaled, offsets not applied)
         try:
             result = 0
             if name == None:
-                vals = {}
-                vals['AcX'] = vals['AcY'] = vals['AcZ'] = vals['GyX'] = vals['GyY'] = vals['GyZ'] = 0.0 
-                for i in range(n_samples):
-                    data = self.__get_raw_value()
-                    vals['AcX'] += data['AcX'] * self.scaleFactorAccel / n_samples
-                    vals['AcY'] += data['AcY'] * self.scaleFactorAccel / n_samples
-                    vals['AcZ'] += data['AcZ'] * self.scaleFactorAccel / n_samples
-                    vals['GyX'] += data['GyX'] * self.scaleFactorGyro / n_samples
-                    vals['GyY'] += data['GyY'] * self.scaleFactorGyro / n_samples
-                    vals['GyZ'] += data['GyZ'] * self.scaleFactorGyro / n_samples
+                acc = self._acc
+                for i in range(7):
+                    acc[i] = 0
+                for _ in range(n_samples):
+                    raw = self.__read_burst()
+                    for i in range(7):
+                        acc[i] += raw[i]
                     if sleep:
                         time.sleep_ms(sleep)
+
+                vals = self._sample
+                scale = self.scaleFactorAccel / n_samples
+                for i in range(_AX, _TMP):
+                    vals[i] = acc[i] * scale
+                vals[_TMP] = acc[_TMP] / n_samples / 340.00 + 36.53
+                scale = self.scaleFactorGyro / n_samples
+                for i in range(_GX, _GZ + 1):
+                    vals[i] = acc[i] * scale
                 result = vals
             else:
-                val = 0.0
-                for i in range(n_samples):
-                    val += self.__get_raw_value(name) / n_samples
+                reg = _NAME_REG[name]
+                total = 0
+                for _ in range(n_samples):
+                    total += self.__read_word(reg)
                     if sleep:
                         time.sleep_ms(sleep)
 
                 if name == 'AcX' or name == 'AcY' or name == 'AcZ':
-                    val = val * self.scaleFactorAccel
+                    result = total * self.scaleFactorAccel / n_samples
                 else:
-                    val = val * self.scaleFactorGyro
-
-                result = val
+                    result = total * self.scaleFactorGyro / n_samples
         finally:
             return result
 
+    def read_sample(self, n_samples=1):
+        # Burst-read (and average) all axes. Returns the reusable array
+        # [AcX, AcY, AcZ, Tmp, GyX, GyY, GyZ], overwritten by the next read.
+        return self.__get_value(None, n_samples)
+
+    def read_frame(self):
+        # Burst-read the 14 raw bytes AcX..GyZ (big endian, as in the registers)
+        # without decoding them, e.g. for rover_mpulog. Returns the reusable
+        # buffer, None on a bus error.
+        try:
+            self._i2c.readfrom_mem_into(self._addr, ACCEL_XOUT_H, self._buf)
+        except OSError:
+            return None
+        return self._buf
+
     def begin(self):
         self.angleX = 0.0
         self.angleY = 0.0
         self.angleZ = 0.0
-        self.update_time = time.time_ns()
+        self.update_time = time.ticks_us()
+        if self._ahrs != None:
+            self._ahrs.reset()
+            self._yaw_last = 0.0
+        if self._fifo_mode:
+            self.__fifo_reset()
+
+    #------------------------------FIFO STREAMING--------------------------#
+
+    def start_fifo(self, rate_hz=200):
+        # Stream GyZ into the MPU6050 FIFO at a fixed rate so updateZ() integrates
+        # every sample with its exact period, however late it is called.
+        # With the DLPF on (CONFIG=1) the gyro output rate is 1kHz:
+        # sample rate = 1000 / (1 + SMPLRT_DIV)
+        div = int(1000 / rate_hz) - 1
+        div = max(0, min(255, div))
+        self.__register(CONFIG, 1)
+        self.__register(SMPLRT_DIV, div)
+        self._fifo_period = (1 + div) / 1000.0
+        self.__register(FIFO_EN, 0x10) # ZG_FIFO_EN
+        self.__fifo_reset()
+        self._fifo_mode = True
+        self.update_time = time.ticks_us()
+
+    def stop_fifo(self):
+        self.__register(FIFO_EN, 0x00)
+        self.__register(USER_CTRL, 0x00)
+        self.__register(SMPLRT_DIV, 0)
+        self._fifo_mode = False
+        self.update_time = time.ticks_us()
+
+    def is_fifo_mode(self):
+        return self._fifo_mode
+
+    def __fifo_reset(self):
+        self.__register(USER_CTRL, 0x04) # FIFO_RESET
+        self.__register(USER_CTRL, 0x40) # FIFO_EN
+
+    def drain_fifo(self):
+        # Integrate every GyZ sample waiting in the FIFO into angleZ.
+        # Returns the number of samples consumed.
+        with self._lock:
+            return self.__drain_fifo()
+
+    def __drain_fifo(self):
+        count = self.__read_word(FIFO_COUNTH) & 0xFFFF
+        if count >= _FIFO_SIZE:
+            # samples were lost, start again from an empty FIFO
+            self.fifo_overflows += 1
+            self.__fifo_reset()
+            return 0
+
+        n = count >> 1
+        total = 0
+        left = n
+        buf = self._fifo_buf
+        while left > 0:
+            k = left if left < _FIFO_CHUNK else _FIFO_CHUNK
+            try:
+                self._i2c.readfrom_mem_into(self._addr, FIFO_R_W, self._fifo_views[k - 1])
+            except OSError:
+                break
+            for i in range(k):
+                v = (buf[2 * i] << 8) | buf[2 * i + 1]
+                total += v - 65536 if v & 0x8000 else v
+            left -= k
+
+        n -= left
+        if n:
+            # sum of (raw * scale - offset) * period over n samples
+            self.angleZ += (total * self.scaleFactorGyro - n * self.gyroZoffs) * self._fifo_period
+            self.fifo_samples += n
+        return n
     
     def calibrateZ(self, n_samples=2000): #calibrate for Z axis
         # print("Calib...") #TODO
-        val = self.__get_raw_value('GyZ') * self.scaleFactorGyro
-        self.gyroZoffs_min = self.gyroZoffs_max = val
-        self.gyroZoffs = val
-        Zoffs = val / n_samples
+        # sum raw readings as ints and scale once at the end
+        val = self.__read_word(GYRO_ZOUT_H)
+        low = high = total = val
         for _ in range(n_samples - 1):
-            val = self.__get_raw_value('GyZ') * self.scaleFactorGyro
-            if self.gyroZoffs_min > val:
-                self.gyroZoffs_min = val
-            if self.gyroZoffs_max < val:
-                self.gyroZoffs_max = val
-            Zoffs += val / n_samples
-        self.gyroZoffs = Zoffs
+            val = self.__read_word(GYRO_ZOUT_H)
+            if low > val:
+                low = val
+            if high < val:
+                high = val
+            total += val
+        self.gyroZoffs_min = low * self.scaleFactorGyro
+        self.gyroZoffs_max = high * self.scaleFactorGyro
+        self.gyroZoffs = total * self.scaleFactorGyro / n_samples
+        self.calib_temp = self.get_temp()
         # print("...done") #TODO
         
     def updateZ(self):
-        t_now = time.time_ns()
-        gyrZ = self.__get_value('GyZ') - self.gyroZoffs
-        deltaT = (t_now - self.update_time) * 1e-9
+        # while the background sampler runs, angleZ is already current
+        if self._bg_running:
+            return
+        self.__updateZ()
+
+    def __updateZ(self):
+        if self._fifo_mode:
+            self.drain_fifo()
+            return
+        t_now = time.ticks_us()
+        gyrZ = self.__read_word(GYRO_ZOUT_H) * self.scaleFactorGyro - self.gyroZoffs
+        deltaT = time.ticks_diff(t_now, self.update_time) * 1e-6
         self.update_time = t_now        
         self.angleZ += gyrZ * deltaT
 
     def calibrate(self, n_samples=1000, sleep=0): #calibrate for all axis
         data = self.__get_value(None, n_samples, sleep)
-        self.acXoffs = data['AcX']
-        self.acYoffs = data['AcY']
-        self.acZoffs = data['AcZ']
-        self.gyroXoffs = data['GyX']
-        self.gyroYoffs = data['GyY']
-        self.gyroZoffs = data['GyZ']
+        self.acXoffs = data[_AX]
+        self.acYoffs = data[_AY]
+        self.acZoffs = data[_AZ]
+        self.gyroXoffs = data[_GX]
+        self.gyroYoffs = data[_GY]
+        self.gyroZoffs = data[_GZ]
+        self.gyroZoffs_min = self.gyroZoffs_max = data[_GZ]
+        self.calib_temp = data[_TMP]
+        self._all_calibrated = True
+
+    #------------------------------PERSISTED CALIBRATION--------------------------#
+
+    def get_temp(self):
+        # die temperature in degree C
+        return self.__read_word(TEMP_OUT_H) / 340.00 + 36.53
+
+    def save_calibration(self, path=CALIB_FILE):
+        if self.calib_temp == None:
+            return False
+        data = struct.pack(_CALIB_FMT, _CALIB_MAGIC, self.calib_temp,
+            self.gyroZoffs, self.gyroZoffs_min, self.gyroZoffs_max,
+            self.gyroXoffs, self.gyroYoffs, self.acXoffs, self.acYoffs, self.acZoffs,
+            1 if self._all_calibrated else 0)
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+        except OSError:
+            return False
+        return True
+
+    def load_calibration(self, path=CALIB_FILE):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            values = struct.unpack(_CALIB_FMT, data)
+        except (OSError, ValueError):
+            return False
+        if values[0] != _CALIB_MAGIC:
+            return False
+        (_, self.calib_temp, self.gyroZoffs, self.gyroZoffs_min, self.gyroZoffs_max,
+            gx, gy, ax, ay, az, all_axis) = values
+        if all_axis:
+            self.gyroXoffs, self.gyroYoffs = gx, gy
+            self.acXoffs, self.acYoffs, self.acZoffs = ax, ay, az
+            self._all_calibrated = True
+        return True
+
+    def check_calibration(self, n_samples=100, tolerance=0.2, max_temp_delta=8):
+        # Cheap validity check of the Z offset (robot must stand still):
+        # the mean GyZ of a few samples must be within tolerance deg/s of the offset
+        # and the die temperature close to the one at calibration time.
+        if self.calib_temp == None:
+            return False
+        if abs(self.get_temp() - self.calib_temp) > max_temp_delta:
+            return False
+        mean = self.__get_value('GyZ', n_samples)
+        return abs(mean - self.gyroZoffs) <= tolerance
+
+    def warm_start(self, path=CALIB_FILE, n_samples=2000, tolerance=0.2):
+        # Load the saved calibration, recalibrate Z (and save) only if it is missing or drifted.
+        # Returns True if the saved calibration was used.
+        if self.load_calibration(path) and self.check_calibration(tolerance=tolerance):
+            return True
+        self.calibrateZ(n_samples)
+        self.save_calibration(path)
+        return False
+
+    def set_filter(self, name='complementary', rate_hz=100, **gains):
+        # Orientation filter of update()/step(): 'complementary' (default),
+        # 'mahony' (gains kp, ki) or 'madgwick' (gain beta), see rover_ahrs.
+        # rate_hz: the rate step() is called at. Restarts from angles 0 like begin().
+        if name == 'mahony':
+            self._ahrs = rover_ahrs.Mahony(**gains)
+        elif name == 'madgwick':
+            self._ahrs = rover_ahrs.Madgwick(**gains)
+        else:
+            self._ahrs = None
+        self._step_dt = 1.0 / rate_hz
+        self.begin()
+
+    def get_filter(self):
+        if isinstance(self._ahrs, rover_ahrs.Mahony):
+            return 'mahony'
+        if isinstance(self._ahrs, rover_ahrs.Madgwick):
+            return 'madgwick'
+        return 'complementary'
 
     def update(self):
+        if self._bg_running and self._bg_full:
+            return
+        self.__update()
+
+    def step(self):
+        # update() for a loop or timer running at the rate_hz of set_filter():
+        # the filter uses that fixed period instead of the measured one
+        if self._bg_running and self._bg_full:
+            return
+        self.__update(self._step_dt)
+
+    def __update(self, deltaT=None):
         #The accelerometer data is reliable only on the long term, so a "low pass" filter has to be used.
         #The gyroscope data is reliable only on the short term, as it starts to drift on the long term.
-        t_now = time.time_ns()
+        t_now = time.ticks_us()
         data = self.__get_value()
-        accX = data['AcX']
-        accY = data['AcY']
-        accZ = data['AcZ']
-        gyrX = data['GyX'] - self.gyroXoffs
-        gyrY = data['GyY'] - self.gyroYoffs
-        gyrZ = data['GyZ'] - self.gyroZoffs
+        if deltaT == None:
+            deltaT = time.ticks_diff(t_now, self.update_time) * 1e-6
+        self.update_time = t_now
+        if self._ahrs != None:
+            self.__update_ahrs(data, deltaT)
+            return
+
+        accX = data[_AX]
+        accY = data[_AY]
+        accZ = data[_AZ]
+        gyrX = data[_GX] - self.gyroXoffs
+        gyrY = data[_GY] - self.gyroYoffs
+        gyrZ = data[_GZ] - self.gyroZoffs
 
         ax = math.atan2(accX, math.sqrt( math.pow(accY, 2) + math.pow(accZ, 2) ) ) * 180 / 3.1415926
         ay = math.atan2(accY, math.sqrt( math.pow(accX, 2) + math.pow(accZ, 2) ) ) * 180 / 3.1415926
-        
-        deltaT = (t_now - self.update_time) * 1e-9
-        self.update_time = t_now
 
         if accZ > 0:
           self.angleX -= gyrY * deltaT
@@ -229,6 +531,175 @@ class Motion:
         self.angleX = self.angleX * filter_coefficient + ax * (1 - filter_coefficient)
         self.angleY = self.angleY * filter_coefficient + ay * (1 - filter_coefficient)
 
+    def __update_ahrs(self, data, deltaT):
+        f = self._ahrs
+        f.update(data[_GX] - self.gyroXoffs, data[_GY] - self.gyroYoffs, data[_GZ] - self.gyroZoffs,
+                 data[_AX], data[_AY], data[_AZ], deltaT)
+        f.angles()
+        self.angleX = f.x
+        self.angleY = f.y
+        # the filter heading wraps at 180, angleZ keeps counting turns
+        d = f.z - self._yaw_last
+        if d > 180:
+            d -= 360
+        elif d < -180:
+            d += 360
+        self.angleZ += d
+        self._yaw_last = f.z
+
+    #------------------------------BACKGROUND SAMPLER--------------------------#
+
+    def start_background(self, rate_hz=100, full=False, timer_id=_BG_TIMER_ID):
+        # Keep angleZ (and angleX/angleY if full=True) current from a hardware timer.
+        # The timer only schedules the work; the I2C reads run via micropython.schedule.
+        self.stop_background()
+        self._bg_full = full
+        self._bg_pending = False
+        self.background_samples = 0
+        self.background_overruns = 0
+        self.update_time = time.ticks_us()
+        self._bg_timer = Timer(timer_id)
+        self._bg_running = True
+        self.set_background_rate(rate_hz)
+
+    def stop_background(self):
+        self._bg_running = False
+        if self._bg_timer:
+            self._bg_timer.deinit()
+            self._bg_timer = None
+
+    def set_background_rate(self, rate_hz):
+        self._bg_rate = rate_hz
+        if self._bg_timer:
+            self._bg_timer.init(period=max(1, int(1000 / rate_hz)), mode=Timer.PERIODIC, callback=self._bg_tick_ref)
+
+    def is_background(self):
+        return self._bg_running
+
+    def _bg_tick(self, _):
+        # previous sample still queued: the rate is too high for the bus/CPU
+        if self._bg_pending:
+            self.background_overruns += 1
+            return
+        self._bg_pending = True
+        try:
+            schedule(self._bg_step_ref, 0)
+        except RuntimeError: # schedule queue full
+            self._bg_pending = False
+            self.background_overruns += 1
+
+    def _bg_step(self, _):
+        self._bg_pending = False
+        if not self._bg_running:
+            return
+        # the main program is in the middle of an I2C sequence, skip this tick
+        if not self._lock.try_acquire():
+            self.background_overruns += 1
+            return
+        try:
+            if self._bg_full:
+                self.__update()
+            else:
+                self.__updateZ()
+        finally:
+            self._lock.release()
+        self.background_samples += 1
+
+    #------------------------------MOTION INTERRUPT--------------------------#
+
+    def start_motion_interrupt(self, pin, threshold_mg=250, duration_ms=1, shake_count=3, shake_window_ms=500, bump_mg=1000):
+        # The MPU6050 compares its high-passed acceleration with threshold_mg
+        # (2..MOT_THR_MAX_MG) and pulses its INT pin, wired to GPIO `pin`:
+        # nothing is polled. Every pulse sets motion_latched. The IRQ then reads
+        # AcX/AcY once: a horizontal acceleration of bump_mg or more (from the
+        # calibrated rest, 4g range) is a bump and calls on_bump(), the other
+        # pulses count for shakes: shake_count of them within shake_window_ms
+        # call on_shake(). bump_mg=None makes every pulse a bump.
+        # The callbacks run from the pin IRQ, keep them short (post an event).
+        if not 2 <= threshold_mg <= MOT_THR_MAX_MG:
+            raise ValueError('threshold_mg 2..{}'.format(MOT_THR_MAX_MG))
+        self.stop_motion_interrupt()
+        self._shake_times = array('i', (0 for _ in range(max(1, shake_count))))
+        self._shake_head = 0
+        self._shake_n = 0
+        self._shake_window = shake_window_ms
+        lsb = 0.001 / self.scaleFactorAccel # raw per mg
+        self._bump_lim = 0 if bump_mg == None else max(1, int(bump_mg * lsb))
+        self._bump_x0 = int(self.acXoffs * 1000 * lsb)
+        self._bump_y0 = int(self.acYoffs * 1000 * lsb)
+        config = self.__read_raw_data(ACCEL_CONFIG, 1)[0]
+        self.__register(ACCEL_CONFIG, (config & 0x18) | _ACCEL_HPF)
+        self.__register(MOT_THR, threshold_mg // 2) # 2mg per LSB
+        self.__register(MOT_DUR, max(1, min(255, duration_ms)))
+        self.__register(INT_PIN_CFG, 0x00) # active high, push-pull, 50us pulse: no INT_STATUS read needed
+        self.__register(INT_ENABLE, _MOT_EN)
+        self._int_pin = Pin(pin, Pin.IN)
+        self._int_pin.irq(handler=self._motion_irq_ref, trigger=Pin.IRQ_RISING)
+
+    def stop_motion_interrupt(self):
+        if self._int_pin == None:
+            return
+        self._int_pin.irq(handler=None)
+        self._int_pin = None
+        self.__register(INT_ENABLE, 0x00)
+        config = self.__read_raw_data(ACCEL_CONFIG, 1)[0]
+        self.__register(ACCEL_CONFIG, config & 0x18)
+
+    def is_motion_interrupt(self):
+        return self._int_pin != None
+
+    def motion_detected(self, clear=True):
+        # True if a motion interrupt came since the last call (with clear=True)
+        latched = self.motion_latched
+        if clear:
+            self.motion_latched = False
+        return latched
+
+    def _motion_irq(self, pin):
+        t = time.ticks_ms()
+        self.motion_events += 1
+        self.motion_latched = True
+        if self.__is_bump():
+            if self.on_bump:
+                self.on_bump()
+            return
+        # times of the last pulses, a shake when the oldest is recent enough
+        times = self._shake_times
+        n = len(times)
+        times[self._shake_head] = t
+        self._shake_head = (self._shake_head + 1) % n
+        if self._shake_n < n:
+            self._shake_n += 1
+        if self._shake_n == n and time.ticks_diff(t, times[self._shake_head]) <= self._shake_window:
+            self._shake_n = 0 # the next shake needs shake_count new pulses
+            self.shakes += 1
+            if self.on_shake:
+                self.on_shake()
+
+    def __is_bump(self):
+        # one read of AcX/AcY, allowed here as the pin IRQ is a soft one;
+        # a pulse during an I2C sequence of the main program counts as a bump
+        if not self._bump_lim:
+            return True
+        if not self._lock.try_acquire():
+            return True
+        try:
+            buf = self._int_buf
+            try:
+                self._i2c.readfrom_mem_into(self._addr, ACCEL_XOUT_H, buf)
+            except OSError:
+                return True
+        finally:
+            self._lock.release()
+        ax = buf[0] << 8 | buf[1]
+        ay = buf[2] << 8 | buf[3]
+        if ax > 32767:
+            ax -= 65536
+        if ay > 32767:
+            ay -= 65536
+        lim = self._bump_lim
+        return abs(ax - self._bump_x0) >= lim or abs(ay - self._bump_y0) >= lim
+
     def get_angleX(self):      
         return self.angleX
 
@@ -267,13 +738,14 @@ class Motion:
 
     def get_accels(self, n_samples=1):
         data = self.__get_value(None, n_samples)
-        return (data['AcX'], data['AcY'], data['AcZ'] - 1)
+        return (data[_AX], data[_AY], data[_AZ] - 1)
 
     def get_gyros(self, n_samples=1):
         data = self.__get_value(None, n_samples)
-        return (data['GyX'] - self.gyroXoffs, data['GyY'] - self.gyroYoffs, data['GyZ'] - self.gyroZoffs)
+        return (data[_GX] - self.gyroXoffs, data[_GY] - self.gyroYoffs, data[_GZ] - self.gyroZoffs)
 
     def is_shaked(self, shake_threshold=4.0, avg_count=10, wait_time=0.1):
+        # samples for wait_time seconds; start_motion_interrupt() detects shakes without polling
         try:
             x = y = z = 0
             total = 0.0
@@ -0,0 +1,156 @@
+import struct
+from time import ticks_us, ticks_diff
+from micropython import const
+
+# Binary log of raw MPU6050 frames, replayed on a PC by sim/replay.py to
+# benchmark the rover_motion filters.
+#
+#   from rover import *
+#   from rover_mpulog import MotionLog, SEG_STILL, SEG_TURN
+#   log = MotionLog(rover.motion, 'turn.rml')
+#   log.begin_segment(SEG_STILL)    # first samples: robot still, they calibrate the replay
+#   for _ in range(400): log.sample(); time.sleep_ms(5)
+#   log.end_segment()
+#   log.begin_segment(SEG_TURN)
+#   ...                             # turn the robot by hand, sampling
+#   log.end_segment(90)             # true angle, degrees counter-clockwise
+#   log.close()
+#
+# File: header '<4sBBB' (magic, version, GYRO_CONFIG, ACCEL_CONFIG), then records
+# starting with a tag byte:
+#   REC_SAMPLE  '<BH' + 14 bytes  us since the previous sample, AcX..GyZ registers
+#   REC_GAP     '<BI'             us to add to the next sample's time (gap > 65535us)
+#   REC_MARK    '<BBf'            segment begin (kind > 0) or end (kind 0, truth value)
+
+LOG_FILE = 'motion.rml'
+LOG_MAGIC = b'RML1'
+LOG_VERSION = const(1)
+_HEADER_FMT = '<4sBBB'
+
+REC_SAMPLE = const(1)
+REC_GAP = const(2)
+REC_MARK = const(3)
+_SAMPLE_SIZE = const(17)
+_GAP_SIZE = const(5)
+_MARK_SIZE = const(6)
+_FRAME_SIZE = const(14)
+
+# Segment kinds, with the meaning of the truth value given to end_segment()
+SEG_END = const(0)
+SEG_STILL = const(1) # robot not moving, truth unused
+SEG_TURN = const(2)  # truth: rotation around Z during the segment, degrees counter-clockwise
+SEG_TILT = const(3)  # truth: angleX at the end of the segment, degrees
+SEG_SHAKE = const(4) # robot shaken the whole segment, truth unused
+
+def _range_bits(scale_factor, base):
+    # GYRO_CONFIG/ACCEL_CONFIG value of a Motion scale factor (full scale / 32768)
+    full_scale = round(scale_factor * 32768)
+    bits = 0
+    while (base << bits) < full_scale and bits < 3:
+        bits += 1
+    return bits << 3
+
+
+class MotionLog:
+    """
+    Writes raw frames of a rover_motion.Motion to a log file. Records are
+    packed into a preallocated buffer written out when it is full, so sample()
+    does not allocate; the file write is the only slow call.
+    """
+    def __init__(self, motion, path=LOG_FILE, buf_size=512):
+        self.motion = motion
+        self.samples = 0
+        self.errors = 0 # bus errors, the sample is skipped
+        self._buf = bytearray(buf_size)
+        self._mv = memoryview(self._buf)
+        self._pos = 0
+        self._t_last = None
+        self._file = open(path, 'wb')
+        self._file.write(struct.pack(_HEADER_FMT, LOG_MAGIC, LOG_VERSION,
+            _range_bits(motion.scaleFactorGyro, 250), _range_bits(motion.scaleFactorAccel, 2)))
+
+    def __reserve(self, size):
+        if self._pos + size > len(self._buf):
+            self.flush()
+
+    def sample(self):
+        # one burst read appended to the log, False on a bus error
+        t = ticks_us()
+        frame = self.motion.read_frame()
+        if frame == None:
+            self.errors += 1
+            return False
+        dt = 0 if self._t_last == None else ticks_diff(t, self._t_last)
+        self._t_last = t
+        if dt > 0xFFFF:
+            self.__reserve(_GAP_SIZE)
+            struct.pack_into('<BI', self._buf, self._pos, REC_GAP, dt)
+            self._pos += _GAP_SIZE
+            dt = 0
+        self.__reserve(_SAMPLE_SIZE)
+        buf = self._buf
+        pos = self._pos
+        struct.pack_into('<BH', buf, pos, REC_SAMPLE, dt)
+        pos += 3
+        for i in range(_FRAME_SIZE):
+            buf[pos + i] = frame[i]
+        self._pos = pos + _FRAME_SIZE
+        self.samples += 1
+        return True
+
+    def __mark(self, kind, value):
+        self.__reserve(_MARK_SIZE)
+        struct.pack_into('<BBf', self._buf, self._pos, REC_MARK, kind, value)
+        self._pos += _MARK_SIZE
+
+    def begin_segment(self, kind):
+        # the samples until end_segment() are a ground truth segment of this kind
+        self.__mark(kind, 0.0)
+
+    def end_segment(self, truth=0.0):
+        self.__mark(SEG_END, truth)
+
+    def flush(self):
+        if self._pos:
+            self._file.write(self._mv[:self._pos])
+            self._pos = 0
+
+    def close(self):
+        if self._file != None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+def read_log(path=LOG_FILE):
+    # Returns (gyro_config, accel_config, records), records a list of
+    # (t_us, frame) for samples and (t_us, kind, value) for segment marks,
+    # t_us counted from the first sample. Raises ValueError on a bad file.
+    with open(path, 'rb') as f:
+        data = f.read()
+    header = struct.calcsize(_HEADER_FMT)
+    if len(data) < header:
+        raise ValueError('not a motion log')
+    magic, version, gyro_config, accel_config = struct.unpack_from(_HEADER_FMT, data, 0)
+    if magic != LOG_MAGIC or version != LOG_VERSION:
+        raise ValueError('not a motion log')
+
+    records = []
+    t = 0
+    pos = header
+    while pos < len(data):
+        tag = data[pos]
+        if tag == REC_SAMPLE and pos + _SAMPLE_SIZE <= len(data):
+            t += struct.unpack_from('<H', data, pos + 1)[0]
+            records.append((t, bytes(data[pos + 3:pos + _SAMPLE_SIZE])))
+            pos += _SAMPLE_SIZE
+        elif tag == REC_GAP and pos + _GAP_SIZE <= len(data):
+            t += struct.unpack_from('<I', data, pos + 1)[0]
+            pos += _GAP_SIZE
+        elif tag == REC_MARK and pos + _MARK_SIZE <= len(data):
+            _, kind, value = struct.unpack_from('<BBf', data, pos)
+            records.append((t, kind, value))
+            pos += _MARK_SIZE
+        else:
+            break # truncated, e.g. the robot was reset before close()
+    return gyro_config, accel_config, records
@@ -1 +1 @@
-"""MicroPython PCF8574 8-Bit I2C I/O Expander with Interrupthttps://github.com/mcauser/micropython-pcf8574MIT LicenseCopyright (c) 2019 Mike Causer"""class PCF8574:    def __init__(self, i2c, address=0x20):        self._i2c = i2c        self._address = address        self._port = bytearray(1)        if i2c.scan().count(address) == 0:            raise OSError('PCF8574 not found at I2C address {:#x}'.format(address))    @property    def port(self):        self._read()        return self._port[0]    @port.setter    def port(self, value):        self._port[0] = value & 0xff        self._write()    def pin(self, pin, value=None):        pin = self.validate_pin(pin)        if value is None:            self._read()            return (self._port[0] >> pin) & 1        else:            if value:                self._port[0] |= (1 << (pin))            else:                self._port[0] &= ~(1 << (pin))            self._write()    def toggle(self, pin):        pin = self.validate_pin(pin)        self._port[0] ^= (1 << (pin))        self._write()    def validate_pin(self, pin):        # pin valid range 0..7        if not 0 <= pin <= 7:            raise ValueError('Invalid pin {}. Use 0-7.'.format(pin))        return pin    def _read(self):        self._i2c.readfrom_into(self._address, self._port)    def _write(self):        self._i2c.writeto(self._address, self._port)
\ No newline at end of file
+"""MicroPython PCF8574 8-Bit I2C I/O Expander with Interrupthttps://github.com/mcauser/micropython-pcf8574MIT LicenseCopyright (c) 2019 Mike Causer"""from utime import ticks_ms, ticks_diffclass PCF8574:    def __init__(self, i2c, address=0x20):        self._i2c = i2c        self._address = address        self._port = bytearray(1)        # last whole-port read, shared by callers that only need recent data        self._snapshot = 0        self._snapshot_time = 0        self._snapshot_valid = False        # number of I2C transactions issued (reads + writes)        self.transactions = 0        if i2c.scan().count(address) == 0:            raise OSError('PCF8574 not found at I2C address {:#x}'.format(address))    @property    def port(self):        self._read()        return self._port[0]    @port.setter    def port(self, value):        self._port[0] = value & 0xff        self._write()    def pin(self, pin, value=None):        pin = self.validate_pin(pin)        if value is None:            self._read()            return (self._port[0] >> pin) & 1        else:            if value:                self._port[0] |= (1 << (pin))            else:                self._port[0] &= ~(1 << (pin))            self._write()    def read_port(self, max_age_ms=0):        # Read all 8 pins in a single I2C transaction.        # If the last snapshot is younger than max_age_ms, return it without touching the bus.        if self._snapshot_valid and max_age_ms > 0 and \                ticks_diff(ticks_ms(), self._snapshot_time) < max_age_ms:            return self._snapshot        self._read()        return self._snapshot    def snapshot(self):        # Last port value read from the bus (no I2C transaction)        return self._snapshot    def write_pins(self, mask, value):        # Set every pin in mask to value with a single I2C write        if value:            self._port[0] |= mask        else:            self._port[0] &= ~mask        self._write()    def reset_stats(self):        self.transactions = 0    def toggle(self, pin):        pin = self.validate_pin(pin)        self._port[0] ^= (1 << (pin))        self._write()    def validate_pin(self, pin):        # pin valid range 0..7        if not 0 <= pin <= 7:            raise ValueError('Invalid pin {}. Use 0-7.'.format(pin))        return pin    def _read(self):        self._i2c.readfrom_into(self._address, self._port)        self.transactions += 1        self._snapshot = self._port[0]        self._snapshot_time = ticks_ms()        self._snapshot_valid = True    def _write(self):        self._i2c.writeto(self._address, self._port)        self.transactions += 1
\ No newline at end of file
@@ -0,0 +1,69 @@
+class PID:
+    """
+    PID controller with output clamping, anti-windup and a filtered derivative.
+
+    setpoint: wanted value of the measurement
+    out_min, out_max: output is clamped to this range
+    d_filter: 0..1, low pass factor for the derivative term (0 = no filter)
+
+    The derivative is taken on the measurement (not the error), so changing the
+    setpoint does not kick the output. The integral stops growing while the
+    output is saturated in the direction of the error.
+    """
+    def __init__(self, kp=1.0, ki=0.0, kd=0.0, out_min=-100, out_max=100, d_filter=0.5, setpoint=0.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.out_min = out_min
+        self.out_max = out_max
+        self.d_filter = d_filter
+        self.setpoint = setpoint
+        self.reset()
+
+    def reset(self):
+        self._integral = 0.0
+        self._derivative = 0.0
+        self._last = None
+        self.output = 0.0
+
+    def set_gains(self, kp, ki, kd):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+
+    def set_limits(self, out_min, out_max):
+        self.out_min = out_min
+        self.out_max = out_max
+        self._integral = max(out_min, min(out_max, self._integral))
+
+    def update(self, measurement, dt):
+        # dt: measured time since the previous update, in seconds
+        error = self.setpoint - measurement
+
+        if self._last == None or dt <= 0:
+            self._derivative = 0.0
+        else:
+            d = -(measurement - self._last) / dt
+            self._derivative = self.d_filter * self._derivative + (1 - self.d_filter) * d
+        self._last = measurement
+
+        p = self.kp * error
+        d = self.kd * self._derivative
+        # integral is stored already multiplied by ki so gains can change without a bump
+        integral = self._integral + self.ki * error * dt
+        integral = max(self.out_min, min(self.out_max, integral))
+
+        output = p + integral + d
+        if output > self.out_max:
+            output = self.out_max
+            if error < 0:
+                self._integral = integral
+        elif output < self.out_min:
+            output = self.out_min
+            if error > 0:
+                self._integral = integral
+        else:
+            self._integral = integral
+
+        self.output = output
+        return output
@@ -0,0 +1,142 @@
+import struct
+import uasyncio as asyncio
+from time import ticks_us, ticks_diff, ticks_add
+from micropython import const
+
+# Telemetry of the driving loops, recorded in RAM and written to flash later
+# so recording does not change the timing being observed.
+#
+#   from rover import *
+#   import rover_telemetry
+#   rover.telemetry = rover_telemetry.Telemetry(rover, interval_us=10000)
+#   rover.turn_right_angle(90)       # the turn loop records every 10ms at most
+#   rover.telemetry.close()          # write what is left and close the file
+#
+# The turn, straight and line following loops call record() when
+# rover.telemetry is set; a program can add its own records with record().
+# Records stay in the ring until flush(): call it between motions, or run the
+# run() task, which writes full blocks only. When the ring is full new records
+# are dropped (and counted), never written from the hot path.
+#
+# File: header '<4sBB' (magic, version, record size), then records '<IibbBBH':
+# ticks_us, heading (angleZ in 1/100 degree), wheel speeds m1 and m2, line
+# sensor bits (0xff without sensors), tag, distance in mm (last ultrasonic value).
+# sim/telemetry.py turns a file into CSV or NumPy arrays.
+
+TELEMETRY_FILE = 'telemetry.bin'
+TELEMETRY_MAGIC = b'RTL1'
+TELEMETRY_VERSION = const(1)
+_HEADER_FMT = '<4sBB'
+REC_FMT = '<IibbBBH'
+REC_SIZE = const(14)
+
+# record tags: which loop wrote the record
+TAG_USER = const(0)
+TAG_TURN = const(1)
+TAG_STRAIGHT = const(2)
+TAG_LINE = const(3)
+TAG_NAMES = ('user', 'turn', 'straight', 'line')
+
+
+class Telemetry:
+    """
+    Ring of fixed size records preallocated in RAM. record() packs one in
+    place; flush() writes the pending ones to the file in blocks of
+    block_records (one write per contiguous run of the ring).
+    Use from the main program or scheduled code, not from an IRQ handler.
+    """
+    def __init__(self, rover, path=TELEMETRY_FILE, records=256, block_records=64, interval_us=0):
+        self._rover = rover
+        self._size = records
+        self._block = min(block_records, records)
+        self._ring = bytearray(records * REC_SIZE)
+        self._mv = memoryview(self._ring)
+        self._head = 0 # next record written
+        self._tail = 0 # oldest record not flushed
+        self._count = 0
+        self.set_interval(interval_us)
+        self.records = 0
+        self.dropped = 0
+        self.flushes = 0
+        self._file = open(path, 'wb')
+        self._file.write(struct.pack(_HEADER_FMT, TELEMETRY_MAGIC, TELEMETRY_VERSION, REC_SIZE))
+
+    def set_interval(self, interval_us):
+        # keep at most one record per interval_us, 0 for every call of record();
+        # by time, not by call count: the loops do not all run at a fixed rate
+        self.interval_us = max(0, interval_us)
+        self._t_last = ticks_add(ticks_us(), -self.interval_us)
+
+    def record(self, tag=TAG_USER):
+        now = ticks_us()
+        if ticks_diff(now, self._t_last) < self.interval_us:
+            return
+        self._t_last = now
+        if self._count >= self._size:
+            self.dropped += 1
+            return
+
+        # only values already in memory: no I2C read, no ranging
+        rover = self._rover
+        motion = rover._motion
+        pcf = rover._pcf
+        struct.pack_into(REC_FMT, self._ring, self._head * REC_SIZE, now,
+            int(motion.angleZ * 100) if motion != None else 0,
+            int(rover.m1_speed), int(rover.m2_speed),
+            pcf.snapshot() & 0x0f if pcf != None else 0xff,
+            tag, min(0xffff, int(rover.ultrasonic.last_cm() * 10)))
+        self._head += 1
+        if self._head == self._size:
+            self._head = 0
+        self._count += 1
+        self.records += 1
+
+    def pending(self):
+        return self._count
+
+    def flush(self, full_blocks_only=False):
+        # write the pending records, returns how many were written
+        if self._file == None:
+            return 0
+        written = 0
+        while self._count and (not full_blocks_only or self._count >= self._block):
+            n = self._size - self._tail # contiguous up to the end of the ring
+            if n > self._count:
+                n = self._count
+            if full_blocks_only:
+                n = min(n, self._block)
+            self._file.write(self._mv[self._tail * REC_SIZE:(self._tail + n) * REC_SIZE])
+            self._tail = (self._tail + n) % self._size
+            self._count -= n
+            written += n
+        if written:
+            self._file.flush()
+            self.flushes += 1
+        return written
+
+    async def run(self, period_ms=250):
+        # background writer for uasyncio programs: full blocks only, between the other tasks
+        while self._file != None:
+            self.flush(True)
+            await asyncio.sleep_ms(period_ms)
+
+    def close(self):
+        if self._file != None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+
+def read_telemetry(path=TELEMETRY_FILE):
+    # Returns the records of a file as a list of tuples in REC_FMT order.
+    # Raises ValueError on a bad file; a truncated last record is ignored.
+    with open(path, 'rb') as f:
+        data = f.read()
+    header = struct.calcsize(_HEADER_FMT)
+    if len(data) < header:
+        raise ValueError('not a telemetry file')
+    magic, version, size = struct.unpack_from(_HEADER_FMT, data, 0)
+    if magic != TELEMETRY_MAGIC or version != TELEMETRY_VERSION or size != REC_SIZE:
+        raise ValueError('not a telemetry file')
+    return [struct.unpack_from(REC_FMT, data, pos)
+            for pos in range(header, len(data) - REC_SIZE + 1, REC_SIZE)]
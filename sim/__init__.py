@@ -0,0 +1,3 @@
+# Host simulation of the Rover: fake MicroPython modules on a virtual clock,
+# a simulated robot (motors, MPU6050, PCF8574 line sensors, HC-SR04) and
+# benchmarks of the driving code. Run with: python -m sim.bench
@@ -0,0 +1,206 @@
+"""
+Benchmarks of the Rover driving code on the simulated robot.
+
+    python -m sim.bench              # all benchmarks
+    python -m sim.bench turn line    # some of them
+
+Times are virtual (robot) time. speedup is virtual time / host time.
+"""
+import contextlib
+import io
+import math
+import os
+import sys
+import tempfile
+import time
+
+from sim.replay import record_demo, replay
+from sim.runtime import Simulation, MPU6050_INT_PIN
+from sim.world import World, CircleLine, Box
+
+
+class _Run:
+    # measures one benchmark run: virtual time, host time and bus traffic
+    def __init__(self, sim):
+        self.sim = sim
+
+    def __enter__(self):
+        self.sim.bus.reset_stats()
+        self.t0 = self.sim.now()
+        self.host0 = time.perf_counter()
+        self._quiet = contextlib.redirect_stdout(io.StringIO())
+        self._quiet.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self._quiet.__exit__(*args)
+        self.elapsed = self.sim.now() - self.t0
+        self.host = time.perf_counter() - self.host0
+        self.i2c = self.sim.bus.transactions
+        self.bus_load = self.sim.bus.busy_us * 1e-6 / self.elapsed if self.elapsed > 0 else 0
+
+    def speedup(self):
+        return self.elapsed / self.host if self.host > 0 else 0
+
+
+def _rover(sim):
+    with contextlib.redirect_stdout(io.StringIO()):
+        rover = sim.import_rover() # calibrates the MPU6050 while standing still
+    return rover
+
+def _settle_time(sim, threshold_dps=1.0, limit=1.0):
+    # virtual seconds until the robot stops rotating
+    t0 = sim.now()
+    while abs(math.degrees(sim.world.yaw_rate)) > threshold_dps and sim.now() - t0 < limit:
+        sim.run_for(0.001)
+    return sim.now() - t0
+
+def _table(title, header, rows):
+    print(title)
+    print('  '.join('{:>10}'.format(h) for h in header))
+    for row in rows:
+        print('  '.join('{:>10.2f}'.format(v) if isinstance(v, float) else '{:>10}'.format(v) for v in row))
+    print()
+
+
+def bench_turn(angles=(30, 45, 90, 180, 360)):
+    rows = []
+    for angle in angles:
+        with Simulation(World()) as sim:
+            rover = _rover(sim)
+            h0 = sim.world.heading_deg()
+            with _Run(sim) as run:
+                rover.turn_right_angle(angle)
+            settle = _settle_time(sim)
+            turned = h0 - sim.world.heading_deg()
+            rows.append((angle, turned - angle, run.elapsed * 1000, settle * 1000,
+                         run.i2c, run.bus_load * 100, run.speedup()))
+    _table('turn_right_angle: error and timing',
+           ('angle', 'error_deg', 'time_ms', 'settle_ms', 'i2c', 'bus_%', 'speedup'), rows)
+
+def bench_straight(speeds=(20, 40, 60), t=2.0, right_gain=0.93):
+    rows = []
+    for speed in speeds:
+        for straight in (False, True):
+            with Simulation(World()) as sim:
+                sim.world.right.gain = right_gain
+                rover = _rover(sim)
+                with _Run(sim) as run:
+                    rover.forward(speed, t, straight)
+                loops = rover.straight_loop_hz * t if straight else 0
+                rows.append((speed, 'pid' if straight else 'open', sim.world.heading_deg(),
+                             sim.world.y * 100, float(rover.straight_loop_hz),
+                             run.i2c / loops if loops else 0.0, run.speedup()))
+    _table('forward {}s with a {:.0f}% weaker right wheel'.format(t, (1 - right_gain) * 100),
+           ('speed', 'mode', 'heading', 'drift_cm', 'loop_hz', 'i2c/loop', 'speedup'), rows)
+
+def bench_line(speeds=(25, 35, 45), t=8.0, radius=0.4):
+    rows = []
+    for speed in speeds:
+        with Simulation(World(line=CircleLine(radius))) as sim:
+            rover = _rover(sim)
+            with _Run(sim) as run:
+                rover.follow_line(speed, t)
+            hz, off_ms, longest_ms, lost = rover.line_stats()
+            loops = hz * t
+            rows.append((speed, float(hz), off_ms, longest_ms, lost, sim.world.distance,
+                         run.i2c / loops if loops else 0.0, run.speedup()))
+    _table('follow_line {}s on a {}m radius ring'.format(t, radius),
+           ('speed', 'loop_hz', 'off_ms', 'longest_ms', 'lost', 'dist_m', 'i2c/loop', 'speedup'), rows)
+
+def bench_main(t=15.0):
+    rows = []
+    # (mode name, button presses from the start mode, world)
+    for name, presses, world in (
+            ('avoid', 1, World(walls=Box(-0.8, -0.8, 0.8, 0.8))),
+            ('line', 3, World(line=CircleLine(0.4)))):
+        with Simulation(world) as sim:
+            for i in range(presses):
+                sim.clock.call_at(int((1.0 + 0.1 * i) * 1e6), sim.press_button_a)
+            clearance = [None]
+
+            def watch(dt):
+                if world.walls != None:
+                    w = world.walls
+                    c = min(world.x - w.x_min, w.x_max - world.x, world.y - w.y_min, w.y_max - world.y)
+                    if clearance[0] == None or c < clearance[0]:
+                        clearance[0] = c
+
+            sim.clock.on_advance(watch)
+            with _Run(sim) as run:
+                env = sim.run_main(t)
+            rows.append((name, env.get('mode'), world.distance, clearance[0] if clearance[0] != None else '-',
+                         run.i2c / run.elapsed, run.bus_load * 100, run.speedup()))
+    _table('main.py modes, {}s each'.format(t),
+           ('mode', 'mode_id', 'dist_m', 'clear_m', 'i2c/s', 'bus_%', 'speedup'), rows)
+
+def bench_ahrs(filters=(('complementary', {}), ('mahony', {}), ('madgwick', {}))):
+    # the orientation filters of Motion.update() on the same recorded log
+    tmp = tempfile.mkdtemp(prefix='rover_bench_')
+    path = record_demo(os.path.join(tmp, 'demo.rml'))
+    rows = []
+    try:
+        for name, gains in filters:
+            result = replay(path, filter=name, **gains)
+            segments = result['segments']
+            def worst(kind, key):
+                return max(abs(row[key]) for row in segments if row['kind'] == kind)
+            rows.append((name, result['cost_us']['update']['mean'], worst('still', 'still_tilt'),
+                         worst('tilt', 'x_err'), worst('still', 'z_update_err'), worst('turn', 'z_update_err')))
+    finally:
+        os.remove(path)
+        os.rmdir(tmp)
+    _table('Motion.update() filters on a recorded log (host us, errors in degrees)',
+           ('filter', 'us/update', 'still_tilt', 'tilt_err', 'still_z', 'turn_err'), rows)
+
+def bench_bump(speed=50, t=3.0, shake=0.15):
+    # driving into a wall the ultrasonic sensor does not see, with and without
+    # bump detection, then on a shaking floor where only the wall may stop it
+    rows = []
+    for name, detect, shaking in (('timed', False, 0.0), ('bump stop', True, 0.0), ('shaken', True, shake)):
+        world = World(walls=Box(-0.5, -0.5, 0.5, 0.5))
+        with Simulation(world) as sim:
+            sim.sonar.max_range = 0.0 # obstacle below the sensor
+            sim.mpu.shake = shaking # g rms
+            rover = _rover(sim)
+            if detect:
+                rover.start_bump_detection(MPU6050_INT_PIN)
+            contact = [None, None, 0.0] # contact time, wheels stopped time, time pushing the wall
+
+            def watch(dt):
+                driven = world.left.target_speed() or world.right.target_speed()
+                if world.blocked:
+                    if contact[0] == None:
+                        contact[0] = sim.now()
+                    if driven:
+                        contact[2] += dt
+                if contact[0] != None and contact[1] == None and not driven:
+                    contact[1] = sim.now()
+
+            sim.clock.on_advance(watch)
+            with _Run(sim) as run:
+                rover.forward(speed, t)
+            rows.append((name, (contact[0] - run.t0) if contact[0] != None else '-',
+                         (contact[1] - contact[0]) * 1000 if None not in contact[:2] else '-',
+                         contact[2], rover.bumps, rover.motion.shakes, world.contacts))
+    _table('forward({}, {}s) into a wall at 0.43m (times in s, reaction in ms)'.format(speed, t),
+           ('mode', 'contact_s', 'react_ms', 'pushing_s', 'bumps', 'shakes', 'contacts'), rows)
+
+
+BENCHMARKS = {
+    'turn': bench_turn,
+    'straight': bench_straight,
+    'line': bench_line,
+    'main': bench_main,
+    'ahrs': bench_ahrs,
+    'bump': bench_bump,
+}
+
+def main(names):
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            sys.exit('unknown benchmark {}, choose from: {}'.format(name, ' '.join(BENCHMARKS)))
+        BENCHMARKS[name]()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,209 @@
+"""
+Receiver of the BLE telemetry frames of rover_ble.TelemetryStreamer.
+
+    python -m sim.ble_telemetry            # main.py in line mode, streaming over a loopback
+    python -m sim.ble_telemetry -          # decode '$...'/'+...' lines from stdin to CSV
+
+    rx = TelemetryReceiver()
+    for msg in messages:                   # from the BLE link of the app
+        rx.feed(msg)
+    rx.columns, rx.rows                    # decoded samples, t_ms unwrapped
+
+feed() takes the messages as they arrive, a frame split over several of
+them is decoded once its last piece is in.
+
+Loopback stands in for the BLE link on the PC: its send() hands the messages
+to a receiver, raises OSError like a busy link beyond messages_per_s, and
+cuts messages longer than max_msg like a notification does.
+"""
+import csv
+import sys
+import time
+
+from sim.runtime import _install
+
+_install() # rover_ble imports MicroPython modules
+import rover_ble
+
+
+class TelemetryReceiver:
+    def __init__(self):
+        self.columns = None
+        self.rows = []
+        self.frames = 0
+        self.bad_frames = 0
+        self.lost_frames = 0 # sequence numbers skipped
+        self.dropped = 0 # samples the robot dropped before sending
+        self.bytes = 0 # message length on the link
+        self._parts = None # pieces of a split frame so far
+        self._seq = None
+        self._t = None
+        self._t_raw = None
+
+    def feed(self, msg):
+        # returns True when a frame was decoded, None while waiting for more pieces
+        self.bytes += len(msg)
+        msg = self.__assemble(msg)
+        if msg == None:
+            return None
+        decoded = rover_ble.decode_telemetry(msg)
+        if decoded == None:
+            self.bad_frames += 1
+            return False
+        fields, seq, dropped, samples = decoded
+        columns = rover_ble.telemetry_columns(fields)
+        if columns != self.columns:
+            self.columns = columns
+            self._t = None
+        if self._seq != None:
+            self.lost_frames += (seq - self._seq - 1) & 0xff
+        self._seq = seq
+        self.frames += 1
+        self.dropped += dropped
+        has_time = 't_ms' in columns
+        for sample in samples:
+            if has_time:
+                # 16-bit ms on the robot, unwrapped from the first sample
+                raw = sample[0]
+                self._t = 0 if self._t == None else self._t + ((raw - self._t_raw) & 0xffff)
+                self._t_raw = raw
+                sample = (self._t,) + sample[1:]
+            self.rows.append(sample)
+        return True
+
+    def __assemble(self, msg):
+        # '$' or a header byte starts a frame, '+' (text) or any bytes (raw) continue it
+        if isinstance(msg, str):
+            if msg.startswith('$'):
+                self._parts = msg
+            elif msg.startswith('+') and self._parts != None:
+                self._parts += msg[1:]
+            else:
+                self._parts = None
+                self.bad_frames += 1
+                return None
+            text = self._parts[1:]
+            try:
+                head = rover_ble.a2b_base64(text[:8]) if len(text) >= 8 else b''
+            except ValueError:
+                head = b''
+            size = rover_ble.telemetry_frame_size(head)
+            if not size:
+                if len(text) >= 8:
+                    self._parts = None
+                    self.bad_frames += 1
+                return None
+            if len(text) < (size + 2) // 3 * 4:
+                return None
+        else:
+            msg = bytes(msg)
+            if self._parts == None or msg[:1] == bytes((rover_ble.TELEMETRY_HEADER,)):
+                self._parts = msg
+            else:
+                self._parts += msg
+            size = rover_ble.telemetry_frame_size(self._parts)
+            if not size or len(self._parts) < size:
+                if len(self._parts) >= 5 and not size:
+                    self._parts = None
+                    self.bad_frames += 1
+                return None
+        msg = self._parts
+        self._parts = None
+        return msg
+
+    def column(self, name):
+        i = self.columns.index(name)
+        return [row[i] for row in self.rows]
+
+    def write_csv(self, out):
+        writer = csv.writer(out)
+        writer.writerow(self.columns or ())
+        writer.writerows(self.rows)
+
+
+class Loopback:
+    # BLE link stand-in: send() delivers to the receiver, at most messages_per_s
+    # with bursts of `buffers` messages (the notification buffers of the stack)
+    def __init__(self, receiver, messages_per_s=None, clock=time.monotonic, max_msg=rover_ble.BLE_MSG_MAX,
+                 buffers=8):
+        self.receiver = receiver
+        self.messages_per_s = messages_per_s
+        self.buffers = buffers
+        self.clock = clock
+        self.max_msg = max_msg
+        self.sent = 0
+        self.refused = 0
+        self.truncated = 0
+        self._budget = float(buffers)
+        self._t = None
+
+    def send(self, msg):
+        if self.messages_per_s != None:
+            now = self.clock()
+            if self._t != None:
+                self._budget = min(self.buffers, self._budget + (now - self._t) * self.messages_per_s)
+            self._t = now
+            if self._budget < 1.0:
+                self.refused += 1
+                raise OSError(11) # EAGAIN, like a notification queue that is full
+            self._budget -= 1.0
+        if self.max_msg != None and len(msg) > self.max_msg:
+            self.truncated += 1 # cut like a notification over the MTU
+            msg = msg[:self.max_msg]
+        self.sent += 1
+        self.receiver.feed(msg)
+
+
+def demo(seconds=10.0, messages_per_s=None):
+    # main.py following a line with the app connected, telemetry into a loopback
+    import contextlib
+    import io
+    from sim.runtime import Simulation
+    from sim.world import World, CircleLine, Box
+
+    rx = TelemetryReceiver()
+    with Simulation(World(line=CircleLine(0.4), walls=Box(-1.0, -1.0, 1.0, 1.0))) as sim:
+        link = Loopback(rx, messages_per_s, sim.now)
+        import yolobit
+        yolobit.ble.send = link.send
+        for i in range(3): # to the line finder mode
+            sim.clock.call_at(int((1.0 + 0.1 * i) * 1e6), sim.press_button_a)
+        sim.clock.call_at(int(1.3e6), lambda: yolobit.ble.connected_cb())
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = sim.run_main(seconds)
+        streamer = env['ble_telemetry']
+    return rx, link, streamer
+
+def _summary(title, rx, link, streamer):
+    n = len(rx.rows)
+    print(title)
+    print('  samples {} in {} frames ({:.1f}/frame) of {:.1f} messages, {:.1f} bytes/sample on the link'.format(
+        n, rx.frames, n / rx.frames if rx.frames else 0,
+        streamer.messages / streamer.frames if streamer.frames else 0, rx.bytes / n if n else 0))
+    print('  robot: sampled {} dropped {} send errors {}; link refused {} truncated {}; lost frames {} bad {}'.format(
+        streamer.samples, streamer.dropped, streamer.send_errors, link.refused, link.truncated,
+        rx.lost_frames, rx.bad_frames))
+    if n:
+        t = rx.column('t_ms')
+        d = rx.column('distance_cm')
+        print('  span {:.1f}s, last heading {:.1f} deg, distance {:.0f}..{:.0f} cm, last wheels {} {}'.format(
+            (t[-1] - t[0]) / 1000, rx.rows[-1][1], min(d), max(d), rx.column('m1')[-1], rx.column('m2')[-1]))
+    print()
+
+
+def main(args):
+    if args == ['-']:
+        rx = TelemetryReceiver()
+        for line in sys.stdin:
+            line = line.strip()
+            if line.startswith('$') or line.startswith('+'):
+                rx.feed(line)
+        rx.write_csv(sys.stdout)
+        return
+    if args:
+        sys.exit('usage: python -m sim.ble_telemetry [-]')
+    _summary('loopback, unlimited link', *demo())
+    _summary('loopback, 5 messages/s link: the oldest samples are dropped', *demo(messages_per_s=5))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,105 @@
+import heapq
+
+
+class Clock:
+    """
+    Virtual time in microseconds.
+
+    Time only moves when the code under test sleeps, uses the I2C bus or reads
+    the ticks (each read costs cpu_us, so busy-wait loops terminate). While it
+    moves, the world is stepped and due timers and events fire in order.
+    Functions passed to schedule() (micropython.schedule) run once the clock
+    has caught up, like on the robot where they run between bytecodes.
+    """
+    SCHEDULE_DEPTH = 8
+
+    def __init__(self, cpu_us=2, step_us=1000):
+        self.now_us = 0
+        self.cpu_us = cpu_us
+        self.step_us = step_us # longest physics step
+        self.deadline_us = None # advancing past it raises SimulationEnd, until cleared
+        self._events = [] # heap of (due_us, seq, callback)
+        self._seq = 0
+        self._listeners = []
+        self._advancing = False
+        self._scheduled = []
+        self._in_scheduled = False
+
+    def on_advance(self, fn):
+        # fn(dt_s) is called for every physics step
+        self._listeners.append(fn)
+
+    def call_at(self, due_us, fn):
+        self._seq += 1
+        entry = [due_us, self._seq, fn]
+        heapq.heappush(self._events, entry)
+        return entry
+
+    def call_later(self, delay_us, fn):
+        return self.call_at(self.now_us + delay_us, fn)
+
+    def cancel(self, entry):
+        entry[2] = None
+
+    def tick(self):
+        # cost of the code that reads the clock
+        self.advance(self.cpu_us)
+        return self.now_us
+
+    def advance(self, us):
+        self.advance_to(self.now_us + max(0, int(us)))
+
+    def advance_to(self, t_us):
+        if self._advancing:
+            # an event callback sleeping or using the bus: no other event fires meanwhile
+            self.__step_to(t_us)
+            return
+        self._advancing = True
+        try:
+            while True:
+                due = self._events[0][0] if self._events else None
+                target = t_us if due == None or due > t_us else due
+                self.__step_to(target, True)
+                if self.now_us < target:
+                    continue # a device added an event that is due now
+                if target != due:
+                    break
+                _, _, fn = heapq.heappop(self._events)
+                if fn != None:
+                    fn()
+                    self.__run_scheduled()
+        finally:
+            self._advancing = False
+        self.__run_scheduled()
+        if self.deadline_us != None and self.now_us >= self.deadline_us:
+            raise SimulationEnd()
+
+    def schedule(self, fn, arg):
+        if len(self._scheduled) >= self.SCHEDULE_DEPTH:
+            raise RuntimeError('schedule queue full')
+        self._scheduled.append((fn, arg))
+
+    def __run_scheduled(self):
+        if self._in_scheduled:
+            return
+        self._in_scheduled = True
+        try:
+            while self._scheduled:
+                fn, arg = self._scheduled.pop(0)
+                fn(arg)
+        finally:
+            self._in_scheduled = False
+
+    def __step_to(self, t_us, events=False):
+        while self.now_us < t_us:
+            dt = min(self.step_us, t_us - self.now_us)
+            self.now_us += dt
+            for fn in self._listeners:
+                fn(dt * 1e-6)
+            if events and self._events and self._events[0][0] <= self.now_us:
+                return
+
+
+class SimulationEnd(BaseException):
+    # raised through the code under test when the clock reaches its deadline
+    pass
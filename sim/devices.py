@@ -0,0 +1,281 @@
+import math
+
+_DLPF_HZ = (260, 184, 94, 44, 21, 10, 5) # accel bandwidth per CONFIG DLPF_CFG
+
+
+class SimBus:
+    """
+    Stand-in for machine.I2C/SoftI2C. Transactions are routed to the simulated
+    devices by address and advance the clock by their time on the wire.
+    """
+    def __init__(self, clock, freq=400000, overhead_us=20):
+        self.clock = clock
+        self.freq = freq
+        self.overhead_us = overhead_us # driver cost per transaction (SoftI2C bit-banging)
+        self.devices = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.transactions = 0
+        self.bytes = 0
+        self.busy_us = 0
+        self.per_address = {}
+
+    def add(self, address, device):
+        self.devices[address] = device
+
+    def __device(self, address, n_bytes):
+        # address byte + register/data bytes, 9 clocks each
+        us = self.overhead_us + (1 + n_bytes) * 9 * 1e6 / self.freq
+        self.transactions += 1
+        self.bytes += n_bytes
+        self.busy_us += us
+        self.per_address[address] = self.per_address.get(address, 0) + 1
+        self.clock.advance(us)
+        dev = self.devices.get(address)
+        if dev == None:
+            raise OSError(19) # ENODEV, like MicroPython on a NACK
+        return dev
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def readfrom_into(self, address, buf):
+        self.__device(address, len(buf)).read_into(buf)
+
+    def readfrom(self, address, n):
+        buf = bytearray(n)
+        self.readfrom_into(address, buf)
+        return bytes(buf)
+
+    def writeto(self, address, buf, stop=True):
+        self.__device(address, len(buf)).write(bytes(buf))
+        return len(buf)
+
+    def readfrom_mem_into(self, address, reg, buf):
+        self.__device(address, 1 + len(buf)).read_mem_into(reg, buf)
+
+    def readfrom_mem(self, address, reg, n):
+        buf = bytearray(n)
+        self.readfrom_mem_into(address, reg, buf)
+        return bytes(buf)
+
+    def writeto_mem(self, address, reg, buf):
+        self.__device(address, 1 + len(buf)).write(bytes([reg]) + bytes(buf))
+
+
+class SimPCF8574:
+    # the line sensor outputs drive the low 4 pins, the others read back the output latch
+    def __init__(self, world):
+        self.world = world
+        self.latch = 0xff
+
+    def read_into(self, buf):
+        buf[0] = (self.latch & 0xf0) | self.world.line_sensors()
+
+    def write(self, data):
+        self.latch = data[-1]
+
+
+class SimMPU6050:
+    """
+    Register model of the MPU6050. The gyro Z axis follows the yaw rate of the
+    world plus a constant bias and white noise; the FIFO (GyZ only) fills at the
+    configured sample rate. tilt_rate (deg/s, positive raising angleX, integrated
+    into tilt) and shake (g rms of random acceleration) exercise the other axes.
+    With INT_ENABLE motion detection on, on_interrupt() is called when the
+    high-passed acceleration stays above MOT_THR for MOT_DUR ms.
+    """
+    def __init__(self, world, clock, gyro_bias=0.5, gyro_noise=0.05, temp=28.0):
+        self.world = world
+        self.clock = clock
+        self.gyro_bias = gyro_bias # deg/s
+        self.gyro_noise = gyro_noise # deg/s rms
+        self.temp = temp
+        self.regs = bytearray(128)
+        self.regs[0x6B] = 0x40 # sleeping after reset
+        self.regs[0x75] = 0x68 # WHO_AM_I
+        self.fifo = bytearray()
+        self.fifo_overflow = False
+        self._fifo_due = 0.0
+        self._v_last = 0.0
+        self._accel = 0.0
+        self._accel_out = 0.0 # after the digital low-pass filter (CONFIG)
+        self.tilt = 0.0
+        self.tilt_rate = 0.0
+        self.shake = 0.0
+        self.on_interrupt = None
+        self._hp_base = [0.0, 0.0, 1.0]
+        self._motion_ms = 0.0
+        self._motion_armed = True
+        clock.on_advance(self.__step)
+
+    # scale of the raw values for the configured ranges
+    def gyro_lsb(self):
+        return 131.0 / (1 << ((self.regs[0x1B] >> 3) & 3))
+
+    def accel_lsb(self):
+        return 16384.0 / (1 << ((self.regs[0x1C] >> 3) & 3))
+
+    def sample_rate(self):
+        base = 8000 if (self.regs[0x1A] & 7) in (0, 7) else 1000
+        return base / (1 + self.regs[0x19])
+
+    def __noise(self):
+        return self.world.random.gauss(0.0, self.gyro_noise)
+
+    def __word(self, value):
+        v = int(round(value))
+        v = max(-32768, min(32767, v))
+        return v & 0xffff
+
+    def __live(self):
+        # 7 words: AcX AcY AcZ Tmp GyX GyY GyZ
+        w = self.world
+        g = self.gyro_lsb()
+        a = self.accel_lsb()
+        v = (w.left.speed + w.right.speed) / 2
+        tilt = math.radians(self.tilt)
+        shake = (w.random.gauss(0.0, self.shake) for _ in range(3)) if self.shake else (0.0, 0.0, 0.0)
+        sx, sy, sz = shake
+        return (
+            self.__word((self._accel_out / 9.81 + math.sin(tilt) + sx) * a),
+            self.__word((v * w.yaw_rate / 9.81 + sy) * a),
+            self.__word((math.cos(tilt) + sz) * a),
+            self.__word((self.temp - 36.53) * 340),
+            self.__word(self.__noise() * g),
+            self.__word((self.__noise() - self.tilt_rate) * g),
+            self.__word((math.degrees(w.yaw_rate) + self.gyro_bias + self.__noise()) * g),
+        )
+
+    def __step(self, dt):
+        w = self.world
+        v = (w.left.speed + w.right.speed) / 2
+        self._accel = (v - self._v_last) / dt
+        self._v_last = v
+        # the data registers follow the DLPF: a shock lasts a few ms there
+        bandwidth = _DLPF_HZ[min(6, self.regs[0x1A] & 7)]
+        self._accel_out += (self._accel - self._accel_out) * (1 - math.exp(-dt * 2 * math.pi * bandwidth))
+        self.tilt += self.tilt_rate * dt
+        if self.regs[0x38] & 0x40:
+            self.__motion_detect(dt)
+        if (self.regs[0x6A] & 0x40) and (self.regs[0x23] & 0x10):
+            self._fifo_due += dt * self.sample_rate()
+            while self._fifo_due >= 1:
+                self._fifo_due -= 1
+                if len(self.fifo) >= 1024:
+                    self.fifo_overflow = True
+                    continue
+                gz = self.__live()[6]
+                self.fifo += bytes((gz >> 8, gz & 0xff))
+
+    def __motion_detect(self, dt):
+        w = self.world
+        v = (w.left.speed + w.right.speed) / 2
+        tilt = math.radians(self.tilt)
+        accel = [self._accel / 9.81 + math.sin(tilt), v * w.yaw_rate / 9.81, math.cos(tilt)]
+        if self.shake:
+            for i in range(3):
+                accel[i] += w.random.gauss(0.0, self.shake)
+        # 5Hz high-pass (ACCEL_HPF), compared per axis with the threshold (2mg per LSB)
+        k = min(1.0, dt * 2 * math.pi * 5)
+        threshold = self.regs[0x1F] * 0.002
+        moving = False
+        for i in range(3):
+            self._hp_base[i] += (accel[i] - self._hp_base[i]) * k
+            if abs(accel[i] - self._hp_base[i]) > threshold:
+                moving = True
+        if not moving:
+            self._motion_ms = 0.0
+            self._motion_armed = True
+            return
+        self._motion_ms += dt * 1000
+        if self._motion_armed and self._motion_ms >= self.regs[0x20]:
+            self._motion_armed = False
+            self.regs[0x3A] |= 0x40 # MOT_INT
+            if self.on_interrupt:
+                self.on_interrupt()
+
+    def read_into(self, buf):
+        self.read_mem_into(0x75, buf)
+
+    def read_mem_into(self, reg, buf):
+        live = None
+        for i in range(len(buf)):
+            r = reg + i
+            if r == 0x74:
+                # FIFO_R_W: every byte read pops the FIFO, the register does not advance
+                buf[i] = self.fifo.pop(0) if self.fifo else 0
+                reg -= 1
+            elif 0x3B <= r <= 0x48:
+                if live == None:
+                    live = self.__live()
+                word = live[(r - 0x3B) >> 1]
+                buf[i] = word >> 8 if (r - 0x3B) & 1 == 0 else word & 0xff
+            elif r == 0x3A:
+                buf[i] = self.regs[r] # INT_STATUS clears on read
+                self.regs[r] = 0
+            elif r == 0x72:
+                buf[i] = len(self.fifo) >> 8
+            elif r == 0x73:
+                buf[i] = len(self.fifo) & 0xff
+            else:
+                buf[i] = self.regs[r & 0x7f]
+
+    def write(self, data):
+        reg = data[0]
+        for i, v in enumerate(data[1:]):
+            r = (reg + i) & 0x7f
+            self.regs[r] = v
+            if r == 0x6A and v & 0x04: # FIFO_RESET
+                self.fifo = bytearray()
+                self.fifo_overflow = False
+                self.regs[r] = v & ~0x04
+
+
+class SimSonar:
+    """
+    HC-SR04 on two pins: a falling edge on the trigger pin starts a measurement,
+    the echo pin then pulses for the round trip time to the nearest wall
+    (38ms, the sensor timeout, when nothing is in range).
+    """
+    def __init__(self, sim, trigger_pin, echo_pin, max_range=4.0, noise=0.005):
+        self.sim = sim
+        self.echo_pin = echo_pin
+        self.max_range = max_range
+        self.noise = noise # relative
+        self.measurements = 0
+        self._level = 0
+        self._busy = False
+        sim.watch_pin(trigger_pin, self.__on_trigger)
+
+    def __on_trigger(self, value):
+        if value:
+            self._level = 1
+            return
+        if self._level != 1 or self._busy:
+            return
+        self._level = 0
+        self._busy = True
+        self.measurements += 1
+        d = self.sim.world.obstacle_distance()
+        if d == None or d > self.max_range:
+            width = 38000
+        else:
+            d *= 1 + self.sim.world.random.gauss(0.0, self.noise)
+            width = int(d * 100 * 2 * 29.1)
+        clock = self.sim.clock
+        t = clock.now_us + 460
+        clock.call_at(t, lambda: self.__echo(1))
+        clock.call_at(t + max(1, width), lambda: self.__echo(0))
+
+    def __echo(self, level):
+        if not level:
+            self._busy = False
+        self.sim.drive_pin(self.echo_pin, level)
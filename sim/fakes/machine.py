@@ -0,0 +1,139 @@
+# Fake machine module on the virtual clock of sim.runtime
+import sim.runtime as _rt
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 2
+    PULL_DOWN = 1
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self._value = 0 if value == None else value
+        self._handler = None
+        self.hard = False
+        self._trigger = 0
+        _rt.sim.pins[id] = self
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value != None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v == None:
+            return self._value
+        self._value = 1 if v else 0
+        _rt.sim.pin_written(self.id, self._value)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=3, hard=False):
+        # handlers run at the edge time, hard or not
+        self._handler = handler
+        self._trigger = trigger
+        self.hard = hard
+
+    def set_level(self, v):
+        # driven by the simulated hardware
+        if v != self._value:
+            self._value = v
+            if self._handler and self._trigger & (self.IRQ_RISING if v else self.IRQ_FALLING):
+                self._handler(self)
+
+
+class PWM:
+    def __init__(self, pin, freq=5000, duty=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty
+        self.writes = 0
+        _rt.sim.pwm_created(pin.id, self)
+
+    def freq(self, f=None):
+        if f == None:
+            return self._freq
+        self._freq = f
+
+    def duty(self, d=None):
+        if d == None:
+            return self._duty
+        if not 0 <= d <= 1023:
+            raise ValueError('duty must be 0-1023')
+        self._duty = int(d)
+        self.writes += 1
+
+    def deinit(self):
+        self._duty = 0
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.id = id
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=None):
+        self.deinit()
+        if freq:
+            period = 1000 / freq
+        period_us = max(1, int(period * 1000))
+        clock = _rt.sim.clock
+        timers = _rt.sim.timers
+
+        due = [clock.now_us + period_us]
+
+        def fire():
+            if mode == Timer.PERIODIC:
+                due[0] += period_us
+                timers[self.id] = clock.call_at(due[0], fire)
+            else:
+                timers.pop(self.id, None)
+            if callback:
+                callback(self)
+
+        timers[self.id] = clock.call_at(due[0], fire)
+
+    def deinit(self):
+        entry = _rt.sim.timers.pop(self.id, None)
+        if entry != None:
+            _rt.sim.clock.cancel(entry)
+
+
+def SoftI2C(scl=None, sda=None, freq=400000, timeout=50000):
+    _rt.sim.bus.freq = freq
+    return _rt.sim.bus
+
+def I2C(id=0, scl=None, sda=None, freq=400000):
+    _rt.sim.bus.freq = freq
+    return _rt.sim.bus
+
+def time_pulse_us(pin, level, timeout_us=1000000):
+    return -1
+
+def disable_irq():
+    return 0
+
+def enable_irq(state=0):
+    pass
+
+def idle():
+    _rt.sim.clock.advance(100)
+
+def freq(hz=None):
+    return 240000000
+
+def unique_id():
+    return b'\x00\x00\x00\x00\x00\x01'
@@ -0,0 +1,23 @@
+# Fake micropython module
+import sim.runtime as _rt
+
+
+def const(x):
+    return x
+
+def schedule(fn, arg):
+    _rt.sim.clock.schedule(fn, arg)
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+def mem_info(verbose=None):
+    pass
+
+def opt_level(level=None):
+    return 0
+
+def native(fn):
+    return fn
+
+viper = native
@@ -0,0 +1,69 @@
+# Fake uasyncio: CPython asyncio running on the virtual clock.
+# When no task is ready the loop jumps the clock to the next timer instead of waiting.
+import asyncio as _asyncio
+import selectors as _selectors
+import sim.runtime as _rt
+from asyncio import CancelledError, Event, Lock, TimeoutError, create_task, current_task, gather, sleep, wait_for
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+async def wait_for_ms(aw, ms):
+    return await _asyncio.wait_for(aw, ms / 1000)
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+class _VirtualSelector(_selectors.SelectSelector):
+    def select(self, timeout=None):
+        ready = super().select(0)
+        if ready:
+            return ready
+        clock = _rt.sim.clock
+        if timeout == None:
+            clock.advance(1000)
+        else:
+            clock.advance(max(clock.cpu_us, timeout * 1e6))
+        return []
+
+
+class _VirtualLoop(_asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(_VirtualSelector())
+
+    def time(self):
+        return _rt.sim.clock.now_us * 1e-6
+
+
+def new_event_loop():
+    loop = _VirtualLoop()
+    _asyncio.set_event_loop(loop)
+    return loop
+
+def get_event_loop():
+    return new_event_loop()
+
+def run(coro):
+    loop = new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        # stopped by the end of the simulation: the other tasks go with the loop
+        for task in _asyncio.all_tasks(loop):
+            task._log_destroy_pending = False
+        loop.close()
+        _asyncio.set_event_loop(None)
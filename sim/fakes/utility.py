@@ -0,0 +1,11 @@
+# Fake of the Yolo:Bit utility module
+
+
+def translate(value, left_min, left_max, right_min, right_max):
+    left_span = left_max - left_min
+    right_span = right_max - right_min
+    return right_min + (value - left_min) * right_span / left_span
+
+def hex_to_rgb(value):
+    value = value.lstrip('#')
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
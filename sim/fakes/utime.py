@@ -0,0 +1,30 @@
+# Fake utime module, the time module patched by sim.runtime
+import time as _time
+
+
+def ticks_ms():
+    return _time.ticks_ms()
+
+def ticks_us():
+    return _time.ticks_us()
+
+def ticks_cpu():
+    return _time.ticks_cpu()
+
+def ticks_diff(a, b):
+    return a - b
+
+def ticks_add(a, b):
+    return a + b
+
+def sleep(s):
+    _time.sleep(s)
+
+def sleep_ms(ms):
+    _time.sleep_ms(ms)
+
+def sleep_us(us):
+    _time.sleep_us(us)
+
+def time_ns():
+    return _time.time_ns()
@@ -0,0 +1,81 @@
+# Fake of the Yolo:Bit board module: pins, display, buttons and BLE
+import sys as _sys
+import sim.runtime as _rt
+
+
+class _PinName:
+    def __init__(self, pin):
+        self.pin = pin
+
+for _i in range(21):
+    globals()['pin%d' % _i] = _PinName(_i)
+
+
+class _Display:
+    def __init__(self):
+        self.color = None
+
+    def set_all(self, color):
+        self.color = color
+
+    def clear(self):
+        self.color = None
+
+    def scroll(self, *args, **kwargs):
+        pass
+
+    def show(self, *args, **kwargs):
+        pass
+
+
+class _Button:
+    def __init__(self):
+        self.on_pressed = None
+
+    def is_pressed(self):
+        return False
+
+
+class _Ble:
+    """
+    The program registers its handlers here. The simulation delivers messages
+    with receive() and records what the program sends.
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.sent = []
+        self.connected_cb = None
+        self.disconnected_cb = None
+
+    def on_receive_msg(self, kind, fn):
+        self.handlers[kind] = fn
+
+    def on_connected(self, fn):
+        self.connected_cb = fn
+
+    def on_disconnected(self, fn):
+        self.disconnected_cb = fn
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    send_value = send
+
+    def receive(self, kind, *args):
+        fn = self.handlers.get(kind)
+        if fn:
+            fn(*args)
+
+
+display = _Display()
+button_a = _Button()
+button_b = _Button()
+ble = _Ble()
+_rt.sim.yolobit = _sys.modules[__name__]
+
+
+def say(msg):
+    print(msg)
+
+def stop_all():
+    pass
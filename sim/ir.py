@@ -0,0 +1,200 @@
+"""
+Replay of NEC pulse trains through both IR receivers of rover_ir.
+
+    python -m sim.ir                 # the remote keys, a repeat code and a glitch
+    python -m sim.ir raw.txt         # frames printed by IR_RX with verbose = True
+
+IR_RX gets the edges on a simulated pin at their times, IR_RX_RMT reads the
+same frames from a capture object standing in for an RMT receiver, so both go
+through their own capture code and the shared decode_nec(). The report gives
+the keys decoded by each backend, the Python callbacks it took (pin IRQs or
+timer polls) and the delay from the end of a frame to its event.
+
+A recording is the output of IR_RX._print_raw() (verbose = True on the robot):
+one 'index duration_us' line per pulse, frames separated by blank lines.
+Without one the frames are built from the NEC timings, with the marks
+lengthened and the spaces shortened by the receiver like a VS1838B does.
+"""
+import contextlib
+import io
+import random
+import sys
+
+from sim.runtime import Simulation
+from sim.world import World
+
+_IR_PIN = 'ir'
+_GAP_US = 150000 # between frames, more than the 80ms decode block
+ERROR = -1 # expected result of a frame that must not decode to a key
+
+
+def nec_frame(addr, cmd, distortion=60, jitter=30, rng=None):
+    # durations of one NEC frame: 9ms mark, 4.5ms space, 32 bits LSB first, stop mark
+    rng = rng or random.Random(1)
+    bits = addr | ((addr ^ 0xff) << 8) | (cmd << 16) | ((cmd ^ 0xff) << 24)
+    pulses = [9000, 4500]
+    for bit in range(32):
+        pulses += [560, 1690 if bits >> bit & 1 else 560]
+    pulses.append(560)
+    return _distort(pulses, distortion, jitter, rng)
+
+def nec_repeat(distortion=60, jitter=30, rng=None):
+    return _distort([9000, 2250, 560], distortion, jitter, rng or random.Random(1))
+
+def _distort(pulses, distortion, jitter, rng):
+    # marks (even index) come out longer, spaces shorter
+    return [p + (distortion if i % 2 == 0 else -distortion) + rng.randint(-jitter, jitter)
+            for i, p in enumerate(pulses)]
+
+def demo_frames():
+    # (expected key, ERROR or None if unknown, durations) for the keys of the Rover remote
+    import rover_ir
+    rng = random.Random(1)
+    keys = [v for k, v in sorted(vars(rover_ir).items()) if k.startswith('IR_REMOTE_')]
+    frames = [(key, nec_frame(0x00, key, rng=rng)) for key in keys]
+    frames.append((keys[-1], nec_repeat(rng=rng))) # repeat of the last key
+    frames.append((ERROR, [300])) # a glitch, not a frame
+    return frames
+
+def load_raw(path):
+    # frames from IR_RX._print_raw() output, expected keys unknown
+    frames = []
+    pulses = []
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit():
+                if parts[0] == '000' and pulses:
+                    frames.append((None, pulses))
+                    pulses = []
+                pulses.append(int(parts[1]))
+            elif pulses:
+                frames.append((None, pulses))
+                pulses = []
+    if pulses:
+        frames.append((None, pulses))
+    return frames
+
+
+class ReplayCapture:
+    """
+    Stand-in for an RMT receive channel: read_pulses() returns the durations
+    of the frames that ended since the previous call (the last one of them),
+    like a capture peripheral keeping the last complete frame.
+    """
+    def __init__(self, clock):
+        self.clock = clock
+        self.frames = [] # (end time us, durations)
+        self.reads = 0
+
+    def read_pulses(self):
+        self.reads += 1
+        last = None
+        while self.frames and self.frames[0][0] <= self.clock.now_us:
+            last = self.frames.pop(0)[1]
+        return last
+
+
+def _run(frames, backend):
+    with Simulation(World()) as sim:
+        from machine import Pin
+        import rover_ir
+        pin = Pin(_IR_PIN, Pin.IN)
+        sim.drive_pin(_IR_PIN, 1) # receiver output idles high
+        capture = ReplayCapture(sim.clock)
+        events = []
+        errors = []
+        if backend == 'rmt':
+            rx = rover_ir.IR_RX_RMT(pin, capture)
+        else:
+            rx = rover_ir.IR_RX(pin)
+        rx.on_received(lambda cmd, addr, ext: events.append((sim.clock.now_us, cmd)))
+        rx.on_error(lambda cmd: errors.append((sim.clock.now_us, cmd)))
+
+        irqs = [0]
+        handler = pin._handler
+        def counting(p):
+            irqs[0] += 1
+            handler(p)
+        if handler != None:
+            pin._handler = counting
+
+        t = sim.clock.now_us + 10000
+        ends = []
+        for _, pulses in frames:
+            edges = [t]
+            for p in pulses:
+                edges.append(edges[-1] + p)
+            for i, te in enumerate(edges):
+                level = i % 2 # falling edge first: a mark pulls the output low
+                sim.clock.call_at(te, lambda level=level: sim.drive_pin(_IR_PIN, level))
+            capture.frames.append((edges[-1], pulses))
+            ends.append(edges[-1])
+            t = edges[-1] + _GAP_US
+        sim.run_for((t - sim.clock.now_us) * 1e-6)
+        rx.stop()
+
+    # match every event to the frame that ended last before it
+    results = []
+    for (when, cmd), kind in [(e, 'key') for e in events] + [(e, 'error') for e in errors]:
+        i = max((k for k, end in enumerate(ends) if end <= when), default=None)
+        if i != None:
+            results.append((i, kind, cmd, (when - ends[i]) / 1000))
+    results.sort()
+    return results, irqs[0] + capture.reads
+
+
+def replay(frames):
+    # decode the frames with both backends, returns one dict per backend
+    report = {}
+    for backend in ('pin', 'rmt'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            results, callbacks = _run(frames, backend)
+        decoded = {}
+        for i, kind, cmd, delay in results:
+            decoded.setdefault(i, (kind, cmd, delay))
+        correct = 0
+        for i, (expected, _) in enumerate(frames):
+            kind, cmd, _ = decoded.get(i, (None, None, 0))
+            if (expected == ERROR and kind != 'key') or (kind == 'key' and cmd == expected):
+                correct += 1
+        delays = [d for _, _, d in decoded.values()]
+        report[backend] = {
+            'decoded': [decoded.get(i) for i in range(len(frames))],
+            'correct': correct,
+            'callbacks': callbacks,
+            'delay_ms_max': max(delays) if delays else 0,
+        }
+    return report
+
+
+def main(args):
+    if len(args) > 1:
+        sys.exit('usage: python -m sim.ir [RAW_FILE]')
+    if args:
+        frames = load_raw(args[0])
+    else:
+        with Simulation(World()):
+            frames = demo_frames()
+    report = replay(frames)
+    known = sum(1 for expected, _ in frames if expected != None)
+    same = sum(1 for a, b in zip(report['pin']['decoded'], report['rmt']['decoded'])
+               if (a and a[:2]) == (b and b[:2]))
+    print('{} frames, {} with a known result, {} decoded the same by both backends'.format(
+        len(frames), known, same))
+    print('{:>7}  {:>10}  {:>10}  {:>10}'.format('backend', 'correct', 'callbacks', 'delay_ms'))
+    for backend, r in report.items():
+        print('{:>7}  {:>10}  {:>10}  {:>10.1f}'.format(backend, r['correct'], r['callbacks'], r['delay_ms_max']))
+    print()
+    for i, (expected, pulses) in enumerate(frames):
+        cells = []
+        for backend in report:
+            d = report[backend]['decoded'][i]
+            cells.append('-' if d == None else '{} 0x{:02x}'.format(d[0], d[1] & 0xff) if d[0] == 'key'
+                         else 'error {}'.format(d[1]))
+        print('{:3d} {:>5} pulses  expected {:>5}  pin: {:<12} rmt: {}'.format(
+            i, len(pulses), '?' if expected == None else 'error' if expected == ERROR else '0x{:02x}'.format(expected),
+            *cells))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,316 @@
+"""
+Replay of recorded MPU6050 logs (rover_mpulog) through rover_motion.Motion.
+
+    python -m sim.replay                     # record a log on the simulator and replay it
+    python -m sim.replay turn.rml tilt.rml   # logs recorded on the robot
+    python -m sim.replay --record demo.rml   # only write the simulated log
+    python -m sim.replay --json out.json turn.rml
+    python -m sim.replay --filter mahony turn.rml    # update() with Motion.set_filter('mahony')
+
+The frames are served by a fake MPU6050 at their recorded times, so Motion
+decodes and filters them with its own code: update() (complementary filter),
+updateZ() and is_shaked(). The first samples of a log must be taken with the
+robot still, they calibrate the offsets like on the robot.
+
+For every ground truth segment the report gives the error of angleZ from
+update() and updateZ(), of angleX (with its settle time to within 1 degree),
+the largest tilt (angleX/angleY) seen while still and the share of
+is_shaked() calls that fired. Cost is host time per call and
+the bytes allocated by CPython inside a call (peak, tracemalloc): they do not
+match the robot, but a change that makes a path slower or allocating shows.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sim.runtime import Simulation, MPU6050_ADDR
+from sim.world import World
+
+_KIND_NAMES = {1: 'still', 2: 'turn', 3: 'tilt', 4: 'shake'}
+_SETTLE_DEG = 1.0
+_ALLOC_SAMPLES = 500 # calls measured with tracemalloc, it is slow
+
+
+class LogMPU6050:
+    """
+    Fake MPU6050 answering data reads with a recorded frame: the current one
+    set by the replay loop, or the next frame of `stream` on every read.
+    GYRO_CONFIG/ACCEL_CONFIG keep the recorded ranges whatever Motion writes,
+    so the frames decode with the scale they were taken with.
+    """
+    def __init__(self, gyro_config, accel_config):
+        self.regs = bytearray(128)
+        self.regs[0x1B] = gyro_config
+        self.regs[0x1C] = accel_config
+        self.regs[0x75] = 0x68 # WHO_AM_I
+        self.frame = bytes(14)
+        self.stream = None
+
+    def read_into(self, buf):
+        self.read_mem_into(0x75, buf)
+
+    def read_mem_into(self, reg, buf):
+        if 0x3B <= reg <= 0x48 and self.stream != None:
+            self.frame = next(self.stream, self.frame)
+        for i in range(len(buf)):
+            r = reg + i
+            buf[i] = self.frame[r - 0x3B] if 0x3B <= r <= 0x48 else self.regs[r & 0x7f]
+
+    def write(self, data):
+        reg = data[0]
+        for i, v in enumerate(data[1:]):
+            r = (reg + i) & 0x7f
+            if r != 0x1B and r != 0x1C:
+                self.regs[r] = v
+
+
+def record_demo(path, rate_hz=200):
+    # Log of the simulated robot with the segments of every kind: still,
+    # a left turn, tilting forward and back, shaking. Returns the path.
+    path = os.path.abspath(path)
+    with Simulation(World()) as sim, contextlib.redirect_stdout(io.StringIO()):
+        rover = sim.import_rover()
+        import rover_mpulog as ml
+        from rover_motion import Motion
+        motion = Motion(sim.bus, MPU6050_ADDR)
+        log = ml.MotionLog(motion, path)
+        mpu = sim.mpu
+
+        def run(seconds):
+            for _ in range(int(seconds * rate_hz)):
+                log.sample()
+                sim.run_for(1.0 / rate_hz)
+
+        log.begin_segment(ml.SEG_STILL)
+        run(2.0)
+        log.end_segment()
+
+        log.begin_segment(ml.SEG_TURN)
+        h0 = sim.world.heading_deg()
+        rover.set_wheel_speed(-40, 40)
+        run(1.0)
+        rover.stop()
+        run(0.5)
+        log.end_segment(sim.world.heading_deg() - h0)
+
+        log.begin_segment(ml.SEG_STILL)
+        run(1.0)
+        log.end_segment()
+
+        for rate in (40.0, -40.0):
+            # 20 degrees nose up in 0.5s, then back
+            log.begin_segment(ml.SEG_TILT)
+            mpu.tilt_rate = rate
+            run(0.5)
+            mpu.tilt_rate = 0.0
+            run(1.5)
+            log.end_segment(mpu.tilt)
+
+        log.begin_segment(ml.SEG_SHAKE)
+        mpu.shake = 0.8
+        run(1.0)
+        mpu.shake = 0.0
+        log.end_segment()
+
+        log.begin_segment(ml.SEG_STILL)
+        run(1.0)
+        log.end_segment()
+        log.close()
+    return path
+
+
+def _segments(records):
+    # [(kind, truth, first sample, end sample)] from the marks between the samples
+    segments = []
+    n = 0
+    start = None
+    for r in records:
+        if len(r) == 2:
+            n += 1
+        elif r[1]:
+            start = (r[1], n)
+        elif start != None:
+            segments.append((start[0], r[2], start[1], n))
+            start = None
+    return segments
+
+
+def _call_cost(fn):
+    t = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t) * 1e6
+
+def _call_alloc(fn):
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    fn()
+    return tracemalloc.get_traced_memory()[1] - before
+
+
+def replay(path, calib_samples=200, filter='complementary', **gains):
+    path = os.path.abspath(path)
+    with Simulation(World(), cpu_us=0, mpu=False, pcf=False) as sim:
+        from rover_mpulog import read_log
+        gyro_config, accel_config, records = read_log(path)
+        samples = [r for r in records if len(r) == 2]
+        if len(samples) <= calib_samples:
+            raise ValueError('{}: {} samples, need more than {}'.format(path, len(samples), calib_samples))
+        segments = _segments(records)
+
+        sim.bus.overhead_us = 0
+        sim.bus.freq = 1e15 # reads take no virtual time, the log has the real ones
+        dev = LogMPU6050(gyro_config, accel_config)
+        sim.bus.add(MPU6050_ADDR, dev)
+        from rover_motion import Motion
+        full = Motion(sim.bus, MPU6050_ADDR)
+        full.set_filter(filter, **gains)
+        gyro_z = Motion(sim.bus, MPU6050_ADDR)
+        calib = [f for _, f in samples[:calib_samples]]
+        for m in (full, gyro_z):
+            dev.stream = iter(calib)
+            m.calibrate(len(calib))
+        dev.stream = None
+
+        base = sim.clock.now_us - samples[0][0]
+        sim.clock.advance_to(base + samples[0][0])
+        full.begin()
+        gyro_z.begin()
+        angle_x = []
+        angle_y = []
+        angle_z = []
+        angle_z_only = []
+        cost = {'update': [], 'updateZ': []}
+        for t, frame in samples:
+            sim.clock.advance_to(base + t)
+            dev.frame = frame
+            cost['update'].append(_call_cost(full.update))
+            cost['updateZ'].append(_call_cost(gyro_z.updateZ))
+            angle_x.append(full.angleX)
+            angle_y.append(full.angleY)
+            angle_z.append(full.angleZ)
+            angle_z_only.append(gyro_z.angleZ)
+
+        # second pass for the allocations, on frames already replayed: only
+        # the call is measured, the angles it produces are not used
+        alloc = {'update': [], 'updateZ': []}
+        tracemalloc.start()
+        try:
+            for t, frame in samples[:_ALLOC_SAMPLES]:
+                sim.clock.advance_to(base + t)
+                dev.frame = frame
+                alloc['update'].append(_call_alloc(full.update))
+                alloc['updateZ'].append(_call_alloc(gyro_z.updateZ))
+        finally:
+            tracemalloc.stop()
+
+        rows = []
+        for kind, truth, i0, i1 in segments:
+            if i1 <= i0:
+                continue
+            def delta(trace):
+                return trace[i1 - 1] - (trace[i0 - 1] if i0 else 0.0)
+            row = {
+                'kind': _KIND_NAMES.get(kind, str(kind)),
+                'seconds': (samples[i1 - 1][0] - samples[i0][0]) * 1e-6,
+                'truth': truth,
+            }
+            if kind in (1, 2): # still, turn: rotation around Z
+                row['z_update_err'] = delta(angle_z) - truth
+                row['z_updateZ_err'] = delta(angle_z_only) - truth
+            if kind == 1:
+                row['still_tilt'] = max(max(abs(a) for a in angle_x[i0:i1]),
+                                        max(abs(a) for a in angle_y[i0:i1]))
+            if kind == 3:
+                row['x_err'] = angle_x[i1 - 1] - truth
+                settled = i0
+                for i in range(i0, i1):
+                    if abs(angle_x[i] - truth) > _SETTLE_DEG:
+                        settled = i + 1
+                row['x_settle_ms'] = ((samples[settled][0] if settled < i1 else samples[i1 - 1][0])
+                                      - samples[i0][0]) * 1e-3
+            if kind in (1, 4): # is_shaked must fire while shaken only
+                dev.stream = iter([f for _, f in samples[i0:i1]])
+                calls = (i1 - i0) // 10
+                fired = sum(1 for _ in range(calls) if full.is_shaked(avg_count=10))
+                dev.stream = None
+                row['shaked_pct'] = 100.0 * fired / calls if calls else 0.0
+            rows.append(row)
+
+    return {
+        'log': path,
+        'filter': filter,
+        'samples': len(samples),
+        'seconds': (samples[-1][0] - samples[0][0]) * 1e-6,
+        'bytes_per_sample': os.path.getsize(path) / len(samples),
+        'cost_us': {k: {'mean': sum(v) / len(v), 'max': max(v)} for k, v in cost.items()},
+        'alloc_bytes': {k: {'mean': sum(v) / len(v), 'max': max(v)} for k, v in alloc.items()},
+        'segments': rows,
+    }
+
+
+def _fmt(v):
+    if v == None:
+        return '{:>10}'.format('-')
+    return '{:>10.2f}'.format(v) if isinstance(v, float) else '{:>10}'.format(v)
+
+def report(result):
+    print('{}: {} samples, {:.1f}s, {:.1f} bytes/sample, {} filter'.format(
+        result['log'], result['samples'], result['seconds'], result['bytes_per_sample'], result['filter']))
+    header = ('kind', 'seconds', 'truth', 'z_upd_err', 'z_updZ_err', 'x_err', 'settle_ms', 'still_tilt', 'shaked_%')
+    keys = ('kind', 'seconds', 'truth', 'z_update_err', 'z_updateZ_err', 'x_err', 'x_settle_ms', 'still_tilt',
+            'shaked_pct')
+    print('  '.join('{:>10}'.format(h) for h in header))
+    for row in result['segments']:
+        print('  '.join(_fmt(row.get(k)) for k in keys))
+    for name in ('update', 'updateZ'):
+        c = result['cost_us'][name]
+        a = result['alloc_bytes'][name]
+        print('{:>8}: host us/call {:.1f} (max {:.1f}), CPython alloc bytes/call {:.0f} (max {})'.format(
+            name, c['mean'], c['max'], a['mean'], a['max']))
+    print()
+
+
+def main(args):
+    json_path = None
+    filter = 'complementary'
+    if args[:1] == ['--record']:
+        if len(args) != 2:
+            sys.exit('usage: python -m sim.replay --record LOG')
+        record_demo(args[1])
+        return
+    if args[:1] == ['--json']:
+        if len(args) < 2:
+            sys.exit('usage: python -m sim.replay --json OUT [LOG...]')
+        json_path = args[1]
+        args = args[2:]
+    if args[:1] == ['--filter']:
+        if len(args) < 2:
+            sys.exit('usage: python -m sim.replay --filter complementary|mahony|madgwick [LOG...]')
+        filter = args[1]
+        args = args[2:]
+
+    logs = args
+    tmp = None
+    if not logs:
+        tmp = tempfile.mkdtemp(prefix='rover_replay_')
+        logs = [record_demo(os.path.join(tmp, 'demo.rml'))]
+    try:
+        results = [replay(path, filter=filter) for path in logs]
+    finally:
+        if tmp != None:
+            for name in os.listdir(tmp):
+                os.remove(os.path.join(tmp, name))
+            os.rmdir(tmp)
+    for result in results:
+        report(result)
+    if json_path != None:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
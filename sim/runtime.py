@@ -0,0 +1,167 @@
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sim.clock import Clock, SimulationEnd
+from sim.devices import SimBus, SimMPU6050, SimPCF8574, SimSonar
+from sim.world import World
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakes')
+
+# pin numbers used by rover.py
+MOTOR_PINS = {12: ('left', 'fwd'), 2: ('left', 'back'), 10: ('right', 'fwd'), 15: ('right', 'back')}
+SONAR_TRIGGER_PIN = 13
+SONAR_ECHO_PIN = 14
+PCF8574_ADDR = 0x23
+MPU6050_ADDR = 0x68
+MPU6050_INT_PIN = 1 # GPIO the simulated MPU6050 INT pin is wired to
+
+# modules of the robot, imported again for every simulation
+_ROBOT_MODULES = ('machine', 'micropython', 'utime', 'yolobit', 'neopixel', 'utility',
+                  'uasyncio', 'music', 'ubinascii')
+
+sim = None # the active Simulation, used by the fake modules
+
+
+def _install():
+    for path in (FAKES, ROOT):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    # MicroPython additions to the time module, on virtual time
+    time.ticks_ms = lambda: sim.clock.tick() // 1000
+    time.ticks_us = lambda: sim.clock.tick()
+    time.ticks_cpu = time.ticks_us
+    time.ticks_diff = lambda a, b: a - b
+    time.ticks_add = lambda a, b: a + b
+    time.sleep = lambda s: sim.clock.advance(s * 1e6)
+    time.sleep_ms = lambda ms: sim.clock.advance(ms * 1000)
+    time.sleep_us = lambda us: sim.clock.advance(us)
+    time.time_ns = lambda: sim.clock.tick() * 1000
+    if not hasattr(gc, 'mem_alloc'):
+        gc.mem_alloc = lambda: 0
+        gc.mem_free = lambda: 0
+
+
+class Simulation:
+    """
+    One simulated robot: virtual clock, world, I2C bus with the MPU6050 and
+    PCF8574, the ultrasonic sensor and the fake MicroPython modules.
+
+        with Simulation(World(line=CircleLine())) as s:
+            rover = s.import_rover()
+            rover.follow_line(30, 5)
+
+    rover.py and friends are imported fresh, so their module level objects
+    (the Rover instance, the I2C bus singleton...) belong to this simulation.
+    It runs in a temporary directory, where the gyro calibration is saved.
+    """
+    def __init__(self, world=None, i2c_freq=400000, cpu_us=2, gyro_bias=0.5, mpu=True, pcf=True):
+        global sim
+        _install()
+        self.clock = Clock(cpu_us)
+        self.world = world if world != None else World()
+        self.clock.on_advance(self.world.step)
+        self.bus = SimBus(self.clock, i2c_freq)
+        self.mpu = None
+        self.pcf = None
+        if mpu:
+            self.mpu = SimMPU6050(self.world, self.clock, gyro_bias)
+            self.mpu.on_interrupt = self.__mpu_interrupt
+            self.bus.add(MPU6050_ADDR, self.mpu)
+        if pcf:
+            self.pcf = SimPCF8574(self.world)
+            self.bus.add(PCF8574_ADDR, self.pcf)
+
+        self.pins = {} # pin number -> fake machine.Pin
+        self.timers = {} # timer id -> active clock entry
+        self.yolobit = None
+        self._watchers = {}
+        self.sonar = SimSonar(self, SONAR_TRIGGER_PIN, SONAR_ECHO_PIN)
+
+        for name in list(sys.modules):
+            if name in _ROBOT_MODULES or name.startswith('rover') or name == 'main':
+                del sys.modules[name]
+        sim = self
+
+        self._cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp(prefix='rover_sim_')
+        os.chdir(self.workdir)
+
+    def close(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # hooks for the fake modules
+
+    def watch_pin(self, pin, fn):
+        # fn(value) when the program writes the pin
+        self._watchers[pin] = fn
+
+    def pin_written(self, pin, value):
+        fn = self._watchers.get(pin)
+        if fn != None:
+            fn(value)
+
+    def drive_pin(self, pin, value):
+        # an input pin changed: set its level and run its IRQ handler
+        p = self.pins.get(pin)
+        if p != None:
+            p.set_level(value)
+
+    def __mpu_interrupt(self):
+        # 50us pulse on the INT pin, its IRQ handler runs like a scheduled one
+        self.clock.call_later(0, lambda: self.drive_pin(MPU6050_INT_PIN, 1))
+        self.clock.call_later(50, lambda: self.drive_pin(MPU6050_INT_PIN, 0))
+
+    def pwm_created(self, pin, pwm):
+        wheel = MOTOR_PINS.get(pin)
+        if wheel != None:
+            motor = self.world.left if wheel[0] == 'left' else self.world.right
+            if wheel[1] == 'fwd':
+                motor.pwm_fwd = pwm
+            else:
+                motor.pwm_back = pwm
+
+    # running code
+
+    def now(self):
+        # virtual time in seconds
+        return self.clock.now_us * 1e-6
+
+    def run_for(self, seconds):
+        self.clock.advance(seconds * 1e6)
+
+    def import_rover(self):
+        import rover
+        return rover.rover
+
+    def run_main(self, seconds, path=None):
+        # run main.py until `seconds` of virtual time have passed, returns its globals
+        path = path or os.path.join(ROOT, 'main.py')
+        with open(path) as f:
+            code = compile(f.read(), path, 'exec')
+        env = {'__name__': '__main__'}
+        self.clock.deadline_us = self.clock.now_us + int(seconds * 1e6)
+        try:
+            exec(code, env)
+        except SimulationEnd:
+            pass
+        finally:
+            self.clock.deadline_us = None
+        return env
+
+    def press_button_a(self):
+        button = self.yolobit.button_a
+        if button.on_pressed:
+            button.on_pressed()
@@ -0,0 +1,68 @@
+"""
+Decoder of the telemetry files written by rover_telemetry on the robot.
+
+    python -m sim.telemetry telemetry.bin            # CSV on stdout
+    python -m sim.telemetry telemetry.bin turn.csv
+
+    from sim.telemetry import load, to_numpy
+    columns = load('telemetry.bin')        # dict of lists
+    arrays = to_numpy('telemetry.bin')     # dict of numpy arrays (numpy needed)
+
+Columns: t_ms (from the first record, ticks wrap-around undone), heading_deg,
+m1, m2 (wheel speeds), line (sensor bits, bit 0 leftmost, 255 without sensors),
+tag (loop that recorded), distance_cm.
+"""
+import csv
+import sys
+
+from sim.runtime import _install
+
+_install() # rover_telemetry imports MicroPython modules
+import rover_telemetry
+
+COLUMNS = ('t_ms', 'heading_deg', 'm1', 'm2', 'line', 'tag', 'distance_cm')
+_TICKS_PERIOD = 1 << 30 # MicroPython ticks_us wraps at 2**30
+
+
+def load(path):
+    columns = {name: [] for name in COLUMNS}
+    t = 0
+    last = None
+    for ticks, heading, m1, m2, line, tag, distance in rover_telemetry.read_telemetry(path):
+        if last != None:
+            t += (ticks - last) % _TICKS_PERIOD
+        last = ticks
+        columns['t_ms'].append(t / 1000)
+        columns['heading_deg'].append(heading / 100)
+        columns['m1'].append(m1)
+        columns['m2'].append(m2)
+        columns['line'].append(line)
+        names = rover_telemetry.TAG_NAMES
+        columns['tag'].append(names[tag] if tag < len(names) else str(tag))
+        columns['distance_cm'].append(distance / 10)
+    return columns
+
+def to_numpy(path):
+    import numpy as np
+    columns = load(path)
+    return {name: np.array(values) for name, values in columns.items()}
+
+def to_csv(path, out):
+    columns = load(path)
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    for row in zip(*(columns[name] for name in COLUMNS)):
+        writer.writerow(row)
+
+
+def main(args):
+    if len(args) not in (1, 2):
+        sys.exit('usage: python -m sim.telemetry TELEMETRY_FILE [CSV_FILE]')
+    if len(args) == 1:
+        to_csv(args[0], sys.stdout)
+    else:
+        with open(args[1], 'w', newline='') as f:
+            to_csv(args[0], f)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,149 @@
+import math
+import random
+
+
+class StraightLine:
+    # black line along the x axis
+    def __init__(self, width=0.02):
+        self.width = width
+
+    def is_black(self, x, y):
+        return abs(y) <= self.width / 2
+
+
+class CircleLine:
+    # black ring of the given radius around (0, radius), so the robot starts on it heading +x
+    def __init__(self, radius=0.4, width=0.02):
+        self.radius = radius
+        self.width = width
+
+    def is_black(self, x, y):
+        return abs(math.hypot(x, y - self.radius) - self.radius) <= self.width / 2
+
+
+class Box:
+    # walls of an axis aligned box, for the ultrasonic sensor
+    def __init__(self, x_min=-1.0, y_min=-1.0, x_max=1.0, y_max=1.0):
+        self.x_min, self.y_min, self.x_max, self.y_max = x_min, y_min, x_max, y_max
+
+    def inside(self, x, y):
+        return self.x_min <= x <= self.x_max and self.y_min <= y <= self.y_max
+
+    def distance(self, x, y, heading):
+        # distance along heading to the first wall, None if outside the box
+        c = math.cos(heading)
+        s = math.sin(heading)
+        best = None
+        for t in ((self.x_max - x) / c if c > 1e-9 else None,
+                  (self.x_min - x) / c if c < -1e-9 else None,
+                  (self.y_max - y) / s if s > 1e-9 else None,
+                  (self.y_min - y) / s if s < -1e-9 else None):
+            if t != None and t >= 0 and (best == None or t < best):
+                best = t
+        return best
+
+
+class Motor:
+    """
+    DC motor driven by two PWM channels (forward, backward). Below min_duty
+    the wheel does not turn, above it the speed is linear in the duty, reached
+    with a first order lag of tau seconds.
+    """
+    def __init__(self, max_speed=0.6, min_duty=40, tau=0.08, gain=1.0):
+        self.max_speed = max_speed # m/s at full duty
+        self.min_duty = min_duty
+        self.tau = tau
+        self.gain = gain
+        self.pwm_fwd = None
+        self.pwm_back = None
+        self.speed = 0.0
+
+    def target_speed(self):
+        fwd = self.pwm_fwd.duty() if self.pwm_fwd else 0
+        back = self.pwm_back.duty() if self.pwm_back else 0
+        duty = fwd - back
+        if abs(duty) <= self.min_duty:
+            return 0.0
+        v = (abs(duty) - self.min_duty) / (1023 - self.min_duty) * self.max_speed * self.gain
+        return v if duty > 0 else -v
+
+    def step(self, dt):
+        self.speed += (self.target_speed() - self.speed) * min(1.0, dt / self.tau)
+
+
+class World:
+    """
+    Rover on a plane: two driven wheels (m1 left, m2 right), heading in
+    radians counter-clockwise from +x, like the MPU6050 Z axis.
+    The 4 line sensors sit sensor_ahead in front of the axle, sensor_pitch apart.
+    With walls, the front of the robot (sonar_ahead) stops at them: the wheels
+    lose their speed at once, like in a collision.
+    """
+    def __init__(self, line=None, walls=None, seed=1):
+        self.track = 0.12 # m between the wheels
+        self.sensor_ahead = 0.06
+        self.sensor_pitch = 0.012
+        self.sonar_ahead = 0.07
+        self.left = Motor()
+        self.right = Motor()
+        self.line = line
+        self.walls = walls
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        self.x = x
+        self.y = y
+        self.heading = heading # unwrapped, radians
+        self.yaw_rate = 0.0 # rad/s
+        self.distance = 0.0 # m travelled
+        self.contacts = 0 # collisions with the walls
+        self.blocked = False
+        self.left.speed = self.right.speed = 0.0
+
+    def step(self, dt):
+        self.left.step(dt)
+        self.right.step(dt)
+        v = (self.left.speed + self.right.speed) / 2
+        self.yaw_rate = (self.right.speed - self.left.speed) / self.track
+        self.heading += self.yaw_rate * dt
+        x = self.x + v * math.cos(self.heading) * dt
+        y = self.y + v * math.sin(self.heading) * dt
+        if self.walls != None and not self.walls.inside(x + self.sonar_ahead * math.cos(self.heading),
+                                                        y + self.sonar_ahead * math.sin(self.heading)):
+            if not self.blocked:
+                self.contacts += 1
+            self.blocked = True
+            self.left.speed = self.right.speed = 0.0
+            return
+        self.blocked = False
+        self.x = x
+        self.y = y
+        self.distance += abs(v) * dt
+
+    def heading_deg(self):
+        return math.degrees(self.heading)
+
+    def line_sensors(self):
+        # 4 bits, bit 0 the leftmost sensor, 1 = black line under it
+        if self.line == None:
+            return 0
+        c = math.cos(self.heading)
+        s = math.sin(self.heading)
+        bits = 0
+        for i in range(4):
+            # lateral offset, positive to the left of the robot
+            lat = (1.5 - i) * self.sensor_pitch
+            x = self.x + self.sensor_ahead * c - lat * s
+            y = self.y + self.sensor_ahead * s + lat * c
+            if self.line.is_black(x, y):
+                bits |= 1 << i
+        return bits
+
+    def obstacle_distance(self):
+        # m from the ultrasonic sensor to the wall it faces, None if nothing in range
+        if self.walls == None:
+            return None
+        x = self.x + self.sonar_ahead * math.cos(self.heading)
+        y = self.y + self.sonar_ahead * math.sin(self.heading)
+        return self.walls.distance(x, y, self.heading)